@@ -1,13 +1,45 @@
+import array
+import collections
+import concurrent.futures
+import errno
 import eventlet.hubs.hub
+import functools
 import greenlet
+import heapq
+import io
 import logging
+import math
+import numbers
 import signal
 import sys
+import time
+import traceback
+import weakref
+os = eventlet.patcher.original('os')
+select = eventlet.patcher.original('select')
 socket = eventlet.patcher.original('socket')
 threading = eventlet.patcher.original('threading')
+try:
+    _queue = eventlet.patcher.original('queue')
+except ImportError:
+    # Python 2
+    _queue = eventlet.patcher.original('Queue')
 
 logger = logging.getLogger('aioeventlet')
 
+if hasattr(threading, 'get_ident'):
+    _get_thread_ident = threading.get_ident
+else:
+    # Python 2
+    _get_thread_ident = threading._get_ident
+
+try:
+    StopAsyncIteration = StopAsyncIteration
+except NameError:
+    # Python < 3.5
+    class StopAsyncIteration(Exception):
+        pass
+
 try:
     import asyncio
 
@@ -29,11 +61,7 @@ if eventlet.patcher.is_monkey_patched('socket'):
     # threading.current_thread().
     asyncio.base_events.socket = socket
     asyncio.base_events.threading = threading
-    if hasattr(threading, 'get_ident'):
-        asyncio.base_events._get_thread_ident = threading.get_ident
-    else:
-        # Python 2
-        asyncio.base_events._get_thread_ident = threading._get_ident
+    asyncio.base_events._get_thread_ident = _get_thread_ident
     asyncio.events.threading = threading
     if sys.platform == 'win32':
         asyncio.windows_events.socket = socket
@@ -56,39 +84,413 @@ _EVENT_WRITE = asyncio.selectors.EVENT_WRITE
 _HUB_READ = eventlet.hubs.hub.READ
 _HUB_WRITE = eventlet.hubs.hub.WRITE
 
+# errno of non-blocking socket operations which would block
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+# errors of non-blocking socket operations when the socket is not ready
+_NOT_READY = _WOULD_BLOCK + (errno.EINPROGRESS,)
+
+try:
+    import ssl
+    _SSLSocket = ssl.SSLSocket
+except ImportError:
+    _SSLSocket = ()
+
+if hasattr(asyncio, 'SendfileNotAvailableError'):
+    _SendfileNotAvailableError = asyncio.SendfileNotAvailableError
+else:
+    # Python older than 3.7
+    class _SendfileNotAvailableError(RuntimeError):
+        pass
+
 # Eventlet 0.15 or newer?
 _EVENTLET15 = hasattr(eventlet.hubs.hub.noop, 'mark_as_closed')
 
 
-class _TpoolExecutor(object):
-    def __init__(self, loop):
-        import eventlet.tpool
+class _BoundedExecutor(object):
+    """Base class of executors running functions in greenthreads.
+
+    submit() does not block: each function is executed from a new
+    greenthread. At most max_workers functions are executed at the same
+    time, other functions wait in a queue of at most max_queued functions
+    (unlimited if max_queued is None).
+
+    When the queue is full, rejection_policy decides what submit() does:
+
+    * 'abort': raise a RuntimeError
+    * 'caller_runs': call the function in the caller greenthread; when the
+      caller is a coroutine or a callback, the function blocks the event loop
+    * 'discard_oldest': cancel the oldest queued function
+    """
+
+    _REJECTION_POLICIES = ('abort', 'caller_runs', 'discard_oldest')
+
+    def __init__(self, loop, max_workers, max_queued=None,
+                 rejection_policy='abort'):
+        if max_workers <= 0:
+            raise ValueError("max_workers must be greater than 0")
+        if max_queued is not None and max_queued < 0:
+            raise ValueError("max_queued must be positive or None")
+        if rejection_policy not in self._REJECTION_POLICIES:
+            raise ValueError("invalid rejection policy: %r"
+                             % (rejection_policy,))
         self._loop = loop
-        self._tpool = eventlet.tpool
+        self._max_workers = max_workers
+        self._max_queued = max_queued
+        self._rejection_policy = rejection_policy
+        # queue of (future, fn, args, kwargs, submit_time) tuples waiting
+        # for a worker
+        self._pending = collections.deque()
+        self._running = 0
+        self._shutdown = False
+        # eventlet.event.Event() used by shutdown() to wait until all
+        # functions completed
+        self._idle_event = None
+        # statistics
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+
+    def _spawn(self, func, *args):
+        raise NotImplementedError
+
+    def _execute(self, fn, args, kwargs):
+        raise NotImplementedError
 
     def submit(self, fn, *args, **kwargs):
+        if self._shutdown:
+            raise RuntimeError('cannot schedule new futures after shutdown')
         f = asyncio.Future(loop=self._loop)
+        if (self._max_queued is not None
+        and self._running >= self._max_workers
+        and len(self._pending) >= self._max_queued):
+            self._rejected += 1
+            if self._rejection_policy == 'abort':
+                raise RuntimeError("executor queue is full")
+            elif self._rejection_policy == 'caller_runs':
+                self._call(f, fn, args, kwargs)
+                return f
+            else:
+                # discard_oldest
+                if not self._pending:
+                    # max_queued is 0: the new function is the oldest
+                    f.cancel()
+                    return f
+                self._pending.popleft()[0].cancel()
+        self._pending.append((f, fn, args, kwargs, self._loop.time()))
+        self._start_workers()
+        return f
+
+    def _start_workers(self):
+        while self._pending and self._running < self._max_workers:
+            f, fn, args, kwargs, submit_time = self._pending.popleft()
+            if f.cancelled():
+                continue
+            wait_time = self._loop.time() - submit_time
+            self._wait_time += wait_time
+            self._max_wait_time = max(self._max_wait_time, wait_time)
+            self._running += 1
+            self._spawn(self._run, f, fn, args, kwargs)
+
+    def _call(self, f, fn, args, kwargs):
         try:
-            res = self._tpool.execute(fn, *args, **kwargs)
+            res = fn(*args, **kwargs)
         except Exception as exc:
+            self._failed += 1
             f.set_exception(exc)
         else:
+            self._completed += 1
             f.set_result(res)
-        return f
+
+    def _run(self, f, fn, args, kwargs):
+        try:
+            try:
+                res = self._execute(fn, args, kwargs)
+            except Exception as exc:
+                self._failed += 1
+                if not f.cancelled() and not self._loop.is_closed():
+                    f.set_exception(exc)
+            else:
+                self._completed += 1
+                if not f.cancelled() and not self._loop.is_closed():
+                    f.set_result(res)
+        finally:
+            self._running -= 1
+            self._start_workers()
+            if (self._idle_event is not None
+            and not self._running and not self._pending
+            and not self._idle_event.ready()):
+                self._idle_event.send()
+
+    def get_stats(self):
+        """Get statistics of the executor as a dictionary."""
+        started = self._completed + self._failed + self._running
+        if started:
+            mean_wait_time = self._wait_time / started
+        else:
+            mean_wait_time = 0.0
+        return {
+            'max_workers': self._max_workers,
+            'max_queued': self._max_queued,
+            'queued': len(self._pending),
+            'running': self._running,
+            'completed': self._completed,
+            'failed': self._failed,
+            'rejected': self._rejected,
+            'mean_wait_time': mean_wait_time,
+            'max_wait_time': self._max_wait_time,
+        }
+
+    def shutdown(self, wait=True):
+        """Stop accepting new functions.
+
+        If wait is true, wait until queued and running functions complete.
+        Otherwise, cancel queued functions.
+        """
+        if (wait and (self._running or self._pending)
+        and eventlet.getcurrent() is eventlet.hubs.get_hub().greenlet):
+            # the hub runs the functions: it cannot wait for them
+            raise RuntimeError("shutdown(wait=True) must not be called "
+                               "from the hub greenlet")
+        self._shutdown = True
+        if wait:
+            if self._running or self._pending:
+                self._idle_event = eventlet.event.Event()
+                try:
+                    self._idle_event.wait()
+                finally:
+                    self._idle_event = None
+        else:
+            while self._pending:
+                self._pending.popleft()[0].cancel()
+
+
+class _TpoolExecutor(_BoundedExecutor):
+    """Executor running functions in a pool of native threads.
+
+    Each executor has its own threads, started on demand: at most
+    max_workers threads (default: size of the eventlet thread pool). Worker
+    threads send results to the waiting greenthreads through a socket pair
+    watched by a hub listener, so results are received even if the event
+    loop is blocked.
+    """
+
+    def __init__(self, loop, max_workers=None, max_queued=None,
+                 rejection_policy='abort'):
+        if max_workers is None:
+            import eventlet.tpool
+            max_workers = getattr(eventlet.tpool, '_nthreads', 20)
+        super(_TpoolExecutor, self).__init__(loop, max_workers, max_queued,
+                                             rejection_policy)
+        self._threads = []
+        # queue of (event, fn, args, kwargs) tuples, None stops a thread
+        self._jobs = _queue.Queue()
+        # (event, ok, result) tuples of completed functions, filled by
+        # worker threads
+        self._results = collections.deque()
+        # number of functions sent to worker threads without result yet
+        self._in_flight = 0
+        self._rsock = None
+        self._wsock = None
+        self._hub = None
+        self._listener = None
+
+    def _spawn(self, func, *args):
+        eventlet.spawn_n(func, *args)
+
+    def _execute(self, fn, args, kwargs):
+        if len(self._threads) < self._running:
+            thread = threading.Thread(target=self._worker)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        if self._listener is None:
+            self._listen()
+        event = eventlet.event.Event()
+        self._in_flight += 1
+        self._jobs.put((event, fn, args, kwargs))
+        ok, result = event.wait()
+        if not ok:
+            raise result
+        return result
+
+    def _worker(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            event, fn, args, kwargs = job
+            try:
+                result = (event, True, fn(*args, **kwargs))
+            except BaseException as exc:
+                result = (event, False, exc)
+            # release references in the thread before waiting for a new job
+            job = fn = args = kwargs = None
+            self._results.append(result)
+            try:
+                self._wsock.send(b'x')
+            except socket.error:
+                # the socket was closed: the result was already received
+                pass
+
+    def _listen(self):
+        if self._rsock is None:
+            self._rsock, self._wsock = socketpair()
+            self._rsock.setblocking(False)
+        self._hub = eventlet.hubs.get_hub()
+        fd = self._rsock.fileno()
+        if _EVENTLET15:
+            self._listener = self._hub.add(_HUB_READ, fd, self._read_results,
+                                           self._closed, self._closed)
+        else:
+            self._listener = self._hub.add(_HUB_READ, fd, self._read_results)
+
+    def _closed(self, *args):
+        # the socket pair is private: eventlet never obsoletes the listener
+        pass
+
+    def _read_results(self, fd):
+        # called by the hub when worker threads sent results
+        try:
+            self._rsock.recv(4096)
+        except socket.error:
+            pass
+        results = self._results
+        while results:
+            event, ok, result = results.popleft()
+            self._in_flight -= 1
+            event.send((ok, result))
+        if not self._in_flight:
+            self._hub.remove(self._listener)
+            self._listener = None
+            if self._shutdown:
+                self._close_socket()
+
+    def _close_socket(self):
+        if self._rsock is not None:
+            self._rsock.close()
+            self._wsock.close()
+            self._rsock = self._wsock = None
 
     def shutdown(self, wait=True):
-        self._tpool.killall()
+        super(_TpoolExecutor, self).shutdown(wait)
+        # threads exit once they completed their current function
+        for thread in self._threads:
+            self._jobs.put(None)
+        del self._threads[:]
+        if not self._in_flight:
+            self._close_socket()
+
+
+class GreenPoolExecutor(_BoundedExecutor):
+    """Executor running functions in a pool of greenthreads.
+
+    Functions are called in greenthreads of the thread of the event loop:
+    they must use green (non-blocking) I/O. At most max_workers functions
+    are executed at the same time.
+    """
+
+    def __init__(self, max_workers=1000, loop=None, max_queued=None,
+                 rejection_policy='abort'):
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        super(GreenPoolExecutor, self).__init__(loop, max_workers, max_queued,
+                                                rejection_policy)
+
+    def _spawn(self, func, *args):
+        # Don't use GreenPool.spawn_n(): when the pool is full, it calls the
+        # function in the current greenthread if it belongs to the pool, and
+        # _run() starts the next function when it completes. The number of
+        # workers is already limited by _start_workers().
+        eventlet.spawn_n(func, *args)
+
+    def _execute(self, fn, args, kwargs):
+        return fn(*args, **kwargs)
+
+
+class _Histogram(object):
+    """Histogram of non-negative integers in power of two buckets.
+
+    Bucket 0 counts zeros, bucket N counts values in [2**(N-1), 2**N - 1].
+    """
+
+    def __init__(self):
+        self._buckets = []
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        index = value.bit_length()
+        buckets = self._buckets
+        if index >= len(buckets):
+            buckets.extend([0] * (index + 1 - len(buckets)))
+        buckets[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def get_buckets(self):
+        """List of (low, high, count) tuples of the non-empty buckets."""
+        buckets = []
+        for index, count in enumerate(self._buckets):
+            if not count:
+                continue
+            if index:
+                low = 1 << (index - 1)
+                high = (1 << index) - 1
+            else:
+                low = high = 0
+            buckets.append((low, high, count))
+        return buckets
+
+    def as_dict(self):
+        if self.count:
+            mean = float(self.total) / self.count
+        else:
+            mean = 0.0
+        return {'count': self.count, 'total': self.total, 'max': self.max,
+                'mean': mean, 'buckets': self.get_buckets()}
+
+
+class _LoopStats(object):
+    """Counters of an event loop, see EventLoop.get_stats()."""
+
+    def __init__(self):
+        self.select_calls = 0
+        self.wakeups = {'ready': 0, 'self_pipe': 0, 'notify': 0,
+                        'timeout': 0}
+        self.spurious_wakeups = 0
+        self.ready_queue = _Histogram()
+        self.hub_time = 0.0
+        self.callback_time = 0.0
+        # hub-driven mode: end of the previous iteration
+        self.iteration_end = None
 
 
 class _Selector(asyncio.selectors._BaseSelectorImpl):
     def __init__(self, loop, hub):
         super(_Selector, self).__init__()
-        # fd => events
-        self._notified = {}
+        # Ready set: events notified by the hub indexed by file descriptor,
+        # and list of the notified file descriptors. Both are reused by all
+        # select() calls.
+        self._notified = array.array('B', [0]) * 1024
+        self._notified_fds = []
+        # list of (key, events) returned by select(), reused by all calls
+        self._ready = []
         self._loop = loop
         self._hub = hub
         # eventlet.event.Event() used by FD notifiers to wake up select()
         self._event = None
+        # hub timer waking up select() when its timeout expires
+        self._timer = None
+        # fd => hub listener of the selector
+        self._readers = {}
+        self._writers = {}
+        # file descriptor of the self-pipe, set by the event loop
+        self._self_pipe_fd = None
 
     def close(self):
         keys = list(self.get_map().values())
@@ -100,14 +502,19 @@ class _Selector(asyncio.selectors._BaseSelectorImpl):
         if event == _EVENT_READ:
             event_type = _HUB_READ
             func = self._notify_read
+            listeners = self._readers
         else:
             event_type = _HUB_WRITE
             func = self._notify_write
+            listeners = self._writers
 
         if _EVENTLET15:
-            self._hub.add(event_type, fd, func, self._throwback, None)
+            throwback = functools.partial(self._throwback, fd)
+            listener = self._hub.add(event_type, fd, func,
+                                     throwback, throwback)
         else:
-            self._hub.add(event_type, fd, func)
+            listener = self._hub.add(event_type, fd, func)
+        listeners[fd] = listener
 
     def register(self, fileobj, events, data=None):
         key = super(_Selector, self).register(fileobj, events, data)
@@ -119,30 +526,79 @@ class _Selector(asyncio.selectors._BaseSelectorImpl):
 
     def _remove(self, fd, event):
         if event == _EVENT_READ:
-            event_type = _HUB_READ
-        else:
-            event_type = _HUB_WRITE
-        try:
-            listener = self._hub.listeners[event_type][fd]
-        except KeyError:
-            pass
+            listeners = self._readers
         else:
+            listeners = self._writers
+        # Only remove our listener: if eventlet obsoleted it, the file
+        # descriptor may now be used by a listener of another greenthread
+        listener = listeners.pop(fd, None)
+        if listener is not None:
             self._hub.remove(listener)
 
     def unregister(self, fileobj):
         key = super(_Selector, self).unregister(fileobj)
         self._remove(key.fd, _EVENT_READ)
         self._remove(key.fd, _EVENT_WRITE)
+        self._discard_notified(key.fd, _EVENT_READ | _EVENT_WRITE)
         return key
 
+    def modify(self, fileobj, events, data=None):
+        key = self.get_key(fileobj)
+        if (not events) or (events & ~(_EVENT_READ | _EVENT_WRITE)):
+            raise ValueError("Invalid events: {0!r}".format(events))
+        if events == key.events and data == key.data:
+            return key
+
+        new_key = key._replace(events=events, data=data)
+        self._fd_to_key[key.fd] = new_key
+
+        # Only add or remove the hub listeners of the changed events
+        changed = events ^ key.events
+        for event in (_EVENT_READ, _EVENT_WRITE):
+            if not (changed & event):
+                continue
+            if events & event:
+                self._add(key.fd, event)
+            else:
+                self._remove(key.fd, event)
+                self._discard_notified(key.fd, event)
+        return new_key
+
     def _notify(self, fd, event):
-        if fd in self._notified:
-            self._notified[fd] |= event
+        notified = self._notified
+        try:
+            events = notified[fd]
+        except IndexError:
+            size = max(fd + 1, len(notified) * 2)
+            notified.extend(array.array('B', [0]) * (size - len(notified)))
+            events = 0
+        if not events:
+            self._notified_fds.append(fd)
+        notified[fd] = events | event
+        # wakeup the select() method
+        if fd == self._self_pipe_fd:
+            self._wakeup("self_pipe")
         else:
-            self._notified[fd] = event
-        if self._event is not None and not self._event.ready():
-            # wakeup the select() method
-            self._event.send("ready")
+            self._wakeup("ready")
+
+    def _discard_notified(self, fd, events):
+        # Forget notified events which are no more registered
+        if fd < len(self._notified):
+            self._notified[fd] &= ~events
+
+    def _wakeup(self, reason):
+        # must only be called from the thread of the event loop
+        if self._event is not None:
+            if not self._event.ready():
+                self._event.send(reason)
+                self._cancel_timer()
+        elif self._loop._hub_waiter is not None:
+            # hub-driven event loop: schedule an iteration
+            loop = self._loop
+            timer = loop._hub_timer
+            loop._schedule_iteration(0.0)
+            if loop._stats is not None and loop._hub_timer is not timer:
+                loop._stats.wakeups[reason] += 1
 
     def _notify_read(self, fd):
         self._notify(fd, _EVENT_READ)
@@ -150,55 +606,329 @@ class _Selector(asyncio.selectors._BaseSelectorImpl):
     def _notify_write(self, fd):
         self._notify(fd, _EVENT_WRITE)
 
-    def _throwback(self, fd):
-        # FIXME: do something with the FD in this case?
-        pass
+    def _throwback(self, fd, *args):
+        # eventlet obsoleted the hub listeners of the file descriptor: it was
+        # closed, or its number was reused by a new file. Report registered
+        # events as ready, so the owner gets an error (ex: EBADF) and
+        # unregisters the file descriptor.
+        key = self._fd_to_key.get(fd)
+        if key is not None:
+            self._notify(fd, key.events)
 
     def _read_events(self):
+        # The returned list is only valid until the next call
+        ready = self._ready
+        del ready[:]
+        fds = self._notified_fds
+        if not fds:
+            return ready
+
         notified = self._notified
-        self._notified = {}
-        ready = []
-        for fd, events in notified.items():
-            key = self.get_key(fd)
-            ready.append((key, events & key.events))
+        fd_to_key = self._fd_to_key
+        for fd in fds:
+            events = notified[fd]
+            notified[fd] = 0
+            key = fd_to_key.get(fd)
+            if key is None:
+                # the file descriptor was unregistered after the notification
+                continue
+            events &= key.events
+            if events:
+                ready.append((key, events))
+        del fds[:]
         return ready
 
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _timeout(self):
+        self._timer = None
+        if self._event is not None and not self._event.ready():
+            self._event.send('timeout')
+
     def select(self, timeout):
+        stats = self._loop._stats
+        if stats is not None:
+            stats.select_calls += 1
         events = self._read_events()
-        if events:
+        if events or self._loop._hub_driven:
+            # in the hub-driven mode, select() is called by the hub and so
+            # must not block: the next iteration is scheduled by a hub timer
             return events
 
         self._event = eventlet.event.Event()
         try:
             if timeout is not None:
-                def timeout_cb(event):
-                    if event.ready():
-                        return
-                    event.send('timeout')
-
-                eventlet.spawn_after(timeout, timeout_cb, self._event)
-
-                self._event.wait()
-                # FIXME: cancel the timeout_cb if wait() returns 'ready'?
-            else:
-                # blocking call
+                # Use a hub timer rather than a greenthread: the timer is
+                # cancelled as soon as a notifier wakes up select()
+                self._timer = self._hub.schedule_call_global(timeout,
+                                                             self._timeout)
+            if stats is None:
                 self._event.wait()
-            return self._read_events()
+                return self._read_events()
+
+            t0 = self._hub.clock()
+            reason = self._event.wait()
+            stats.hub_time += self._hub.clock() - t0
+            stats.wakeups[reason] += 1
+            events = self._read_events()
+            if not events and reason != 'timeout' and not self._loop._ready:
+                stats.spurious_wakeups += 1
+            return events
         finally:
+            self._cancel_timer()
             self._event = None
 
 
+class BufferPool(object):
+    """Pool of reusable receive buffers (bytearray objects).
+
+    At most max_buffers free buffers are kept in the pool.
+    """
+
+    def __init__(self, buffer_size=256 * 1024, max_buffers=16):
+        if buffer_size < 1:
+            raise ValueError("buffer_size must be at least 1")
+        self.buffer_size = buffer_size
+        self.max_buffers = max_buffers
+        self._free = []
+
+    def acquire(self):
+        """Get a buffer of buffer_size bytes."""
+        if self._free:
+            return self._free.pop()
+        return bytearray(self.buffer_size)
+
+    def release(self, buf):
+        """Give back a buffer to the pool."""
+        if len(self._free) < self.max_buffers and len(buf) == self.buffer_size:
+            self._free.append(buf)
+
+
+# Python 3.7 and newer: transports of other event loops also read directly
+# into the buffer of the protocol with recv_into()
+_BufferedProtocol = getattr(asyncio, 'BufferedProtocol', asyncio.Protocol)
+
+
+class PooledBufferProtocol(_BufferedProtocol):
+    """Protocol receiving data in buffers of the pool of the event loop.
+
+    Subclasses implement buffer_received(view) instead of data_received().
+    view is a memoryview of a pooled buffer: it is only valid during the
+    call, copy the data to keep it.
+
+    Socket transports of the aioeventlet event loop receive data with
+    recv_into() into buffers of the pool of the event loop. Other transports
+    (like SSL transports) call data_received(): buffer_received() gets a
+    memoryview of the received bytes.
+    """
+
+    # set by the transport, or a private pool
+    _buffer_pool = None
+    _buffer = None
+
+    def buffer_received(self, view):
+        raise NotImplementedError
+
+    def get_buffer(self, sizehint):
+        if self._buffer is None:
+            if self._buffer_pool is None:
+                self._buffer_pool = BufferPool()
+            self._buffer = self._buffer_pool.acquire()
+        return self._buffer
+
+    def buffer_updated(self, nbytes):
+        buf = self._buffer
+        self._buffer = None
+        try:
+            self.buffer_received(memoryview(buf)[:nbytes])
+        finally:
+            self._buffer_pool.release(buf)
+
+    def data_received(self, data):
+        self.buffer_received(memoryview(data))
+
+
+class _SocketTransport(asyncio.selector_events._SelectorSocketTransport):
+    # Socket transport receiving data of a PooledBufferProtocol with
+    # recv_into() into a buffer of the pool of the event loop. It also
+    # supports EventLoop.sendfile(): write() is refused while the file is
+    # sent directly on the socket.
+    _sendfile_running = False
+    _flush_waiter = None
+
+    def write(self, data):
+        if self._sendfile_running:
+            raise RuntimeError("unable to write: sendfile is in progress")
+        super(_SocketTransport, self).write(data)
+
+    def _write_ready(self):
+        super(_SocketTransport, self)._write_ready()
+        if not self._buffer:
+            self._wakeup_flush_waiter(None)
+
+    def _force_close(self, exc):
+        super(_SocketTransport, self)._force_close(exc)
+        self._wakeup_flush_waiter(exc or RuntimeError("transport closed"))
+
+    def _call_connection_lost(self, exc):
+        # trollius starts reading after connection_made() even if the
+        # protocol closed the transport: don't leave the closed socket
+        # registered in the selector
+        self._loop._remove_transport_reader(self._sock_fd)
+        super(_SocketTransport, self)._call_connection_lost(exc)
+
+    def _flush(self):
+        # Return a future done when the write buffer is empty
+        waiter = asyncio.Future(loop=self._loop)
+        if self._conn_lost:
+            waiter.set_exception(RuntimeError("transport closed"))
+        elif not self._buffer:
+            waiter.set_result(None)
+        else:
+            self._flush_waiter = waiter
+        return waiter
+
+    def _wakeup_flush_waiter(self, exc):
+        waiter = self._flush_waiter
+        if waiter is None:
+            return
+        self._flush_waiter = None
+        if waiter.done():
+            return
+        if exc is not None:
+            waiter.set_exception(exc)
+        else:
+            waiter.set_result(None)
+
+    def _read_ready(self):
+        protocol = self._protocol
+        if not isinstance(protocol, PooledBufferProtocol):
+            super(_SocketTransport, self)._read_ready()
+            return
+        if self._conn_lost:
+            return
+        if protocol._buffer_pool is None:
+            protocol._buffer_pool = self._loop.get_buffer_pool()
+        buf = protocol.get_buffer(-1)
+        try:
+            done, nbytes = _try_io(self._sock.recv_into, buf)
+        except Exception as exc:
+            self._fatal_error(exc, 'Fatal read error on socket transport')
+            return
+        if not done:
+            # keep the buffer for the next read
+            return
+        if nbytes:
+            protocol.buffer_updated(nbytes)
+            return
+
+        if protocol._buffer is not None:
+            protocol._buffer_pool.release(protocol._buffer)
+            protocol._buffer = None
+        keep_open = protocol.eof_received()
+        if keep_open:
+            # keep the connection open to write, but stop reading
+            self._loop._remove_transport_reader(self._sock_fd)
+        else:
+            self.close()
+
+
+class _SlackTimerHandle(asyncio.TimerHandle):
+    # Handle of a timer scheduled with a slack with the timer backend
+    # 'asyncio': its deadline owns a slot of EventLoop._timer_slots
+    __slots__ = ()
+    slot = True
+
+
+class _HubTimerHandle(asyncio.TimerHandle):
+    # Handle of call_at() with the timer backend 'hub'. The handle is itself
+    # a timer of the eventlet hub: the hub stores it in its heap and calls
+    # it, no eventlet Timer object is created. slot is true if the timer was
+    # scheduled with a slack.
+    __slots__ = ('seconds', 'called', 'slot')
+
+    def __call__(self):
+        # called by the hub when the timer expires
+        if not self.called:
+            self.called = True
+            self._loop._hub_timer_expired(self)
+
+    def __lt__(self, other):
+        if isinstance(other, asyncio.TimerHandle):
+            return self._when < other._when
+        # the hub compares timers scheduled at the same time
+        return id(self) < id(other)
+
+    def cancel(self):
+        # Don't call TimerHandle.cancel(): the handle is not in the heap of
+        # asyncio
+        asyncio.Handle.cancel(self)
+        if not self.called:
+            self.called = True
+            del self._loop._hub_timer_handles[id(self)]
+            self._loop._hub.timer_canceled(self)
+            self._loop._timer_slot_cancelled(self)
+
+
 class EventLoop(asyncio.SelectorEventLoop):
-    def __init__(self):
+    """asyncio event loop scheduling callbacks in eventlet.
+
+    If hub_driven is true, iterations of the event loop are scheduled as
+    eventlet hub timers and callbacks are called from the greenlet of the
+    hub, instead of waiting for events in the greenthread running
+    run_forever().
+
+    If timer_backend is 'hub', call_at() and call_later() schedule eventlet
+    hub timers instead of pushing handles into the heap of asyncio.
+    """
+
+    def __init__(self, hub_driven=False, timer_backend='asyncio'):
+        if timer_backend not in ('asyncio', 'hub'):
+            # BaseEventLoop.__del__() checks is_closed()
+            self._closed = True
+            raise ValueError("invalid timer backend: %r" % (timer_backend,))
         self._greenthread = None
+        self._hub_driven = hub_driven
+        self._hub_timers = (timer_backend == 'hub')
+        # Hub-driven mode: eventlet.event.Event() used to wake up
+        # run_forever(), and hub timer of the next iteration
+        self._hub_waiter = None
+        self._hub_timer = None
+        self._hub_timer_when = None
+        # True if the hub timer was scheduled for the next asyncio timer
+        self._hub_timer_timeout = False
+        # Timer backend 'hub': pending handles, id(handle) => handle
+        self._hub_timer_handles = {}
+        # _LoopStats if statistics are enabled
+        self._stats = None
+        # tuple of functions called with each handle before it is called,
+        # and with None at the end of an iteration; see _add_handle_hook()
+        self._handle_hooks = None
+        # True if a byte was written into the self-pipe and not read yet
+        self._wakeup_pending = False
+        # Timer coalescing: default slack, deadlines of timers scheduled
+        # with a slack (deadline => number of timers not cancelled) and
+        # counters
+        self._timer_slack = 0.0
+        self._timer_slots = {}
+        self._timer_slots_limit = 1024
+        self._timer_slack_scheduled = 0
+        self._timer_slack_expired = 0
+        self._timer_slack_wakeups = 0
 
         # Store a reference to the hub to ensure
         # that we always use the same hub
         self._hub = eventlet.hubs.get_hub()
+        # The hub is local to the thread which created the event loop
+        self._thread_ident = _get_thread_ident()
 
         selector = _Selector(self, self._hub)
 
         super(EventLoop, self).__init__(selector=selector)
+        selector._self_pipe_fd = self._ssock.fileno()
 
         # Force a call to set_debug() to set hub.debug_blocking
         self.set_debug(self.get_debug())
@@ -206,28 +936,280 @@ class EventLoop(asyncio.SelectorEventLoop):
         if eventlet.patcher.is_monkey_patched('thread'):
             self._default_executor = _TpoolExecutor(self)
 
+        self._buffer_pool = None
+
+    def _wakeup_selector(self):
+        if self._selector is None:
+            return
+        if self._selector._event is None and self._hub_waiter is None:
+            return
+        if _get_thread_ident() == self._thread_ident:
+            # selector.select() is running in a greenthread of the same
+            # thread: send the event directly, no need to write into the
+            # self-pipe
+            self._selector._wakeup("notify")
+        else:
+            self._write_to_self()
+
+    def _write_to_self(self):
+        # Coalesce wakeups from other threads: a single unread byte is
+        # enough to wake up the event loop
+        if self._wakeup_pending:
+            return
+        self._wakeup_pending = True
+        super(EventLoop, self)._write_to_self()
+
+    def _read_from_self(self):
+        super(EventLoop, self)._read_from_self()
+        # Clear the flag after reading: a thread which skipped its write
+        # before this point added its callback before, so the callback will
+        # be seen by the next iteration of the event loop
+        self._wakeup_pending = False
+
+    def close(self):
+        super(EventLoop, self).close()
+        self._cancel_hub_timers()
+        # pending timers will never expire
+        self._expire_timer_slots()
+        self._timer_slots.clear()
+
+    def _cancel_hub_timers(self):
+        # Timer backend 'hub': the hub would keep pending handles in its
+        # heap until they expire
+        handles = list(self._hub_timer_handles.values())
+        if not handles:
+            return
+        for handle in handles:
+            handle.cancel()
+        # timer_canceled() only purges the heap when most timers are
+        # cancelled: purge it now, as timer_canceled() does
+        hub = self._hub
+        hub.timers_canceled = 0
+        hub.timers = [t for t in hub.timers if not t[1].called]
+        hub.next_timers = [t for t in hub.next_timers if not t[1].called]
+        heapq.heapify(hub.timers)
+
     def stop(self):
         super(EventLoop, self).stop()
-        # selector.select() is running: write into the self-pipe to wake up
-        # the selector
-        self._write_to_self()
+        self._wakeup_selector()
 
     def call_soon(self, callback, *args):
         handle = super(EventLoop, self).call_soon(callback, *args)
-        if self._selector is not None and self._selector._event:
-            # selector.select() is running: write into the self-pipe to wake up
-            # the selector
-            self._write_to_self()
+        self._wakeup_selector()
         return handle
 
     def call_at(self, when, callback, *args):
-        handle = super(EventLoop, self).call_at(when, callback, *args)
-        if self._selector is not None and self._selector._event:
-            # selector.select() is running: write into the self-pipe to wake up
-            # the selector
-            self._write_to_self()
+        return self._call_at(when, self._timer_slack, callback, args)
+
+    def call_at_slack(self, when, slack, callback, *args):
+        """Like call_at(), but the callback may be called up to slack
+        seconds late, to be called with other timers in the same wakeup.
+        """
+        if slack < 0:
+            raise ValueError("slack must be positive or zero")
+        return self._call_at(when, slack, callback, args)
+
+    def call_later_slack(self, delay, slack, callback, *args):
+        """Like call_later(), with a slack: see call_at_slack()."""
+        return self.call_at_slack(self.time() + delay, slack,
+                                  callback, *args)
+
+    def set_timer_slack(self, slack):
+        """Set the default slack in seconds of call_at() and call_later()."""
+        if slack < 0:
+            raise ValueError("slack must be positive or zero")
+        self._timer_slack = slack
+
+    def get_timer_slack(self):
+        return self._timer_slack
+
+    def get_timer_stats(self):
+        """Get statistics of timers scheduled with a slack.
+
+        'expired' is the number of timers which expired (not cancelled),
+        'wakeups' the number of distinct deadlines of these timers and
+        'wakeups_saved' the difference: the number of timers which didn't
+        need their own wakeup.
+        """
+        self._expire_timer_slots()
+        return {'slack': self._timer_slack,
+                'scheduled': self._timer_slack_scheduled,
+                'expired': self._timer_slack_expired,
+                'wakeups': self._timer_slack_wakeups,
+                'wakeups_saved': (self._timer_slack_expired
+                                  - self._timer_slack_wakeups)}
+
+    def _call_at(self, when, slack, callback, args):
+        if slack:
+            # Round the deadline up to a multiple of slack: timers due in the
+            # same window get the same deadline and so expire together
+            when = math.ceil(float(when) / slack) * slack
+        if self._hub_timers:
+            handle = self._call_at_hub(when, callback, args, bool(slack))
+        elif slack:
+            handle = self._call_at_slack(when, callback, args)
+            self._wakeup_selector()
+        else:
+            handle = super(EventLoop, self).call_at(when, callback, *args)
+            self._wakeup_selector()
+        if slack:
+            self._add_timer_slot(when)
+        return handle
+
+    def _call_at_slack(self, when, callback, args):
+        # Timer backend 'asyncio': BaseEventLoop.call_at() creating a handle
+        # which owns a timer slot
+        self._check_closed()
+        if self._debug and hasattr(self, '_check_thread'):
+            self._check_thread()
+        handle = _SlackTimerHandle(when, callback, args, self)
+        if getattr(handle, '_source_traceback', None):
+            del handle._source_traceback[-1]
+        heapq.heappush(self._scheduled, handle)
+        handle._scheduled = True
+        return handle
+
+    def _add_timer_slot(self, when):
+        slots = self._timer_slots
+        self._timer_slack_scheduled += 1
+        if when in slots:
+            slots[when] += 1
+            return
+        if len(slots) >= self._timer_slots_limit:
+            # count expired deadlines; grow the limit to keep the cost
+            # amortized if most deadlines are still pending
+            self._expire_timer_slots()
+            self._timer_slots_limit = max(1024, len(slots) * 2)
+        slots[when] = 1
+
+    def _expire_timer_slots(self):
+        # Timers of a deadline expire in the same wakeup, unless they were
+        # all cancelled
+        now = self.time()
+        slots = self._timer_slots
+        for when in [when for when in slots if when <= now]:
+            timers = slots.pop(when)
+            if timers:
+                self._timer_slack_expired += timers
+                self._timer_slack_wakeups += 1
+
+    def _timer_handle_cancelled(self, handle):
+        super(EventLoop, self)._timer_handle_cancelled(handle)
+        if handle._scheduled:
+            self._timer_slot_cancelled(handle)
+
+    def _timer_slot_cancelled(self, handle):
+        # timers scheduled without slack have no slot, even if another
+        # timer has a slot at the same deadline
+        if not getattr(handle, 'slot', False):
+            return
+        slots = self._timer_slots
+        if slots.get(handle._when):
+            slots[handle._when] -= 1
+
+    def _call_at_hub(self, when, callback, args, slot):
+        # Timer backend 'hub': the hub timer moves the handle to the ready
+        # queue, the handle is not stored in the heap of asyncio
+        self._check_closed()
+        if self._debug and hasattr(self, '_check_thread'):
+            self._check_thread()
+        handle = _HubTimerHandle(when, callback, args, self)
+        if getattr(handle, '_source_traceback', None):
+            del handle._source_traceback[-1]
+        handle.seconds = max(when - self.time(), 0.0)
+        handle.called = False
+        handle.slot = slot
+        self._hub.add_timer(handle)
+        self._hub_timer_handles[id(handle)] = handle
         return handle
 
+    def _hub_timer_expired(self, handle):
+        del self._hub_timer_handles[id(handle)]
+        if self.is_closed():
+            return
+        self._ready.append(handle)
+        # hub timers are called in the thread of the event loop; in the
+        # hub-driven mode, _wakeup() schedules an iteration
+        self._selector._wakeup("timeout")
+
+    def _process_events(self, event_list):
+        super(EventLoop, self)._process_events(event_list)
+        if self._stats is not None:
+            self._stats.ready_queue.add(len(self._ready))
+
+    def set_stats_enabled(self, enabled):
+        """Enable or disable the statistics of get_stats().
+
+        Enabling statistics resets the counters.
+        """
+        if enabled:
+            self._stats = _LoopStats()
+        else:
+            self._stats = None
+
+    def get_stats_enabled(self):
+        return (self._stats is not None)
+
+    def get_stats(self):
+        """Get statistics of the event loop as a dictionary.
+
+        Counters are only updated if statistics are enabled by
+        set_stats_enabled(True).
+        """
+        stats = self._stats
+        if stats is None:
+            stats = _LoopStats()
+        listeners = self._hub.listeners
+        executor = self._default_executor
+        if executor is None:
+            executor_stats = None
+        elif hasattr(executor, 'get_stats'):
+            executor_stats = executor.get_stats()
+        elif hasattr(executor, '_work_queue'):
+            # concurrent.futures.ThreadPoolExecutor
+            executor_stats = {'queued': executor._work_queue.qsize()}
+        else:
+            executor_stats = None
+        if self._selector is not None:
+            fds = len(self._selector.get_map())
+            selector_listeners = (len(self._selector._readers)
+                                  + len(self._selector._writers))
+        else:
+            fds = selector_listeners = 0
+        return {
+            'enabled': self._stats is not None,
+            'select_calls': stats.select_calls,
+            'wakeups': dict(stats.wakeups),
+            'spurious_wakeups': stats.spurious_wakeups,
+            'ready_queue': stats.ready_queue.as_dict(),
+            'hub_time': stats.hub_time,
+            'callback_time': stats.callback_time,
+            'fds': fds,
+            'selector_listeners': selector_listeners,
+            'hub_listeners': (len(listeners[_HUB_READ])
+                              + len(listeners[_HUB_WRITE])),
+            'scheduled_timers': (len(self._scheduled)
+                                 + len(self._hub_timer_handles)),
+            'timers': self.get_timer_stats(),
+            'executor': executor_stats,
+        }
+
+    def configure_executor(self, max_workers=None, max_queued=None,
+                           rejection_policy='abort'):
+        """Use a new executor running functions in its own native threads.
+
+        The executor becomes the default executor of run_in_executor(); the
+        previous default executor is shut down without waiting. Return the
+        executor.
+        """
+        executor = _TpoolExecutor(self, max_workers, max_queued,
+                                  rejection_policy)
+        previous = self._default_executor
+        self._default_executor = executor
+        if previous is not None:
+            previous.shutdown(wait=False)
+        return executor
+
     def set_debug(self, debug):
         super(EventLoop, self).set_debug(debug)
 
@@ -247,6 +1229,121 @@ class EventLoop(asyncio.SelectorEventLoop):
         and hasattr(self, 'slow_callback_duration')):
             self._hub.debug_blocking_resolution = self.slow_callback_duration
 
+    def _schedule_iteration(self, delay):
+        when = self.time() + delay
+        if self._hub_timer is not None:
+            if self._hub_timer_when <= when:
+                # an iteration is already scheduled early enough
+                return
+            self._hub_timer.cancel()
+        self._hub_timer = self._hub.schedule_call_global(delay,
+                                                         self._iteration)
+        self._hub_timer_when = when
+        self._hub_timer_timeout = (delay > 0.0)
+
+    def _cancel_iteration(self):
+        if self._hub_timer is not None:
+            self._hub_timer.cancel()
+            self._hub_timer = None
+
+    def _wakeup_run_forever(self, *exc_info):
+        # Stop scheduling iterations and wake up the greenthread of
+        # run_forever()
+        waiter = self._hub_waiter
+        self._hub_waiter = None
+        self._cancel_iteration()
+        if self._stats is not None:
+            self._stats.iteration_end = None
+        if exc_info:
+            waiter.send_exception(*exc_info)
+        else:
+            waiter.send(None)
+
+    def _iteration(self):
+        # Called by the hub in the hub-driven mode
+        self._hub_timer = None
+        stats = self._stats
+        if stats is not None:
+            if self._hub_timer_timeout:
+                stats.wakeups['timeout'] += 1
+            if stats.iteration_end is not None:
+                stats.hub_time += self._hub.clock() - stats.iteration_end
+        try:
+            self._run_iteration()
+        except BaseException:
+            # run_forever() handles the exception, ex: _StopError
+            self._wakeup_run_forever(*sys.exc_info())
+            return
+        finally:
+            if stats is not None:
+                stats.iteration_end = self._hub.clock()
+
+        if getattr(self, '_stopping', False):
+            self._wakeup_run_forever()
+        elif self._ready:
+            self._schedule_iteration(0.0)
+        elif self._scheduled:
+            delay = self._scheduled[0]._when - self.time()
+            self._schedule_iteration(max(delay, 0.0))
+        # otherwise, wait until a notifier wakes up the event loop
+
+    def _add_handle_hook(self, hook):
+        # The ready queue calls the hooks when the event loop pops a handle,
+        # just before calling it
+        if self._handle_hooks is None:
+            ready = _HookedReady(self._ready)
+            ready.loop = self
+            self._ready = ready
+            self._handle_hooks = (hook,)
+        else:
+            self._handle_hooks += (hook,)
+
+    def _remove_handle_hook(self, hook):
+        hooks = tuple(func for func in self._handle_hooks if func != hook)
+        if hooks:
+            self._handle_hooks = hooks
+        else:
+            self._handle_hooks = None
+            self._ready = collections.deque(self._ready)
+
+    def _run_iteration(self):
+        stats = self._stats
+        if stats is None and self._handle_hooks is None:
+            super(EventLoop, self)._run_once()
+            return
+
+        if stats is not None:
+            hub_time = stats.hub_time
+            t0 = self._hub.clock()
+        try:
+            super(EventLoop, self)._run_once()
+        finally:
+            if self._handle_hooks is not None:
+                # the last callback of the iteration has returned
+                for hook in self._handle_hooks:
+                    hook(None)
+            if stats is not None:
+                # time of the iteration, except the time waiting in select()
+                stats.callback_time += (self._hub.clock() - t0
+                                        - (stats.hub_time - hub_time))
+
+    def _run_once(self):
+        if not self._hub_driven:
+            self._run_iteration()
+            return
+
+        # Hub-driven mode: the hub runs iterations of the event loop, the
+        # greenthread of run_forever() only waits until the event loop is
+        # stopped or until an iteration raised an exception
+        waiter = eventlet.event.Event()
+        self._hub_waiter = waiter
+        try:
+            self._schedule_iteration(0.0)
+            waiter.wait()
+        finally:
+            self._hub_waiter = None
+            self._cancel_iteration()
+
     def run_forever(self):
         self._greenthread = eventlet.getcurrent()
         try:
@@ -261,56 +1358,621 @@ class EventLoop(asyncio.SelectorEventLoop):
     def time(self):
         return self._hub.clock()
 
+    def get_buffer_pool(self):
+        """Get the pool of receive buffers of the event loop."""
+        if self._buffer_pool is None:
+            self._buffer_pool = BufferPool()
+        return self._buffer_pool
 
-class EventLoopPolicy(asyncio.DefaultEventLoopPolicy):
-    _loop_factory = EventLoop
+    def set_buffer_pool(self, pool):
+        """Set the pool of receive buffers of the event loop."""
+        self._buffer_pool = pool
 
+    def _make_socket_transport(self, sock, protocol, waiter=None,
+                               extra=None, server=None):
+        return _SocketTransport(self, sock, protocol, waiter, extra, server)
 
-def wrap_greenthread(gt, loop=None):
-    """Wrap an eventlet GreenThread, or a greenlet, into a Future object.
+    def _remove_transport_reader(self, fd):
+        # remove_reader() of Python 3.6 and newer refuses file descriptors
+        # of transports
+        if hasattr(self, '_remove_reader'):
+            self._remove_reader(fd)
+        else:
+            self.remove_reader(fd)
 
-    The Future object waits for the completion of a greenthread. The result
-    or the exception of the greenthread will be stored in the Future object.
+    def _use_sock_fast_path(self, sock, event_type):
+        if isinstance(sock, _SSLSocket):
+            return False
+        # The socket is already registered in the selector for the same
+        # event: use the selector, the hub only supports one listener
+        if event_type == _HUB_READ:
+            listeners = self._selector._readers
+        else:
+            listeners = self._selector._writers
+        return not listeners or sock.fileno() not in listeners
 
-    The greenthread must be wrapped before its execution starts. If the
-    greenthread is running or already finished, an exception is raised.
+    def _sock_op(self, event_type, sock, op, fallback=True):
+        # Fast path of the sock_*() methods: call op() until it returns the
+        # result rather than raising an error of _NOT_READY. Wait until the
+        # socket is ready with a hub listener calling op() directly, without
+        # registering the socket into the selector.
+        #
+        # Most operations complete immediately: only check if the fast path
+        # can be used when the socket is not ready. If it cannot be used and
+        # fallback is true, return None: the caller must use the selector.
+        if self._debug and sock.gettimeout() != 0:
+            raise ValueError("the socket must be non-blocking")
+        fut = asyncio.Future(loop=self)
+        try:
+            fut.set_result(op())
+            return fut
+        except (socket.error, OSError) as exc:
+            if exc.errno not in _NOT_READY:
+                fut.set_exception(exc)
+                return fut
+        except Exception as exc:
+            fut.set_exception(exc)
+            return fut
+        if fallback and not self._use_sock_fast_path(sock, event_type):
+            return None
 
-    For greenlets, the run attribute must be set.
-    """
-    if loop is None:
-        loop = asyncio.get_event_loop()
-    fut = asyncio.Future(loop=loop)
+        fd = sock.fileno()
+        hub = self._hub
+        listener = []
 
-    if not isinstance(gt, greenlet.greenlet):
-        raise TypeError("greenthread or greenlet request, not %s"
-                        % type(gt))
+        def add():
+            if _EVENTLET15:
+                listener.append(hub.add(event_type, fd, step, closed, closed))
+            else:
+                listener.append(hub.add(event_type, fd, step))
 
-    if gt:
-        raise RuntimeError("wrap_greenthread: the greenthread is running")
-    if gt.dead:
-        raise RuntimeError("wrap_greenthread: the greenthread already finished")
+        def remove(fut=None):
+            if listener:
+                hub.remove(listener.pop())
 
-    if isinstance(gt, eventlet.greenthread.GreenThread):
-        orig_main = gt.run
-        def wrap_func(*args, **kw):
+        def closed(*args):
+            # eventlet obsoleted the listener: the socket was closed, op()
+            # will get the error
+            del listener[:]
+            step()
+
+        def step(*args):
+            if fut.done():
+                # the future was cancelled
+                remove()
+                return
             try:
-                orig_main(*args, **kw)
+                result = op()
+            except (socket.error, OSError) as exc:
+                if exc.errno in _NOT_READY:
+                    if not listener:
+                        add()
+                    return
+                remove()
+                fut.set_exception(exc)
             except Exception as exc:
+                remove()
                 fut.set_exception(exc)
             else:
-                result = gt.wait()
+                remove()
                 fut.set_result(result)
-        gt.run = wrap_func
-    else:
-        try:
-            orig_func = gt.run
-        except AttributeError:
-            raise RuntimeError("wrap_greenthread: the run attribute "
-                               "of the greenlet is not set")
-        def wrap_func(*args, **kw):
-            try:
-                result = orig_func(*args, **kw)
-            except Exception as exc:
+
+        add()
+        fut.add_done_callback(remove)
+        return fut
+
+    def sock_recv(self, sock, n):
+        recv = functools.partial(sock.recv, n)
+        fut = self._sock_op(_HUB_READ, sock, recv)
+        if fut is None:
+            fut = super(EventLoop, self).sock_recv(sock, n)
+        return fut
+
+    def sock_recv_into(self, sock, buf):
+        recv_into = functools.partial(sock.recv_into, buf)
+        # Python older than 3.7 has no selector implementation
+        fallback = hasattr(super(EventLoop, self), 'sock_recv_into')
+        fut = self._sock_op(_HUB_READ, sock, recv_into, fallback)
+        if fut is None:
+            fut = super(EventLoop, self).sock_recv_into(sock, buf)
+        return fut
+
+    def sock_sendall(self, sock, data):
+        remaining = [data]
+        sendall = functools.partial(_sendall, sock, remaining)
+        fut = self._sock_op(_HUB_WRITE, sock, sendall)
+        if fut is None:
+            # send the remaining data
+            fut = super(EventLoop, self).sock_sendall(sock, remaining[0])
+        return fut
+
+    def sock_accept(self, sock):
+        def accept():
+            conn, address = sock.accept()
+            conn.setblocking(False)
+            return conn, address
+
+        fut = self._sock_op(_HUB_READ, sock, accept)
+        if fut is None:
+            fut = super(EventLoop, self).sock_accept(sock)
+        return fut
+
+    def sock_connect(self, sock, address):
+        if (not self._use_sock_fast_path(sock, _HUB_WRITE)
+        or not _is_resolved_address(sock, address)):
+            return super(EventLoop, self).sock_connect(sock, address)
+        started = []
+
+        def connect():
+            if not started:
+                started.append(True)
+                # fails with EINPROGRESS until the connection completes
+                sock.connect(address)
+                return None
+            # the socket is writable: the connection completed
+            err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err != 0:
+                raise socket.error(err, 'Connect call failed %s' % (address,))
+            return None
+
+        # the connection is started by the first call to connect(): the
+        # selector path cannot be used anymore
+        return self._sock_op(_HUB_WRITE, sock, connect, False)
+
+    def sock_sendfile(self, sock, file, offset=0, count=None, fallback=True):
+        """Send a file with os.sendfile(), return the number of sent bytes.
+
+        If os.sendfile() cannot be used and fallback is true, read the file
+        and send it by chunks.
+        """
+        if self._debug and sock.gettimeout() != 0:
+            raise ValueError("the socket must be non-blocking")
+        _check_sendfile_params(sock, file, offset, count)
+
+        fut = asyncio.Future(loop=self)
+        try:
+            native = self._sock_sendfile_native(sock, file, offset, count)
+        except _SendfileNotAvailableError:
+            if not fallback:
+                raise
+            native = None
+        if native is None:
+            self._sock_sendfile_fallback(fut, sock, file, offset, count)
+            return fut
+
+        def native_done(native):
+            if fut.cancelled():
+                return
+            exc = native.exception()
+            if exc is None:
+                fut.set_result(native.result())
+            elif isinstance(exc, _SendfileNotAvailableError) and fallback:
+                self._sock_sendfile_fallback(fut, sock, file, offset, count)
+            else:
+                fut.set_exception(exc)
+
+        def cancel_native(fut):
+            if fut.cancelled():
+                native.cancel()
+
+        native.add_done_callback(native_done)
+        fut.add_done_callback(cancel_native)
+        return fut
+
+    def sendfile(self, transport, file, offset=0, count=None, fallback=True):
+        """Send a file on a socket transport, return a future of the number
+        of sent bytes.
+
+        Pause reading, wait until the write buffer of the transport is
+        flushed, and send the file on the socket with sock_sendfile().
+        """
+        if not isinstance(transport, _SocketTransport):
+            raise _SendfileNotAvailableError(
+                "only socket transports of the event loop are supported")
+        if transport._closing:
+            raise RuntimeError("Transport is closing")
+        if transport._sendfile_running:
+            raise RuntimeError("sendfile is already in progress")
+        _check_sendfile_params(transport._sock, file, offset, count)
+
+        fut = asyncio.Future(loop=self)
+        sendfile = [None]
+        resume_reading = not transport._paused
+        if resume_reading:
+            transport.pause_reading()
+        transport._sendfile_running = True
+
+        def flushed(flush):
+            if fut.cancelled():
+                return
+            if flush.exception() is not None:
+                fut.set_exception(flush.exception())
+                return
+            try:
+                sendfile[0] = self.sock_sendfile(transport._sock, file,
+                                                 offset, count, fallback)
+            except Exception as exc:
+                fut.set_exception(exc)
+                return
+            sendfile[0].add_done_callback(sent)
+
+        def sent(sendfile):
+            if fut.cancelled():
+                return
+            if sendfile.exception() is not None:
+                fut.set_exception(sendfile.exception())
+            else:
+                fut.set_result(sendfile.result())
+
+        def done(fut):
+            if fut.cancelled():
+                if sendfile[0] is not None:
+                    sendfile[0].cancel()
+                else:
+                    flush.cancel()
+            transport._sendfile_running = False
+            if (resume_reading and transport._paused
+            and not transport._closing):
+                transport.resume_reading()
+
+        flush = transport._flush()
+        flush.add_done_callback(flushed)
+        fut.add_done_callback(done)
+        return fut
+
+    def _sock_sendfile_native(self, sock, file, offset, count):
+        if not hasattr(os, 'sendfile'):
+            raise _SendfileNotAvailableError("os.sendfile() is not available")
+        if not self._use_sock_fast_path(sock, _HUB_WRITE):
+            raise _SendfileNotAvailableError("the socket is registered")
+        try:
+            fileno = file.fileno()
+        except (AttributeError, ValueError, io.UnsupportedOperation):
+            raise _SendfileNotAvailableError("not a regular file")
+        try:
+            fsize = os.fstat(fileno).st_size
+        except OSError:
+            raise _SendfileNotAvailableError("not a regular file")
+        total = count if count else fsize - offset
+        sent = [0]
+
+        def sendfile():
+            try:
+                while sent[0] < total:
+                    try:
+                        nbytes = os.sendfile(sock.fileno(), fileno,
+                                             offset + sent[0],
+                                             total - sent[0])
+                    except OSError as exc:
+                        if exc.errno not in _WOULD_BLOCK and not sent[0]:
+                            raise _SendfileNotAvailableError(
+                                "os.sendfile() failed: %s" % exc)
+                        raise
+                    if not nbytes:
+                        # end of file
+                        break
+                    sent[0] += nbytes
+                return sent[0]
+            finally:
+                # the file position is the end of the sent data
+                if sent[0]:
+                    file.seek(offset + sent[0])
+
+        return self._sock_op(_HUB_WRITE, sock, sendfile, False)
+
+    def _sock_sendfile_fallback(self, fut, sock, file, offset, count):
+        # Read the file in the default executor, send chunks with
+        # sock_sendall()
+        blocksize = min(count, 256 * 1024) if count else 256 * 1024
+        view = memoryview(bytearray(blocksize))
+        sent = [0]
+
+        def done(exc=None):
+            if sent[0]:
+                file.seek(offset + sent[0])
+            if fut.cancelled():
+                return
+            if exc is not None:
+                fut.set_exception(exc)
+            else:
+                fut.set_result(sent[0])
+
+        def read_next():
+            size = blocksize
+            if count is not None:
+                size = min(size, count - sent[0])
+            if size <= 0 or fut.cancelled():
+                done()
+                return
+            read = self.run_in_executor(None, _readinto, file, view[:size])
+            read.add_done_callback(send)
+
+        def send(read):
+            if read.exception() is not None:
+                done(read.exception())
+                return
+            nbytes = read.result()
+            if not nbytes or fut.cancelled():
+                done()
+                return
+            sendall = asyncio.async(self.sock_sendall(sock, view[:nbytes]),
+                                    loop=self)
+            sendall.add_done_callback(functools.partial(sent_chunk, nbytes))
+
+        def sent_chunk(nbytes, sendall):
+            if sendall.exception() is not None:
+                done(sendall.exception())
+                return
+            sent[0] += nbytes
+            read_next()
+
+        if offset:
+            file.seek(offset)
+        read_next()
+
+
+def _check_sendfile_params(sock, file, offset, count):
+    if 'b' not in getattr(file, 'mode', 'b'):
+        raise ValueError("file should be opened in binary mode")
+    # sock.type includes SOCK_NONBLOCK and SOCK_CLOEXEC flags on Linux
+    # before Python 3.7
+    sock_type = sock.getsockopt(socket.SOL_SOCKET, socket.SO_TYPE)
+    if sock_type != socket.SOCK_STREAM:
+        raise ValueError("only SOCK_STREAM type sockets are supported")
+    if count is not None:
+        if not isinstance(count, numbers.Integral):
+            raise TypeError("count must be a positive integer (got %r)"
+                            % (count,))
+        if count <= 0:
+            raise ValueError("count must be a positive integer (got %r)"
+                             % (count,))
+    if not isinstance(offset, numbers.Integral):
+        raise TypeError("offset must be a non-negative integer (got %r)"
+                        % (offset,))
+    if offset < 0:
+        raise ValueError("offset must be a non-negative integer (got %r)"
+                         % (offset,))
+
+
+def _readinto(file, view):
+    try:
+        readinto = file.readinto
+    except AttributeError:
+        # file objects of Python 2 and GreenPipe have no readinto()
+        data = file.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+    return readinto(view)
+
+
+def _sendall(sock, remaining):
+    # Send remaining[0] until all data is sent or the socket is not ready
+    while True:
+        nbytes = sock.send(remaining[0])
+        if nbytes == len(remaining[0]):
+            return None
+        # only copy-free slicing after a partial send
+        remaining[0] = memoryview(remaining[0])[nbytes:]
+
+
+def _try_io(func, *args):
+    # Call a non-blocking socket method: return (True, result), or
+    # (False, None) if the operation would block
+    try:
+        return True, func(*args)
+    except socket.error as exc:
+        if exc.errno in _WOULD_BLOCK:
+            return False, None
+        raise
+
+
+def _is_resolved_address(sock, address):
+    if sock.family not in (socket.AF_INET, getattr(socket, 'AF_INET6', None)):
+        return True
+    try:
+        socket.inet_pton(sock.family, address[0])
+    except (AttributeError, TypeError, ValueError, socket.error):
+        return False
+    return True
+
+
+class EventLoopPolicy(asyncio.DefaultEventLoopPolicy):
+    _loop_factory = EventLoop
+
+    def __init__(self, hub_driven=False, timer_backend='asyncio'):
+        super(EventLoopPolicy, self).__init__()
+        self._hub_driven = hub_driven
+        self._timer_backend = timer_backend
+
+    def new_event_loop(self):
+        return self._loop_factory(hub_driven=self._hub_driven,
+                                  timer_backend=self._timer_backend)
+
+
+def _copy_future_state(cfut, fut):
+    # Copy the state of an asyncio future into a concurrent future
+    if fut.cancelled():
+        cfut.set_exception(concurrent.futures.CancelledError())
+    elif fut.exception() is not None:
+        cfut.set_exception(fut.exception())
+    else:
+        cfut.set_result(fut.result())
+
+
+def run_in_loop(loop, func, *args):
+    """Call func(*args) in the event loop loop, from any thread.
+
+    Return a concurrent.futures.Future of the result. If func returns a
+    coroutine object or a future, the concurrent future waits for it.
+    """
+    cfut = concurrent.futures.Future()
+
+    def callback():
+        if not cfut.set_running_or_notify_cancel():
+            return
+        try:
+            result = func(*args)
+            if asyncio.iscoroutine(result) or isinstance(result,
+                                                         asyncio.Future):
+                fut = asyncio.async(result, loop=loop)
+                fut.add_done_callback(
+                    functools.partial(_copy_future_state, cfut))
+                return
+        except Exception as exc:
+            cfut.set_exception(exc)
+        else:
+            cfut.set_result(result)
+
+    if getattr(loop, '_thread_ident', None) == _get_thread_ident():
+        # same thread: no need to wake up the event loop with the self-pipe
+        loop.call_soon(callback)
+    else:
+        loop.call_soon_threadsafe(callback)
+    return cfut
+
+
+class EventLoopGroup(object):
+    """Group of event loops, each running in its own native thread.
+
+    Each thread has its own eventlet hub and its own aioeventlet event
+    loop. Use get_loop() to choose a loop and run_in_loop() to call a
+    function in it.
+    """
+
+    def __init__(self, nthread, hub_driven=False):
+        if nthread < 1:
+            raise ValueError("nthread must be at least 1")
+        self._nthread = nthread
+        self._hub_driven = hub_driven
+        self._loops = []
+        self._threads = []
+        self._next = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run_loop(self, ready, errors):
+        try:
+            loop = EventLoop(hub_driven=self._hub_driven)
+            asyncio.set_event_loop(loop)
+        except Exception as exc:
+            errors.append(exc)
+            ready.set()
+            return
+        self._loops.append(loop)
+        ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    def start(self):
+        """Start the threads and wait until their event loops are created."""
+        if self._threads:
+            raise RuntimeError("the event loop group is already started")
+        errors = []
+        for index in range(self._nthread):
+            ready = threading.Event()
+            thread = threading.Thread(target=self._run_loop,
+                                      args=(ready, errors),
+                                      name='aioeventlet-loop-%s' % index)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+            ready.wait()
+            if errors:
+                self.stop()
+                raise errors[0]
+
+    def stop(self):
+        """Stop the event loops and wait until the threads exit."""
+        for loop in self._loops:
+            loop.call_soon_threadsafe(loop.stop)
+        for thread in self._threads:
+            thread.join()
+        del self._loops[:]
+        del self._threads[:]
+
+    def get_loops(self):
+        """List of the event loops of the group."""
+        return list(self._loops)
+
+    def get_loop(self, key=None):
+        """Choose an event loop.
+
+        If key is None, choose the loops in turn (round-robin). Otherwise,
+        always choose the same loop for the same key (hash of key).
+        """
+        loops = self._loops
+        if not loops:
+            raise RuntimeError("the event loop group is not started")
+        if key is None:
+            index = self._next % len(loops)
+            self._next = index + 1
+        else:
+            index = hash(key) % len(loops)
+        return loops[index]
+
+
+def wrap_greenthread(gt, loop=None):
+    """Wrap an eventlet GreenThread, or a greenlet, into a Future object.
+
+    The Future object waits for the completion of a greenthread. The result
+    or the exception of the greenthread will be stored in the Future object.
+
+    The greenthread must be wrapped before its execution starts. If the
+    greenthread is running or already finished, an exception is raised.
+
+    For greenlets, the run attribute must be set.
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    fut = asyncio.Future(loop=loop)
+
+    if not isinstance(gt, greenlet.greenlet):
+        raise TypeError("greenthread or greenlet request, not %s"
+                        % type(gt))
+
+    if gt:
+        raise RuntimeError("wrap_greenthread: the greenthread is running")
+    if gt.dead:
+        raise RuntimeError("wrap_greenthread: the greenthread already finished")
+
+    accounting = _get_cpu_accounting()
+    if accounting is not None:
+        accounting._set_owner(gt=gt)
+
+    if isinstance(gt, eventlet.greenthread.GreenThread):
+        orig_main = gt.run
+        def wrap_func(*args, **kw):
+            if accounting is not None:
+                # GreenThread.main(function, args, kwargs)
+                accounting._wrap_greenthread(gt, args[0])
+            try:
+                orig_main(*args, **kw)
+            except Exception as exc:
+                fut.set_exception(exc)
+            else:
+                result = gt.wait()
+                fut.set_result(result)
+        gt.run = wrap_func
+    else:
+        try:
+            orig_func = gt.run
+        except AttributeError:
+            raise RuntimeError("wrap_greenthread: the run attribute "
+                               "of the greenlet is not set")
+        def wrap_func(*args, **kw):
+            if accounting is not None:
+                accounting._wrap_greenthread(gt, orig_func)
+            try:
+                result = orig_func(*args, **kw)
+            except Exception as exc:
                 fut.set_exception(exc)
             else:
                 fut.set_result(result)
@@ -318,6 +1980,14 @@ def wrap_greenthread(gt, loop=None):
     return fut
 
 
+def _check_yield_greenthread(loop, func_name):
+    current = eventlet.getcurrent()
+    if loop._greenthread == current or current is loop._hub.greenlet:
+        raise RuntimeError("%s() must not be called from "
+                           "the greenthread of the aioeventlet event loop"
+                           % func_name)
+
+
 def yield_future(future, loop=None):
     """Wait for a future, a task, or a coroutine object from a greenthread.
 
@@ -330,9 +2000,14 @@ def yield_future(future, loop=None):
     running the aioeventlet event loop.
     """
     future = asyncio.async(future, loop=loop)
-    if future._loop._greenthread == eventlet.getcurrent():
-        raise RuntimeError("yield_future() must not be called from "
-                           "the greenthread of the aioeventlet event loop")
+    _check_yield_greenthread(future._loop, "yield_future")
+    accounting = _get_cpu_accounting()
+    if accounting is not None and isinstance(future, asyncio.Task):
+        # the task runs on behalf of the current greenthread
+        accounting._set_owner(task=future)
+    if future.done():
+        # fast path: no need to switch to the event loop
+        return future.result()
 
     event = eventlet.event.Event()
     def done(fut):
@@ -345,3 +2020,1283 @@ def yield_future(future, loop=None):
 
     future.add_done_callback(done)
     return event.wait()
+
+
+def yield_futures(fs, loop=None, return_when=asyncio.ALL_COMPLETED):
+    """Wait for futures, tasks, or coroutine objects from a greenthread.
+
+    Yield control other eligible eventlet coroutines until the condition
+    return_when is met: FIRST_COMPLETED, FIRST_EXCEPTION or ALL_COMPLETED,
+    similar to asyncio.wait(). The greenthread is only woken up once.
+
+    Return two sets of futures: (done, pending).
+
+    The function must not be called from the greenthread
+    running the aioeventlet event loop.
+    """
+    if return_when not in (asyncio.FIRST_COMPLETED, asyncio.FIRST_EXCEPTION,
+                           asyncio.ALL_COMPLETED):
+        raise ValueError('Invalid return_when value: {0}'.format(return_when))
+    fs = set(fs)
+    if not fs:
+        raise ValueError('Set of coroutines/Futures is empty.')
+    # check the loop of futures before wrapping coroutines into tasks
+    futures = [f for f in fs if isinstance(f, asyncio.Future)]
+    if loop is None and futures:
+        loop = futures[0]._loop
+    for fut in futures:
+        if fut._loop is not loop:
+            raise ValueError('loop argument must agree with Future')
+    fs = set(asyncio.async(f, loop=loop) for f in fs)
+    _check_yield_greenthread(next(iter(fs))._loop, "yield_futures")
+
+    def is_exception(fut):
+        return not fut.cancelled() and fut.exception() is not None
+
+    def completed(done, pending):
+        if not pending:
+            return True
+        if return_when == asyncio.FIRST_COMPLETED:
+            return bool(done)
+        if return_when == asyncio.FIRST_EXCEPTION:
+            return any(is_exception(fut) for fut in done)
+        return False
+
+    done = set(fut for fut in fs if fut.done())
+    pending = fs - done
+    if completed(done, pending):
+        return done, pending
+
+    event = eventlet.event.Event()
+    counter = [len(pending)]
+    def on_completion(fut):
+        counter[0] -= 1
+        if event.ready():
+            return
+        if (counter[0] <= 0
+        or return_when == asyncio.FIRST_COMPLETED
+        or (return_when == asyncio.FIRST_EXCEPTION and is_exception(fut))):
+            event.send()
+
+    for fut in pending:
+        fut.add_done_callback(on_completion)
+    try:
+        event.wait()
+    finally:
+        for fut in pending:
+            fut.remove_done_callback(on_completion)
+
+    done = set(fut for fut in fs if fut.done())
+    return done, fs - done
+
+
+def _wake_waiter(waiter, value):
+    if isinstance(waiter, asyncio.Future):
+        waiter.set_result(value)
+    else:
+        waiter.send(value)
+
+
+def _is_cancelled(waiter):
+    return isinstance(waiter, asyncio.Future) and waiter.cancelled()
+
+
+class Channel(object):
+    """Bounded channel passing items between greenthreads and coroutines.
+
+    Greenthreads call put(), put_many(), get() and get_many() which block
+    the greenthread. Coroutines call async_put(), async_put_many(),
+    async_get() and async_get_many() which return futures.
+
+    The channel contains at most maxsize items: putters wait until there is
+    enough space. get_many() and async_get_many() get all available items
+    (at most max_items) at once, so the cost of switching between the
+    greenthread and the event loop is paid per batch, not per item.
+
+    Greenthreads and the event loop must run in the same thread.
+    """
+
+    def __init__(self, maxsize, loop=None):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be greater than 0")
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self._loop = loop
+        self._maxsize = maxsize
+        self._items = collections.deque()
+        # waiting getters: (max_items, waiter, single) tuples where waiter
+        # is an eventlet.event.Event() or a Future
+        self._getters = collections.deque()
+        # waiting putters: (items, waiter) tuples where items is the deque
+        # of items which are not in the channel yet
+        self._putters = collections.deque()
+
+    def qsize(self):
+        """Number of items in the channel."""
+        return len(self._items)
+
+    def _transfer(self):
+        items = self._items
+        getters = self._getters
+        putters = self._putters
+        while True:
+            # move items of waiting putters into the channel
+            while putters and len(items) < self._maxsize:
+                pending, waiter = putters[0]
+                if _is_cancelled(waiter):
+                    putters.popleft()
+                    continue
+                while pending and len(items) < self._maxsize:
+                    items.append(pending.popleft())
+                if pending:
+                    break
+                putters.popleft()
+                _wake_waiter(waiter, None)
+
+            if not (getters and items):
+                break
+
+            # give items to waiting getters
+            while getters and items:
+                max_items, waiter, single = getters.popleft()
+                if _is_cancelled(waiter):
+                    continue
+                _wake_waiter(waiter, self._take(max_items, single))
+
+            if not putters:
+                break
+
+    def _take(self, max_items, single):
+        items = self._items
+        if single:
+            return items.popleft()
+        if max_items is None or max_items >= len(items):
+            batch = list(items)
+            items.clear()
+        else:
+            batch = [items.popleft() for index in range(max_items)]
+        return batch
+
+    def _put_nowait(self, pending):
+        # Put as much items as possible without waiting, return True if all
+        # items are in the channel
+        items = self._items
+        while pending and not self._putters and len(items) < self._maxsize:
+            while pending and len(items) < self._maxsize:
+                items.append(pending.popleft())
+            self._transfer()
+        return not pending
+
+    def _get_nowait(self, max_items, single):
+        if self._getters or not self._items:
+            return False, None
+        value = self._take(max_items, single)
+        self._transfer()
+        return True, value
+
+    def _wait(self, waiters, entry, event):
+        try:
+            return event.wait()
+        except BaseException:
+            # the greenthread was killed
+            try:
+                waiters.remove(entry)
+            except ValueError:
+                pass
+            raise
+
+    def put_many(self, items):
+        """Put items into the channel from a greenthread.
+
+        Block until all items are in the channel.
+        """
+        pending = collections.deque(items)
+        if self._put_nowait(pending):
+            return
+        _check_yield_greenthread(self._loop, "Channel.put_many")
+        event = eventlet.event.Event()
+        entry = (pending, event)
+        self._putters.append(entry)
+        self._wait(self._putters, entry, event)
+
+    def put(self, item):
+        """Put an item into the channel from a greenthread."""
+        self.put_many((item,))
+
+    def _get(self, max_items, single):
+        done, value = self._get_nowait(max_items, single)
+        if done:
+            return value
+        _check_yield_greenthread(self._loop, "Channel.get")
+        event = eventlet.event.Event()
+        entry = (max_items, event, single)
+        self._getters.append(entry)
+        return self._wait(self._getters, entry, event)
+
+    def get_many(self, max_items=None):
+        """Get a list of items from a greenthread.
+
+        Block until at least one item is available, return at most
+        max_items items (all available items if max_items is None).
+        """
+        return self._get(max_items, False)
+
+    def get(self):
+        """Get an item from a greenthread."""
+        return self._get(1, True)
+
+    def async_put_many(self, items):
+        """Put items into the channel from a coroutine.
+
+        Return a future which is done when all items are in the channel.
+        """
+        fut = asyncio.Future(loop=self._loop)
+        pending = collections.deque(items)
+        if self._put_nowait(pending):
+            fut.set_result(None)
+        else:
+            self._putters.append((pending, fut))
+        return fut
+
+    def async_put(self, item):
+        """Put an item into the channel from a coroutine, return a future."""
+        return self.async_put_many((item,))
+
+    def _async_get(self, max_items, single):
+        fut = asyncio.Future(loop=self._loop)
+        done, value = self._get_nowait(max_items, single)
+        if done:
+            fut.set_result(value)
+        else:
+            self._getters.append((max_items, fut, single))
+        return fut
+
+    def async_get_many(self, max_items=None):
+        """Get a list of items from a coroutine.
+
+        Return a future of a list of at least one item and at most max_items
+        items (all available items if max_items is None).
+        """
+        return self._async_get(max_items, False)
+
+    def async_get(self):
+        """Get an item from a coroutine, return a future."""
+        return self._async_get(1, True)
+
+
+class _GeneratorEnd(object):
+    # Last item put into the channel by the producer of wrap_generator()
+    def __init__(self, exc=None):
+        self.exc = exc
+
+
+class _GreenGenerator(object):
+    """Asynchronous iterator returned by wrap_generator()."""
+
+    def __init__(self, gen, prefetch, loop):
+        self._loop = loop
+        self._channel = Channel(prefetch, loop=loop)
+        # items already got from the channel
+        self._buffer = collections.deque()
+        self._end = None
+        # pending async_get_many() future and the future of the next item
+        self._get = None
+        self._next = None
+        self._greenthread = eventlet.spawn(self._produce, gen)
+
+    def _produce(self, gen):
+        put = self._channel.put
+        it = None
+        try:
+            it = iter(gen)
+            for item in it:
+                put(item)
+        except greenlet.GreenletExit:
+            # aclose() killed the greenthread
+            close = getattr(it, 'close', None)
+            if close is not None:
+                close()
+            raise
+        except Exception as exc:
+            put(_GeneratorEnd(exc))
+        else:
+            put(_GeneratorEnd())
+
+    def _set_next(self, fut, item):
+        if isinstance(item, _GeneratorEnd):
+            self._end = item
+            if item.exc is not None:
+                fut.set_exception(item.exc)
+            else:
+                fut.set_exception(StopAsyncIteration())
+        else:
+            fut.set_result(item)
+
+    def _fill(self, get):
+        self._get = None
+        fut = self._next
+        if get.cancelled():
+            # aclose() was called
+            if not fut.done():
+                fut.set_exception(StopAsyncIteration())
+            return
+        buffer = self._buffer
+        buffer.extend(get.result())
+        if fut.cancelled():
+            # keep the items for the next call
+            return
+        self._set_next(fut, buffer.popleft())
+
+    def next_future(self):
+        """Return a future of the next item.
+
+        The future raises StopAsyncIteration when the generator is
+        exhausted, or the exception raised by the generator.
+        """
+        fut = asyncio.Future(loop=self._loop)
+        if self._get is not None:
+            if not self._next.cancelled():
+                raise RuntimeError("the previous item is still pending")
+            # the previous call was cancelled: reuse its pending get
+            self._next = fut
+        elif self._buffer:
+            self._set_next(fut, self._buffer.popleft())
+        elif self._end is not None:
+            fut.set_exception(StopAsyncIteration())
+        else:
+            # get all items produced in advance at once
+            self._next = fut
+            self._get = self._channel.async_get_many()
+            self._get.add_done_callback(self._fill)
+        return fut
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        return self.next_future()
+
+    def aclose(self):
+        """Stop the generator and kill its greenthread.
+
+        Return a done future, for "await it.aclose()".
+        """
+        if self._end is None:
+            self._end = _GeneratorEnd()
+            self._buffer.clear()
+            if self._get is not None:
+                self._get.cancel()
+            self._greenthread.kill()
+        fut = asyncio.Future(loop=self._loop)
+        fut.set_result(None)
+        return fut
+
+
+def wrap_generator(gen, prefetch=1, loop=None):
+    """Iterate on a generator running in a greenthread from a coroutine.
+
+    Return an asynchronous iterator ("async for"). The generator is run in a
+    new greenthread which produces up to prefetch items in advance.
+
+    With trollius, use "yield From(it.next_future())" to get the next item.
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    return _GreenGenerator(gen, prefetch, loop)
+
+
+if hasattr(time, 'perf_counter'):
+    _perf_counter = time.perf_counter
+else:
+    # Python 2
+    _perf_counter = time.time
+# the sleep() of the watchdog thread must not be monkey-patched
+_sleep = eventlet.patcher.original('time').sleep
+
+if hasattr(time, 'thread_time'):
+    _thread_time = time.thread_time
+elif hasattr(time, 'CLOCK_THREAD_CPUTIME_ID'):
+    # Python 3.3-3.6
+    _thread_time = functools.partial(time.clock_gettime,
+                                     time.CLOCK_THREAD_CPUTIME_ID)
+else:
+    _thread_time = None
+
+# Hooks called at each greenlet switch of the current thread, see
+# _add_switch_hook()
+_switch_hooks = threading.local()
+
+
+def _set_switch_tracer(hooks, previous):
+    # Install a greenlet tracer calling the hooks: the tracer is called at
+    # each switch, it must be fast
+    hooks = tuple(hooks)
+
+    def trace(event, args):
+        if event == 'switch' or event == 'throw':
+            for hook in hooks:
+                hook(*args)
+        if previous is not None:
+            previous(event, args)
+
+    greenlet.settrace(trace)
+
+
+def _add_switch_hook(hook):
+    """Call hook(origin, target) at each greenlet switch of the current
+    thread."""
+    if not hasattr(greenlet, 'settrace'):
+        raise RuntimeError("greenlet.settrace() requires greenlet 0.4 "
+                           "or newer")
+    hooks = getattr(_switch_hooks, 'hooks', None)
+    if not hooks:
+        hooks = _switch_hooks.hooks = []
+        _switch_hooks.previous = greenlet.gettrace()
+    hooks.append(hook)
+    _set_switch_tracer(hooks, _switch_hooks.previous)
+
+
+def _remove_switch_hook(hook):
+    hooks = _switch_hooks.hooks
+    hooks.remove(hook)
+    if hooks:
+        _set_switch_tracer(hooks, _switch_hooks.previous)
+    else:
+        greenlet.settrace(_switch_hooks.previous)
+        _switch_hooks.previous = None
+
+
+def _callback_key(callback):
+    while isinstance(callback, functools.partial):
+        callback = callback.func
+    code = getattr(callback, '__code__', None)
+    if code is not None:
+        return code
+    return getattr(callback, '__qualname__', None) or repr(callback)
+
+
+def _format_callback_key(key):
+    if hasattr(key, 'co_name'):
+        return '%s (%s:%s)' % (key.co_name, key.co_filename,
+                               key.co_firstlineno)
+    return key
+
+
+def _format_stack(frame):
+    if frame is None:
+        return None
+    return traceback.format_list(traceback.extract_stack(frame))
+
+
+class _HookedReady(collections.deque):
+    # Ready queue of an event loop calling handle hooks: the event loop pops
+    # a handle just before calling it
+    def popleft(self):
+        handle = collections.deque.popleft(self)
+        for hook in self.loop._handle_hooks:
+            hook(handle)
+        return handle
+
+
+class Profiler(object):
+    """Profile greenthread runs and event loop callbacks without signals.
+
+    Record the duration of runs of greenthreads (between two greenlet
+    switches) and of callbacks of the event loop into histograms: one run of
+    sample_interval is recorded. A watchdog thread captures the stack of the
+    thread of the event loop when a recorded run takes longer than threshold
+    seconds.
+    """
+
+    def __init__(self, threshold=0.100, sample_interval=10, max_slow=100):
+        if sample_interval < 1:
+            raise ValueError("sample_interval must be at least 1")
+        self.threshold = threshold
+        self.sample_interval = sample_interval
+        self._max_slow = max_slow
+        self._loop = None
+        self._thread_ident = None
+        self._hub_greenlet = None
+        self._watchdog = None
+        self._running = False
+        self.reset()
+
+    def reset(self):
+        """Forget recorded runs."""
+        # greenlet => _Histogram of run durations in microseconds
+        self._greenlets = weakref.WeakKeyDictionary()
+        self._greenlet_runs = _Histogram()
+        # callback key => _Histogram of call durations in microseconds
+        self._callbacks = {}
+        self._callback_count = 0
+        self._slow = collections.deque(maxlen=self._max_slow)
+        # number of greenlet switches until the next sampled run
+        self._skip = 0
+        # sampled run: greenlet, start time (None if the current run is not
+        # sampled) and identifier of the first sample of the run. The
+        # identifier is incremented when a sampled run or callback starts,
+        # the watchdog stores (identifier, stack) in _captured.
+        self._current = greenlet.getcurrent()
+        self._run_start = _perf_counter()
+        self._run_id = 0
+        self._run_first_id = 0
+        self._captured = None
+        # current sampled callback: (handle, start time, identifier)
+        self._callback = None
+
+    def start(self, loop=None):
+        """Start profiling greenthreads of the current thread and callbacks
+        of the event loop."""
+        if self._running:
+            raise RuntimeError("the profiler is already running")
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        _add_switch_hook(self._switch)
+        self._running = True
+        self._loop = loop
+        self._thread_ident = _get_thread_ident()
+        self._hub_greenlet = eventlet.hubs.get_hub().greenlet
+        self._start_run(greenlet.getcurrent(), _perf_counter())
+        if isinstance(loop, EventLoop):
+            loop._add_handle_hook(self._handle_hook)
+        if self.threshold:
+            self._watchdog = threading.Thread(target=self._watch)
+            self._watchdog.daemon = True
+            self._watchdog.start()
+
+    def stop(self):
+        """Stop profiling."""
+        if not self._running:
+            return
+        self._running = False
+        _remove_switch_hook(self._switch)
+        if isinstance(self._loop, EventLoop):
+            self._loop._remove_handle_hook(self._handle_hook)
+        self._end_callback()
+        self._loop = None
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+
+    def _watch(self):
+        interval = self.threshold / 2.0
+        while self._running:
+            _sleep(interval)
+            run_id = self._run_id
+            if (self._captured is not None
+            and self._captured[0] == run_id):
+                continue
+            callback = self._callback
+            if callback is not None:
+                start = callback[1]
+            elif self._current is self._hub_greenlet:
+                # the hub is waiting for events
+                continue
+            else:
+                start = self._run_start
+            if start is None or _perf_counter() - start < self.threshold:
+                # no sampled run or callback, or not slow
+                continue
+            frame = sys._current_frames().get(self._thread_ident)
+            if run_id == self._run_id:
+                self._captured = (run_id, _format_stack(frame))
+
+    def _record_slow(self, kind, name, duration, stack):
+        self._slow.append({'type': kind, 'name': name,
+                           'duration': duration, 'stack': stack})
+
+    def _start_run(self, target, now):
+        self._current = target
+        self._run_start = now
+        self._run_id += 1
+        self._run_first_id = self._run_id
+
+    def _switch(self, origin, target):
+        if self._run_start is None:
+            # the run which ends is not sampled: only count switches, the
+            # hook is called at each switch
+            self._skip -= 1
+            if self._skip:
+                return
+            self._start_run(target, _perf_counter())
+            return
+
+        now = _perf_counter()
+        duration = now - self._run_start
+        runs = self._greenlets.get(origin)
+        if runs is None:
+            runs = self._greenlets[origin] = _Histogram()
+        usec = int(duration * 1e6)
+        runs.add(usec)
+        self._greenlet_runs.add(usec)
+
+        # the hub waits for events in its runs
+        if (duration >= self.threshold and self.threshold
+        and origin is not self._hub_greenlet):
+            captured = self._captured
+            if captured is not None and captured[0] >= self._run_first_id:
+                stack = captured[1]
+            else:
+                stack = _format_stack(origin.gr_frame)
+            self._record_slow('greenthread', repr(origin), duration, stack)
+
+        self._skip = self.sample_interval - 1
+        if self._skip:
+            self._run_start = None
+        else:
+            self._start_run(target, now)
+
+    def _handle_hook(self, handle):
+        if self._callback is not None:
+            self._end_callback()
+        if handle is None:
+            return
+        self._callback_count += 1
+        if not (self._callback_count % self.sample_interval
+                or handle._cancelled):
+            self._run_id += 1
+            self._callback = (handle, _perf_counter(), self._run_id)
+
+    def _end_callback(self):
+        if self._callback is None:
+            return
+        handle, start, run_id = self._callback
+        self._callback = None
+        duration = _perf_counter() - start
+        key = _callback_key(handle._callback)
+        runs = self._callbacks.get(key)
+        if runs is None:
+            runs = self._callbacks[key] = _Histogram()
+        runs.add(int(duration * 1e6))
+        if self.threshold and duration >= self.threshold:
+            captured = self._captured
+            if captured is not None and captured[0] == run_id:
+                stack = captured[1]
+            else:
+                stack = None
+            self._record_slow('callback', _format_callback_key(key),
+                              duration, stack)
+
+    def get_report(self, limit=None):
+        """Get recorded runs as a dictionary.
+
+        Histograms are in microseconds. Callbacks and greenthreads are
+        sorted by total duration, at most limit of each kind are reported.
+        """
+        callbacks = sorted(self._callbacks.items(),
+                           key=lambda item: item[1].total, reverse=True)
+        greenlets = sorted(self._greenlets.items(),
+                           key=lambda item: item[1].total, reverse=True)
+        if limit is not None:
+            callbacks = callbacks[:limit]
+            greenlets = greenlets[:limit]
+        return {
+            'threshold': self.threshold,
+            'sample_interval': self.sample_interval,
+            'callbacks': [{'callback': _format_callback_key(key),
+                           'runs': runs.as_dict()}
+                          for key, runs in callbacks],
+            'greenthreads': [{'greenthread': repr(glet),
+                              'runs': runs.as_dict()}
+                             for glet, runs in greenlets],
+            'greenthread_runs': self._greenlet_runs.as_dict(),
+            'slow': list(self._slow),
+        }
+
+
+def _get_cpu_accounting():
+    # CpuAccounting running in the current thread, or None
+    return getattr(_switch_hooks, 'cpu_accounting', None)
+
+
+class _CpuEntry(object):
+    __slots__ = ('kind', 'name', 'owner', 'cpu', 'runs')
+
+    def __init__(self, kind, name, owner=None):
+        self.kind = kind
+        self.name = name
+        self.owner = owner
+        self.cpu = 0.0
+        self.runs = 0
+
+    def as_dict(self):
+        return {'type': self.kind, 'name': self.name, 'owner': self.owner,
+                'cpu': self.cpu, 'runs': self.runs}
+
+
+class CpuAccounting(object):
+    """Charge the CPU time of the thread to greenthreads and tasks.
+
+    At each greenlet switch and before each callback of the event loop, the
+    CPU time consumed since the previous switch is charged to the running
+    greenthread, to the task of the callback, or to the callback.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._running = False
+        self.reset()
+
+    def reset(self):
+        """Forget the CPU time charged so far."""
+        # id(greenlet or task) => _CpuEntry, and weak references
+        self._entries = {}
+        self._refs = {}
+        # callback key => _CpuEntry of callbacks which are not task steps
+        self._callbacks = {}
+        # (type, name) => [cpu, runs, count] of dead greenlets and tasks
+        self._finished = {}
+        self._greenlet_labels = weakref.WeakKeyDictionary()
+        self._entry = None
+        self._handle_entry = None
+        self._handle_greenlet = None
+        if self._running:
+            self._entry = self._greenlet_entry(greenlet.getcurrent())
+            self._last = _thread_time()
+
+    def start(self, loop=None):
+        """Start accounting in the current thread for the event loop."""
+        if _thread_time is None:
+            raise RuntimeError("the thread CPU time is not available")
+        if self._running:
+            raise RuntimeError("the CPU accounting is already running")
+        if _get_cpu_accounting() is not None:
+            raise RuntimeError("a CPU accounting is already running "
+                               "in this thread")
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        _add_switch_hook(self._switch)
+        _switch_hooks.cpu_accounting = self
+        self._running = True
+        self._loop = loop
+        self._hub_greenlet = eventlet.hubs.get_hub().greenlet
+        if isinstance(loop, EventLoop):
+            loop._add_handle_hook(self._handle_hook)
+        self._entry = self._greenlet_entry(greenlet.getcurrent())
+        self._last = _thread_time()
+
+    def stop(self):
+        """Stop accounting."""
+        if not self._running:
+            return
+        self._charge()
+        self._running = False
+        _remove_switch_hook(self._switch)
+        _switch_hooks.cpu_accounting = None
+        if isinstance(self._loop, EventLoop):
+            self._loop._remove_handle_hook(self._handle_hook)
+        self._loop = None
+        self._entry = None
+
+    def _charge(self):
+        now = _thread_time()
+        entry = self._entry
+        entry.cpu += now - self._last
+        entry.runs += 1
+        self._last = now
+
+    def _switch(self, origin, target):
+        self._charge()
+        if self._entry.name is None:
+            # the name of a greenthread is only known once it started
+            self._entry.name = self._greenlet_name(origin)
+        if (target is self._handle_greenlet
+        and self._handle_entry is not None):
+            self._entry = self._handle_entry
+        else:
+            self._entry = self._greenlet_entry(target)
+
+    def _handle_hook(self, handle):
+        self._charge()
+        current = greenlet.getcurrent()
+        if handle is None:
+            # end of the iteration
+            self._handle_entry = None
+            self._entry = self._greenlet_entry(current)
+            return
+        entry = self._handle_entry = self._handle_to_entry(handle)
+        self._handle_greenlet = current
+        self._entry = entry
+
+    def _track(self, obj, entry):
+        key = id(obj)
+
+        def finished(ref):
+            if self._entries.get(key) is not entry:
+                # forgotten by reset()
+                return
+            del self._entries[key]
+            del self._refs[key]
+            name = entry.name or entry.kind
+            total = self._finished.setdefault((entry.kind, name),
+                                              [0.0, 0, 0])
+            total[0] += entry.cpu
+            total[1] += entry.runs
+            total[2] += 1
+
+        self._entries[key] = entry
+        self._refs[key] = weakref.ref(obj, finished)
+
+    def _greenlet_entry(self, glet):
+        entry = self._entries.get(id(glet))
+        if entry is not None:
+            return entry
+        if glet is self._hub_greenlet:
+            entry = _CpuEntry('hub', 'hub')
+        elif glet is getattr(self._loop, '_greenthread', None):
+            entry = _CpuEntry('loop', 'event loop')
+        else:
+            entry = _CpuEntry('greenthread', None)
+            if (isinstance(glet, eventlet.greenthread.GreenThread)
+            and not glet and not glet.dead):
+                # the greenthread didn't start yet: get its function when
+                # it exits, if it exits in its first run
+                glet.link(self._greenthread_exit)
+        self._track(glet, entry)
+        return entry
+
+    def _greenthread_exit(self, gt):
+        entry = self._entries.get(id(gt))
+        if entry is not None and entry.name is None:
+            entry.name = self._greenlet_name(gt)
+
+    def _greenlet_name(self, glet):
+        func = self._greenlet_labels.get(glet)
+        if glet is greenlet.getcurrent():
+            frame = sys._getframe()
+        else:
+            frame = glet.gr_frame
+        if func is None and frame is not None:
+            # bottom frame of the greenthread
+            while frame.f_back is not None:
+                frame = frame.f_back
+            if isinstance(glet, eventlet.greenthread.GreenThread):
+                # GreenThread.main(function, args, kwargs)
+                func = frame.f_locals.get('function')
+            else:
+                return _format_callback_key(frame.f_code)
+        if func is None:
+            return type(glet).__name__
+        return _format_callback_key(_callback_key(func))
+
+    def _task_entry(self, task, owner=None):
+        entry = self._entries.get(id(task))
+        if entry is None:
+            coro = getattr(task, '_coro', None)
+            code = (getattr(coro, 'cr_code', None)
+                    or getattr(coro, 'gi_code', None))
+            if code is not None:
+                name = _format_callback_key(code)
+            else:
+                name = repr(coro)
+            entry = _CpuEntry('task', name, owner)
+            self._track(task, entry)
+        return entry
+
+    def _handle_to_entry(self, handle):
+        callback = handle._callback
+        task = getattr(callback, '__self__', None)
+        if isinstance(task, asyncio.Task):
+            return self._task_entry(task)
+        key = _callback_key(callback)
+        entry = self._callbacks.get(key)
+        if entry is None:
+            entry = _CpuEntry('callback', _format_callback_key(key))
+            self._callbacks[key] = entry
+        return entry
+
+    def _wrap_greenthread(self, gt, func):
+        # Called by wrap_greenthread() when the greenthread starts: the
+        # greenthread is charged on behalf of the wrapper
+        self._greenlet_labels[gt] = func
+
+    def _set_owner(self, gt=None, task=None):
+        # gt or task runs on behalf of the current greenthread or task
+        owner = self._entry.name
+        if owner is None:
+            owner = self._greenlet_name(greenlet.getcurrent())
+            self._entry.name = owner
+        if task is not None:
+            entry = self._task_entry(task)
+        else:
+            entry = self._greenlet_entry(gt)
+        entry.owner = owner
+
+    def get_report(self, limit=10):
+        """Get the CPU time charged to greenthreads, tasks and callbacks.
+
+        Return a dictionary: 'top' lists the greenthreads and tasks still
+        alive and callbacks which consumed the most CPU time, 'by_name' sums
+        the CPU time by name (function or coroutine), including finished
+        greenthreads and tasks. Each list has at most limit entries.
+        """
+        if self._running:
+            self._charge()
+        for key, entry in list(self._entries.items()):
+            if entry.name is None:
+                glet = self._refs[key]()
+                if glet is not None:
+                    entry.name = self._greenlet_name(glet)
+        entries = list(self._entries.values()) + list(self._callbacks.values())
+        totals = {}
+        for (kind, name), total in self._finished.items():
+            totals[(kind, name)] = list(total)
+        for entry in entries:
+            total = totals.setdefault((entry.kind, entry.name), [0.0, 0, 0])
+            total[0] += entry.cpu
+            total[1] += entry.runs
+            total[2] += 1
+
+        entries.sort(key=lambda entry: entry.cpu, reverse=True)
+        by_name = sorted(totals.items(), key=lambda item: item[1][0],
+                         reverse=True)
+        return {
+            'cpu': sum(total[0] for total in totals.values()),
+            'top': [entry.as_dict() for entry in entries[:limit]],
+            'by_name': [{'type': kind, 'name': name, 'cpu': total[0],
+                         'runs': total[1], 'count': total[2]}
+                        for (kind, name), total in by_name[:limit]],
+        }
+
+
+# private attributes of eventlet.tpool reset by _reset_after_fork(): the
+# state of the pool, and its socket pair (or its pipe in eventlet 0.14)
+_TPOOL_STATE = ('_setup_already', '_threads')
+_TPOOL_FILES = ('_rsock', '_wsock', '_rfile', '_wfile')
+
+
+def _reset_after_fork():
+    # The child process inherits the hub of the parent: its poll object, its
+    # listeners and its timers are shared with the parent. Use a new hub of
+    # the same class.
+    hub_class = type(eventlet.hubs.get_hub())
+    eventlet.hubs.use_hub(hub_class)
+
+    # Threads of the eventlet thread pool don't exist in the child process.
+    # tpool.killall() cannot be used: killing the tpool greenthread would
+    # resume the hub of the parent process. Reset the state of tpool if it
+    # has the expected attributes (eventlet 0.14 and newer).
+    tpool = sys.modules.get('eventlet.tpool')
+    if (tpool is not None and getattr(tpool, '_setup_already', False)
+    and all(hasattr(tpool, name) for name in _TPOOL_STATE)):
+        for name in _TPOOL_FILES:
+            fileobj = getattr(tpool, name, None)
+            if fileobj is not None:
+                fileobj.close()
+                setattr(tpool, name, None)
+        del tpool._threads[:]
+        tpool._setup_already = False
+
+    # Don't use the event loop of the parent process
+    asyncio.set_event_loop(None)
+
+
+class PreforkServer(object):
+    """TCP server running an event loop in each forked worker process.
+
+    The listening socket is created by the constructor. run() forks workers
+    and supervises them: a worker which exits unexpectedly is restarted,
+    SIGHUP reloads workers and SIGTERM or SIGINT stops the server.
+
+    If reuse_port is true, each worker listens on its own socket bound with
+    SO_REUSEPORT, and the kernel distributes connections between workers.
+
+    Only available on UNIX.
+    """
+
+    # minimum delay in seconds between the start of a worker and its restart
+    restart_delay = 1.0
+
+    def __init__(self, protocol_factory, host=None, port=0, workers=None,
+                 reuse_port=False, backlog=100, graceful_timeout=10.0,
+                 hub_driven=False):
+        if not hasattr(os, 'fork'):
+            raise NotImplementedError("PreforkServer requires os.fork()")
+        if reuse_port and not hasattr(socket, 'SO_REUSEPORT'):
+            raise ValueError("SO_REUSEPORT is not supported")
+        if workers is None:
+            import multiprocessing
+            workers = multiprocessing.cpu_count()
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self._protocol_factory = protocol_factory
+        self._nworker = workers
+        self._reuse_port = reuse_port
+        self._backlog = backlog
+        self._graceful_timeout = graceful_timeout
+        self._hub_driven = hub_driven
+
+        infos = socket.getaddrinfo(host, port, socket.AF_UNSPEC,
+                                   socket.SOCK_STREAM, 0, socket.AI_PASSIVE)
+        family, type_, proto, canonname, address = infos[0]
+        self._family = family
+        # With SO_REUSEPORT, the socket of the supervisor is bound but not
+        # listening: it reserves the address and receives no connection
+        self._sock = self._create_socket(address)
+        self._address = self._sock.getsockname()
+        if not reuse_port:
+            self._sock.listen(backlog)
+
+        # pid => (generation, start time) of running workers
+        self._workers = {}
+        # pid => deadline to kill stopping workers (None once killed)
+        self._stopping = {}
+        self._generation = 0
+        # start times of crashed workers to restart
+        self._crashed = []
+        self._running = False
+        self._reload = False
+        self._wakeup_fds = None
+
+    def _create_socket(self, address):
+        sock = socket.socket(self._family, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self._reuse_port:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(address)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def getsockname(self):
+        """Address of the listening socket."""
+        return self._address
+
+    def get_pids(self):
+        """List of the process identifiers of the running workers."""
+        return sorted(self._workers)
+
+    def close(self):
+        """Close the listening socket."""
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _wakeup(self):
+        if self._wakeup_fds is None:
+            return
+        try:
+            os.write(self._wakeup_fds[1], b'\0')
+        except OSError:
+            pass
+
+    def reload(self):
+        """Start new workers and stop gracefully the old workers."""
+        self._reload = True
+        self._wakeup()
+
+    def stop(self):
+        """Stop gracefully the workers and exit run()."""
+        self._running = False
+        self._wakeup()
+
+    def _signal_handler(self, signum, frame):
+        if signum == signal.SIGHUP:
+            self._reload = True
+        elif signum in (signal.SIGTERM, signal.SIGINT):
+            self._running = False
+
+    def run(self):
+        """Fork the workers and supervise them until stop() is called.
+
+        Must be called from the main thread.
+        """
+        if self._sock is None:
+            raise RuntimeError("the server is closed")
+        rfd, wfd = os.pipe()
+        self._wakeup_fds = (rfd, wfd)
+        signums = (signal.SIGCHLD, signal.SIGHUP, signal.SIGTERM,
+                   signal.SIGINT)
+        old_handlers = {}
+        for fd in (rfd, wfd):
+            _set_nonblocking(fd)
+        old_wakeup_fd = signal.set_wakeup_fd(wfd)
+        try:
+            for signum in signums:
+                old_handlers[signum] = signal.signal(signum,
+                                                     self._signal_handler)
+            self._supervise()
+        finally:
+            for signum, handler in old_handlers.items():
+                signal.signal(signum, handler)
+            signal.set_wakeup_fd(old_wakeup_fd)
+            self._wakeup_fds = None
+            os.close(rfd)
+            os.close(wfd)
+
+    def _supervise(self):
+        self._running = True
+        for index in range(self._nworker):
+            self._spawn()
+
+        while self._running or self._workers:
+            self._wait(self._get_timeout())
+            self._reap()
+            now = time.time()
+
+            if not self._running:
+                self._terminate(self._workers, now)
+            elif self._reload:
+                self._reload = False
+                old_workers = list(self._workers)
+                self._generation += 1
+                del self._crashed[:]
+                for index in range(self._nworker):
+                    self._spawn()
+                self._terminate(old_workers, now)
+            else:
+                while (self._crashed
+                       and self._crashed[0] + self.restart_delay <= now):
+                    del self._crashed[0]
+                    self._spawn()
+
+            for pid, deadline in list(self._stopping.items()):
+                if deadline is not None and deadline <= now:
+                    logger.warning("Kill the worker %s: it did not stop "
+                                   "after %.1f sec",
+                                   pid, self._graceful_timeout)
+                    self._kill(pid, signal.SIGKILL)
+                    self._stopping[pid] = None
+
+    def _get_timeout(self):
+        deadlines = [deadline for deadline in self._stopping.values()
+                     if deadline is not None]
+        if self._running and self._crashed:
+            deadlines.append(self._crashed[0] + self.restart_delay)
+        if not deadlines:
+            return None
+        return max(min(deadlines) - time.time(), 0.0)
+
+    def _wait(self, timeout):
+        rfd = self._wakeup_fds[0]
+        try:
+            select.select([rfd], [], [], timeout)
+        except (OSError, select.error) as exc:
+            # Python 2: select() is interrupted by signals
+            if exc.args[0] != errno.EINTR:
+                raise
+        try:
+            while os.read(rfd, 4096):
+                pass
+        except OSError as exc:
+            if exc.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def _reap(self):
+        while self._workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as exc:
+                if exc.errno != errno.ECHILD:
+                    raise
+                break
+            if not pid:
+                break
+            if pid not in self._workers:
+                continue
+            generation, start_time = self._workers.pop(pid)
+            stopping = pid in self._stopping
+            self._stopping.pop(pid, None)
+            if (not stopping and self._running
+            and generation == self._generation):
+                logger.error("Worker %s exited unexpectedly (status %s): "
+                             "restart it", pid, status)
+                self._crashed.append(start_time)
+
+    def _kill(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except OSError as exc:
+            if exc.errno != errno.ESRCH:
+                raise
+
+    def _terminate(self, pids, now):
+        deadline = now + self._graceful_timeout
+        for pid in pids:
+            if pid in self._stopping:
+                continue
+            self._stopping[pid] = deadline
+            self._kill(pid, signal.SIGTERM)
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid:
+            self._workers[pid] = (self._generation, time.time())
+            return
+
+        # child process
+        status = 1
+        try:
+            self._setup_worker()
+            self._serve()
+            status = 0
+        except BaseException:
+            logger.exception("Worker %s failed", os.getpid())
+        finally:
+            os._exit(status)
+
+    def _setup_worker(self):
+        signal.set_wakeup_fd(-1)
+        for fd in self._wakeup_fds:
+            os.close(fd)
+        self._wakeup_fds = None
+        for signum in (signal.SIGCHLD, signal.SIGHUP, signal.SIGTERM):
+            signal.signal(signum, signal.SIG_DFL)
+        # SIGINT from the terminal is also sent to the workers: only the
+        # supervisor handles it
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        _reset_after_fork()
+
+    def _serve(self):
+        if self._reuse_port:
+            sock = self._create_socket(self._address)
+            sock.listen(self._backlog)
+            self._sock.close()
+        else:
+            sock = self._sock
+        self._sock = None
+
+        loop = EventLoop(hub_driven=self._hub_driven)
+        asyncio.set_event_loop(loop)
+        try:
+            connections = set()
+            stopping = []
+
+            def protocol_factory():
+                protocol = self._protocol_factory()
+                connection_lost = protocol.connection_lost
+
+                def track_connection_lost(exc):
+                    connections.discard(protocol)
+                    try:
+                        connection_lost(exc)
+                    finally:
+                        if not connections and stopping:
+                            loop.stop()
+
+                connections.add(protocol)
+                protocol.connection_lost = track_connection_lost
+                return protocol
+
+            server = loop.run_until_complete(
+                loop.create_server(protocol_factory, sock=sock))
+            loop.add_signal_handler(signal.SIGTERM, loop.stop)
+            loop.run_forever()
+
+            # graceful stop: stop accepting connections and wait until
+            # active connections are closed
+            stopping.append(True)
+            server.close()
+            if connections:
+                loop.call_later(self._graceful_timeout, loop.stop)
+                loop.run_forever()
+        finally:
+            loop.close()
+
+
+def _set_nonblocking(fd):
+    import fcntl
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
@@ -0,0 +1,64 @@
+"""Benchmark the call_soon() round-trip latency.
+
+A greenthread schedules a callback with call_soon() while the event loop is
+waiting in select(), and waits until the callback is called.
+
+Compare the same-thread wakeup (the selector event is sent directly) to the
+self-pipe wakeup (a byte is written into the self-pipe and read back by the
+event loop), and to the hub-driven mode (the hub runs iterations of the event
+loop).
+"""
+import eventlet
+
+from benchutil import (aioeventlet, new_event_loop, perf_counter, result,
+                       print_results)
+
+LOOPS = 5000
+
+
+class HubDrivenEventLoop(aioeventlet.EventLoop):
+    def __init__(self):
+        super(HubDrivenEventLoop, self).__init__(hub_driven=True)
+
+
+class SelfPipeEventLoop(aioeventlet.EventLoop):
+    """Event loop always waking up select() with the self-pipe."""
+
+    def _wakeup_selector(self):
+        if self._selector is not None and self._selector._event is not None:
+            self._write_to_self()
+
+
+def pinger(loop, loops, timings):
+    for index in range(loops):
+        event = eventlet.event.Event()
+        t0 = perf_counter()
+        loop.call_soon(event.send)
+        event.wait()
+        timings.append(perf_counter() - t0)
+    loop.stop()
+
+
+def bench(loop_class, wakeup, loops=LOOPS):
+    loop = new_event_loop(loop_class)
+    try:
+        timings = []
+        eventlet.spawn(pinger, loop, loops, timings)
+        loop.run_forever()
+    finally:
+        loop.close()
+
+    latency = sum(timings) / len(timings)
+    return [result('call_soon_latency', latency * 1e6, 'us', wakeup=wakeup)]
+
+
+def run():
+    results = []
+    results.extend(bench(SelfPipeEventLoop, 'self-pipe'))
+    results.extend(bench(aioeventlet.EventLoop, 'notify'))
+    results.extend(bench(HubDrivenEventLoop, 'hub-driven'))
+    return results
+
+
+if __name__ == '__main__':
+    print_results(run())
@@ -0,0 +1,64 @@
+"""Benchmark a Channel between a greenthread producer and the event loop.
+
+A greenthread puts items into the channel, the event loop gets them with
+async_get() (one future per item) or async_get_many() (one future per
+batch).
+"""
+import eventlet
+
+from benchutil import (aioeventlet, new_event_loop, perf_counter, result,
+                       print_results)
+
+ITEMS = 100000
+MAXSIZE = 1000
+
+
+def producer(chan, nitem):
+    for item in range(nitem):
+        chan.put(item)
+
+
+def bench(batch, nitem=ITEMS, maxsize=MAXSIZE):
+    loop = new_event_loop()
+    try:
+        chan = aioeventlet.Channel(maxsize, loop=loop)
+        count = [0]
+
+        def consume(fut):
+            if batch:
+                count[0] += len(fut.result())
+            else:
+                fut.result()
+                count[0] += 1
+            if count[0] >= nitem:
+                loop.stop()
+                return
+            get_next()
+
+        if batch:
+            def get_next():
+                chan.async_get_many().add_done_callback(consume)
+        else:
+            def get_next():
+                chan.async_get().add_done_callback(consume)
+
+        t0 = perf_counter()
+        eventlet.spawn(producer, chan, nitem)
+        loop.call_soon(get_next)
+        loop.run_forever()
+        dt = perf_counter() - t0
+    finally:
+        loop.close()
+    return [result('channel', nitem / dt, 'items/sec',
+                   batch=batch, maxsize=maxsize)]
+
+
+def run():
+    results = []
+    results.extend(bench(False))
+    results.extend(bench(True))
+    return results
+
+
+if __name__ == '__main__':
+    print_results(run())
@@ -0,0 +1,57 @@
+"""Benchmark executors running I/O-bound functions.
+
+Each function waits 1 ms, simulating a blocking I/O call: with a blocking
+sleep in the native threads of _TpoolExecutor, with a green sleep in
+an eventlet GreenPool (GreenPoolExecutor).
+"""
+import eventlet
+
+from benchutil import (aioeventlet, new_event_loop, perf_counter, result,
+                       print_results)
+
+CALLS = 2000
+WORKERS = 20
+DELAY = 0.001
+
+time = eventlet.patcher.original('time')
+
+
+def blocking_io():
+    time.sleep(DELAY)
+
+
+def green_io():
+    eventlet.sleep(DELAY)
+
+
+def bench(name, create_executor, func, calls=CALLS):
+    loop = new_event_loop()
+    try:
+        executor = create_executor(loop)
+        t0 = perf_counter()
+        futs = [loop.run_in_executor(executor, func) for index in range(calls)]
+        for fut in futs:
+            loop.run_until_complete(fut)
+        dt = perf_counter() - t0
+        executor.shutdown(wait=False)
+    finally:
+        loop.close()
+    return [result('executor_calls', calls / dt, 'calls/sec',
+                   executor=name, workers=WORKERS)]
+
+
+def run():
+    results = []
+    results.extend(bench('tpool',
+                         lambda loop: aioeventlet._TpoolExecutor(loop,
+                                                                 WORKERS),
+                         blocking_io))
+    results.extend(bench('greenpool',
+                         lambda loop: aioeventlet.GreenPoolExecutor(WORKERS,
+                                                                    loop),
+                         green_io))
+    return results
+
+
+if __name__ == '__main__':
+    print_results(run())
@@ -0,0 +1,55 @@
+"""Benchmark an EventLoopGroup over thread counts.
+
+Jobs compressing data with zlib (which releases the GIL) are spread over the
+event loops of the group with run_in_loop(). Measure the throughput for
+1, 2 and 4 threads, and the latency of a cross-loop call.
+"""
+import zlib
+
+from benchutil import (aioeventlet, perf_counter, result, print_results)
+
+JOBS = 200
+DATA = repr(list(range(50000))).encode('ascii')
+CALLS = 2000
+
+
+def compress():
+    return len(zlib.compress(DATA, 6))
+
+
+def bench_jobs(nthread, jobs=JOBS):
+    with aioeventlet.EventLoopGroup(nthread) as group:
+        t0 = perf_counter()
+        cfuts = [aioeventlet.run_in_loop(group.get_loop(), compress)
+                 for index in range(jobs)]
+        for cfut in cfuts:
+            cfut.result()
+        dt = perf_counter() - t0
+    return [result('loop_group_jobs', jobs / dt, 'jobs/sec',
+                   threads=nthread)]
+
+
+def noop():
+    pass
+
+
+def bench_call_latency(calls=CALLS):
+    with aioeventlet.EventLoopGroup(1) as group:
+        loop = group.get_loop()
+        t0 = perf_counter()
+        for index in range(calls):
+            aioeventlet.run_in_loop(loop, noop).result()
+        dt = perf_counter() - t0
+    return [result('loop_group_call_latency', dt / calls * 1e6, 'us')]
+
+
+def run():
+    results = []
+    for nthread in (1, 2, 4):
+        results.extend(bench_jobs(nthread))
+    results.extend(bench_call_latency())
+    return results
+
+
+if __name__ == '__main__':
+    print_results(run())
@@ -0,0 +1,74 @@
+"""Benchmark the overhead of the Profiler.
+
+Measure the throughput of a chain of call_soon() callbacks and the
+round-trip of a greenthread woken up by the event loop, without profiler,
+with a profiler timing all callbacks and with a profiler timing one callback
+of ten.
+"""
+import eventlet
+
+from benchutil import (aioeventlet, new_event_loop, perf_counter, result,
+                       print_results)
+
+CALLBACKS = 100000
+ROUND_TRIPS = 5000
+
+
+def bench_callbacks(loop, loops=CALLBACKS):
+    remaining = [loops]
+
+    def chain():
+        remaining[0] -= 1
+        if remaining[0]:
+            loop.call_soon(chain)
+        else:
+            loop.stop()
+
+    t0 = perf_counter()
+    loop.call_soon(chain)
+    loop.run_forever()
+    return loops / (perf_counter() - t0)
+
+
+def pinger(loop, loops):
+    for index in range(loops):
+        event = eventlet.event.Event()
+        loop.call_soon(event.send)
+        event.wait()
+    loop.stop()
+
+
+def bench_round_trips(loop, loops=ROUND_TRIPS):
+    t0 = perf_counter()
+    eventlet.spawn(pinger, loop, loops)
+    loop.run_forever()
+    return (perf_counter() - t0) / loops
+
+
+def bench(mode, sample_interval=None):
+    loop = new_event_loop()
+    profiler = None
+    try:
+        if sample_interval is not None:
+            profiler = aioeventlet.Profiler(sample_interval=sample_interval)
+            profiler.start(loop)
+        callbacks = bench_callbacks(loop)
+        round_trip = bench_round_trips(loop)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+        loop.close()
+    return [result('callbacks', callbacks, 'calls/sec', profiler=mode),
+            result('round_trip', round_trip * 1e6, 'us', profiler=mode)]
+
+
+def run():
+    results = []
+    results.extend(bench('none'))
+    results.extend(bench('all', 1))
+    results.extend(bench('1/10', 10))
+    return results
+
+
+if __name__ == '__main__':
+    print_results(run())
@@ -0,0 +1,68 @@
+"""Microbenchmark collecting ready events in the selector.
+
+Each iteration, the hub notifies N registered file descriptors as readable,
+and then select() collects ready events. The hub is replaced with a hub which
+does not poll file descriptors, so fake file descriptors can be registered.
+"""
+from benchutil import (aioeventlet, new_event_loop, perf_counter, result,
+                       print_results)
+
+LOOPS = 20
+READY = (1000, 10000, 100000)
+
+
+class NullHub(object):
+    """Hub ignoring listeners."""
+
+    def __init__(self):
+        self.listeners = {aioeventlet._HUB_READ: {},
+                          aioeventlet._HUB_WRITE: {}}
+
+    def add(self, *args):
+        pass
+
+    def remove(self, listener):
+        pass
+
+
+def bench(nready, loops=LOOPS):
+    loop = new_event_loop()
+    selector = aioeventlet._Selector(loop, NullHub())
+    try:
+        fds = range(nready)
+        for fd in fds:
+            selector.register(fd, aioeventlet._EVENT_READ)
+
+        notify = selector._notify_read
+        notify_time = 0.0
+        read_time = 0.0
+        for index in range(loops):
+            t0 = perf_counter()
+            for fd in fds:
+                notify(fd)
+            t1 = perf_counter()
+            events = selector._read_events()
+            t2 = perf_counter()
+            assert len(events) == nready
+            notify_time += t1 - t0
+            read_time += t2 - t1
+    finally:
+        selector.close()
+        loop.close()
+
+    count = float(loops * nready)
+    return [result('notify', notify_time / count * 1e9, 'ns/fd',
+                   ready=nready),
+            result('read_events', read_time / count * 1e9, 'ns/fd',
+                   ready=nready)]
+
+
+def run():
+    results = []
+    for nready in READY:
+        results.extend(bench(nready))
+    return results
+
+
+if __name__ == '__main__':
+    print_results(run())
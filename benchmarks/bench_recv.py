@@ -0,0 +1,74 @@
+"""Benchmark the receive path of socket transports.
+
+A transport writes 64 MiB into a socketpair, the transport of the other end
+receives the data with a regular protocol (data_received() gets a new bytes
+object per read) or with a PooledBufferProtocol (recv_into() a pooled
+buffer).
+"""
+from benchutil import (aioeventlet, asyncio, new_event_loop, perf_counter,
+                       result, print_results)
+
+CHUNK = b'x' * (1024 * 1024)
+CHUNKS = 64
+
+
+class Receiver(object):
+    def __init__(self, loop, total):
+        self.loop = loop
+        self.total = total
+        self.received = 0
+
+    def connection_made(self, transport):
+        pass
+
+    def count(self, nbytes):
+        self.received += nbytes
+        if self.received >= self.total:
+            self.loop.stop()
+
+    def connection_lost(self, exc):
+        pass
+
+
+class BytesReceiver(Receiver, asyncio.Protocol):
+    def data_received(self, data):
+        self.count(len(data))
+
+
+class PooledReceiver(Receiver, aioeventlet.PooledBufferProtocol):
+    def buffer_received(self, view):
+        self.count(len(view))
+
+
+def bench(protocol_class, mode, chunks=CHUNKS):
+    loop = new_event_loop()
+    rsock, wsock = aioeventlet.socketpair()
+    try:
+        total = len(CHUNK) * chunks
+        receiver = protocol_class(loop, total)
+        loop.run_until_complete(
+            loop.create_connection(lambda: receiver, sock=rsock))
+        transport, protocol = loop.run_until_complete(
+            loop.create_connection(asyncio.Protocol, sock=wsock))
+
+        t0 = perf_counter()
+        for index in range(chunks):
+            transport.write(CHUNK)
+        loop.run_forever()
+        dt = perf_counter() - t0
+        transport.close()
+    finally:
+        loop.close()
+    return [result('recv_throughput', total / dt / 1024 ** 2, 'MiB/sec',
+                   mode=mode)]
+
+
+def run():
+    results = []
+    results.extend(bench(BytesReceiver, 'bytes'))
+    results.extend(bench(PooledReceiver, 'pooled'))
+    return results
+
+
+if __name__ == '__main__':
+    print_results(run())
@@ -0,0 +1,58 @@
+"""Benchmark _Selector.select() wakeups.
+
+Each iteration, a greenthread schedules a callback with call_soon() and waits
+until it is called by the event loop: select() is woken up before its timeout
+expires. Far-future handles are scheduled with call_later() to make select()
+use a long timeout.
+
+Report the round-trip latency and the number of timers left in the heap of
+the eventlet hub, depending on the number of scheduled handles.
+"""
+import eventlet
+
+from benchutil import (new_event_loop, perf_counter, get_timers_count, result,
+                       print_results)
+
+LOOPS = 2000
+HANDLES = (0, 10, 100, 1000, 10000)
+
+
+def pinger(loop, loops, timings):
+    for index in range(loops):
+        event = eventlet.event.Event()
+        t0 = perf_counter()
+        loop.call_soon(event.send)
+        event.wait()
+        timings.append(perf_counter() - t0)
+    loop.stop()
+
+
+def bench(nhandle, loops=LOOPS):
+    loop = new_event_loop()
+    try:
+        hub = loop._hub
+        handles = [loop.call_later(3600.0 + index, lambda: None)
+                   for index in range(nhandle)]
+        timings = []
+        eventlet.spawn(pinger, loop, loops, timings)
+        loop.run_forever()
+        ntimer = get_timers_count(hub)
+        for handle in handles:
+            handle.cancel()
+    finally:
+        loop.close()
+
+    latency = sum(timings) / len(timings)
+    return [result('select_latency', latency * 1e6, 'us', handles=nhandle),
+            result('hub_timers', ntimer, 'timers', handles=nhandle)]
+
+
+def run():
+    results = []
+    for nhandle in HANDLES:
+        results.extend(bench(nhandle))
+    return results
+
+
+if __name__ == '__main__':
+    print_results(run())
@@ -0,0 +1,87 @@
+"""Benchmark loop.sock_recv() and loop.sock_sendall() on a socketpair.
+
+Ping-pong of small messages between the two ends of a socketpair using
+sock_sendall() and sock_recv(). Compare the fast path (a single hub listener
+per operation) to the selector path: the sock_*() methods of the selector
+event loop, which register the socket into the selector and then unregister
+it.
+
+sock_echo sends the message before receiving it: sock_recv() completes
+immediately. sock_echo_wait calls sock_recv() before the message is sent:
+sock_recv() has to wait until the socket is readable.
+"""
+from benchutil import (aioeventlet, asyncio, new_event_loop, perf_counter,
+                       result, print_results)
+
+BaseSelectorEventLoop = asyncio.selector_events.BaseSelectorEventLoop
+LOOPS = 10000
+MESSAGE = b'x' * 64
+
+
+class SelectorEventLoop(aioeventlet.EventLoop):
+    """Event loop using the sock_*() methods of the selector event loop."""
+
+    def sock_recv(self, sock, n):
+        return BaseSelectorEventLoop.sock_recv(self, sock, n)
+
+    def sock_sendall(self, sock, data):
+        return BaseSelectorEventLoop.sock_sendall(self, sock, data)
+
+
+def bench(loop_class, path, wait=False, loops=LOOPS):
+    loop = new_event_loop(loop_class)
+    sock_a, sock_b = aioeventlet.socketpair()
+    try:
+        sock_a.setblocking(False)
+        sock_b.setblocking(False)
+        count = [0]
+
+        def send(sock):
+            asyncio.async(loop.sock_sendall(sock, MESSAGE), loop=loop)
+
+        def echo(sender, receiver, callback):
+            if not wait:
+                send(sender)
+            fut = asyncio.async(loop.sock_recv(receiver, len(MESSAGE)),
+                                loop=loop)
+            fut.add_done_callback(callback)
+            if wait:
+                loop.call_soon(send, sender)
+
+        def ping():
+            echo(sock_a, sock_b, pong)
+
+        def pong(fut):
+            fut.result()
+            echo(sock_b, sock_a, next_ping)
+
+        def next_ping(fut):
+            fut.result()
+            count[0] += 1
+            if count[0] == loops:
+                loop.stop()
+            else:
+                ping()
+
+        t0 = perf_counter()
+        loop.call_soon(ping)
+        loop.run_forever()
+        dt = perf_counter() - t0
+    finally:
+        sock_a.close()
+        sock_b.close()
+        loop.close()
+    name = 'sock_echo_wait' if wait else 'sock_echo'
+    return [result(name, loops / dt, 'round-trips/sec', path=path)]
+
+
+def run():
+    results = []
+    for wait in (False, True):
+        results.extend(bench(SelectorEventLoop, 'selector', wait))
+        results.extend(bench(aioeventlet.EventLoop, 'hub', wait))
+    return results
+
+
+if __name__ == '__main__':
+    print_results(run())
@@ -0,0 +1,88 @@
+"""Stress call_soon_threadsafe() from many native threads.
+
+Native threads schedule callbacks with call_soon_threadsafe() as fast as
+possible while the event loop runs. Measure the number of submissions per
+second and the number of bytes written into the self-pipe (wakeup
+syscalls), with and without coalesced wakeups.
+"""
+import eventlet
+
+from benchutil import (aioeventlet, new_event_loop, perf_counter, result,
+                       print_results)
+
+threading = eventlet.patcher.original('threading')
+
+THREADS = 4
+CALLS = 20000
+
+
+class UncoalescedEventLoop(aioeventlet.EventLoop):
+    """Event loop writing into the self-pipe at each wakeup."""
+
+    def _write_to_self(self):
+        self._wakeup_pending = False
+        super(UncoalescedEventLoop, self)._write_to_self()
+
+
+class CountingSocket(object):
+    """Socket proxy counting send() calls."""
+
+    def __init__(self, sock):
+        self._sock = sock
+        self.sends = 0
+
+    def send(self, data):
+        self.sends += 1
+        return self._sock.send(data)
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+
+def submitter(loop, calls, callback):
+    for index in range(calls):
+        loop.call_soon_threadsafe(callback)
+
+
+def bench(loop_class, coalesced, nthread=THREADS, calls=CALLS):
+    loop = new_event_loop(loop_class)
+    try:
+        csock = CountingSocket(loop._csock)
+        loop._csock = csock
+        total = nthread * calls
+        count = [0]
+
+        def callback():
+            count[0] += 1
+            if count[0] == total:
+                loop.stop()
+
+        threads = [threading.Thread(target=submitter,
+                                    args=(loop, calls, callback))
+                   for index in range(nthread)]
+        t0 = perf_counter()
+        for thread in threads:
+            thread.start()
+        loop.run_forever()
+        dt = perf_counter() - t0
+        for thread in threads:
+            thread.join()
+        loop._csock = csock._sock
+    finally:
+        loop.close()
+
+    params = {'threads': nthread, 'coalesced': coalesced}
+    return [result('threadsafe_submissions', total / dt, 'calls/sec',
+                   **params),
+            result('threadsafe_wakeups', csock.sends, 'writes', **params)]
+
+
+def run():
+    results = []
+    results.extend(bench(UncoalescedEventLoop, False))
+    results.extend(bench(aioeventlet.EventLoop, True))
+    return results
+
+
+if __name__ == '__main__':
+    print_results(run())
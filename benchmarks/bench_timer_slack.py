@@ -0,0 +1,58 @@
+"""Benchmark timer coalescing with a slack.
+
+Schedule timers with random delays over 0.5 second, and count the number of
+iterations of the event loop (select() calls) until all timers expired, with
+different slacks.
+"""
+import random
+
+from benchutil import new_event_loop, perf_counter, result, print_results
+
+TIMERS = 10000
+SLACKS = (0.0, 0.001, 0.010, 0.050)
+
+
+def bench(slack, timers=TIMERS):
+    loop = new_event_loop()
+    try:
+        selector = loop._selector
+        select = selector.select
+        calls = [0]
+
+        def counting_select(timeout):
+            calls[0] += 1
+            return select(timeout)
+
+        selector.select = counting_select
+        rand = random.Random(timers)
+        fired = [0]
+
+        def callback():
+            fired[0] += 1
+            if fired[0] == timers:
+                loop.stop()
+
+        t0 = perf_counter()
+        for index in range(timers):
+            loop.call_later_slack(rand.random() * 0.5, slack, callback)
+        loop.run_forever()
+        dt = perf_counter() - t0
+        stats = loop.get_timer_stats()
+    finally:
+        loop.close()
+    params = {'slack': slack, 'timers': timers}
+    return [result('slack_wakeups', calls[0], 'select', **params),
+            result('slack_wakeups_saved', stats['wakeups_saved'], 'wakeups',
+                   **params),
+            result('slack_time', dt, 'sec', **params)]
+
+
+def run():
+    results = []
+    for slack in SLACKS:
+        results.extend(bench(slack))
+    return results
+
+
+if __name__ == '__main__':
+    print_results(run())
@@ -0,0 +1,111 @@
+"""Benchmark call_later() with many pending timers.
+
+For 10k, 100k and 1M timers, measure the cost of call_later(), the cost of
+cancel(), the cost of an iteration of the event loop while the timers are
+pending, and the time to run timers expiring in a short interval. Compare
+the timer backends 'asyncio' (heap of asyncio) and 'hub' (eventlet hub
+timers).
+"""
+import random
+
+from benchutil import (aioeventlet, new_event_loop, perf_counter, result,
+                       print_results)
+
+COUNTS = (10000, 100000, 1000000)
+ITERATIONS = 1000
+
+
+class HubTimerEventLoop(aioeventlet.EventLoop):
+    def __init__(self):
+        super(HubTimerEventLoop, self).__init__(timer_backend='hub')
+
+
+def noop():
+    pass
+
+
+def bench_pending(loop_class, count):
+    loop = new_event_loop(loop_class)
+    try:
+        rand = random.Random(count)
+        delays = [60.0 + rand.random() * 60.0 for index in range(count)]
+
+        # include an iteration of the event loop: the hub pushes new timers
+        # into its heap at its next iteration
+        t0 = perf_counter()
+        handles = [loop.call_later(delay, noop) for delay in delays]
+        loop.call_soon(loop.stop)
+        loop.run_forever()
+        schedule = perf_counter() - t0
+
+        # iterations of the event loop with pending timers
+        remaining = [ITERATIONS]
+
+        def iteration():
+            remaining[0] -= 1
+            if remaining[0]:
+                loop.call_soon(iteration)
+            else:
+                loop.stop()
+
+        t0 = perf_counter()
+        loop.call_soon(iteration)
+        loop.run_forever()
+        iterate = perf_counter() - t0
+
+        t0 = perf_counter()
+        for handle in handles:
+            handle.cancel()
+        cancel = perf_counter() - t0
+        # run an iteration to purge cancelled timers
+        loop.call_soon(loop.stop)
+        loop.run_forever()
+    finally:
+        loop.close()
+    return schedule / count, iterate / ITERATIONS, cancel / count
+
+
+def bench_expire(loop_class, count):
+    loop = new_event_loop(loop_class)
+    try:
+        rand = random.Random(count)
+        fired = [0]
+
+        def callback():
+            fired[0] += 1
+            if fired[0] == count:
+                loop.stop()
+
+        t0 = perf_counter()
+        for index in range(count):
+            loop.call_later(rand.random() * 0.1, callback)
+        loop.run_forever()
+        return perf_counter() - t0
+    finally:
+        loop.close()
+
+
+def bench(loop_class, backend, counts=COUNTS):
+    results = []
+    for count in counts:
+        schedule, iterate, cancel = bench_pending(loop_class, count)
+        expire = bench_expire(loop_class, count)
+        params = {'backend': backend, 'timers': count}
+        results.extend((
+            result('timer_schedule', schedule * 1e6, 'us', **params),
+            result('timer_cancel', cancel * 1e6, 'us', **params),
+            result('timer_iteration', iterate * 1e6, 'us', **params),
+            result('timer_expire', expire, 'sec', **params),
+        ))
+    return results
+
+
+def run():
+    results = []
+    results.extend(bench(aioeventlet.EventLoop, 'asyncio'))
+    results.extend(bench(HubTimerEventLoop, 'hub'))
+    return results
+
+
+if __name__ == '__main__':
+    print_results(run())
@@ -0,0 +1,42 @@
+"""Helpers shared by the aioeventlet benchmarks."""
+from __future__ import print_function
+import os.path
+import sys
+import time
+
+# Benchmarks are run as scripts from a source checkout: make the aioeventlet
+# module importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aioeventlet
+
+asyncio = aioeventlet.asyncio
+
+if hasattr(time, 'perf_counter'):
+    perf_counter = time.perf_counter
+else:
+    # Python 2
+    perf_counter = time.time
+
+
+def new_event_loop(loop_class=aioeventlet.EventLoop):
+    loop = loop_class()
+    asyncio.set_event_loop(loop)
+    return loop
+
+
+def get_timers_count(hub):
+    """Number of timers (pending or cancelled) in the heap of the hub."""
+    return len(hub.timers) + len(hub.next_timers)
+
+
+def result(name, value, unit, **params):
+    return {'name': name, 'value': value, 'unit': unit, 'params': params}
+
+
+def print_results(results):
+    for res in results:
+        params = ', '.join('%s=%s' % item
+                           for item in sorted(res['params'].items()))
+        print("%s(%s): %.3f %s" % (res['name'], params,
+                                   res['value'], res['unit']))
@@ -0,0 +1,404 @@
+"""Run the benchmark suite and write the results as JSON.
+
+Run the benchmarks of suite.py with each eventlet hub (epolls, poll,
+selects), with and without monkey patching, and with a stock asyncio event
+loop as a reference. The hub and monkey patching are global to a process:
+each configuration runs in a child process.
+
+Usage::
+
+    python benchmarks/run.py -o results.json
+    python benchmarks/run.py --quick --hub=epolls --bench=call_soon
+
+The JSON document contains the metadata of the run (date, Python, eventlet
+and platform versions) and a list of results. The parameters of each result
+include the configuration: loop ('aioeventlet' or 'asyncio'), hub and
+monkey_patch. The calibration of a result is the best time of a pure Python
+loop measured before each benchmark of the child process.
+
+With --compare, results of aioeventlet are compared to a baseline and the
+command fails if a result regressed by more than the tolerance. Values are
+normalized by their calibration to compensate the speed of the machine, not
+the Python version: a baseline is only comparable to results of the same
+environment (Python implementation and version). The eventlet version is
+stored in the metadata, but is not part of the environment: comparing results
+of a new eventlet version to the baseline checks the upgrade. Baselines of
+each environment are stored in benchmarks/baselines/: --save writes the
+baseline of the current environment, --check compares to it::
+
+    python benchmarks/run.py --quick --repeat=3 --no-asyncio --save
+    python benchmarks/run.py --quick --repeat=3 --no-asyncio --check
+"""
+from __future__ import print_function
+import json
+import optparse
+import os
+import platform
+import subprocess
+import sys
+import time
+
+HUBS = ('epolls', 'poll', 'selects')
+# scale factor of the number of loops used by --quick
+QUICK_SCALE = 0.1
+# default maximum slowdown of a result compared to the baseline
+TOLERANCE = 0.40
+CALIBRATION_LOOPS = 100000
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'baselines')
+
+if hasattr(time, 'perf_counter'):
+    perf_counter = time.perf_counter
+else:
+    # Python 2
+    perf_counter = time.time
+
+ARGS = optparse.OptionParser(description="Run the aioeventlet benchmarks.",
+                             usage="%prog [options]")
+ARGS.add_option(
+    '-o', '--output', action='store', dest='output', default=None,
+    help='Write the JSON results into a file instead of stdout')
+ARGS.add_option(
+    '-b', '--bench', action='append', dest='benchmarks', default=[],
+    help='Only run this benchmark (option can be repeated)')
+ARGS.add_option(
+    '--hub', action='append', dest='hubs', default=[],
+    help='Only use this eventlet hub (option can be repeated)')
+ARGS.add_option(
+    '--no-patch', action='store_true', dest='no_patch', default=False,
+    help='Skip configurations with monkey patching')
+ARGS.add_option(
+    '--patch-only', action='store_true', dest='patch_only', default=False,
+    help='Skip configurations without monkey patching')
+ARGS.add_option(
+    '--no-asyncio', action='store_true', dest='no_asyncio', default=False,
+    help='Skip the stock asyncio event loop')
+ARGS.add_option(
+    '--quick', action='store_true', dest='quick', default=False,
+    help='Run less loops (results are less reliable)')
+ARGS.add_option(
+    '--repeat', action='store', type='int', dest='repeat', default=1,
+    help='Run each configuration N times and keep the best values')
+ARGS.add_option(
+    '--compare', action='store', dest='baseline', default=None,
+    help='Compare results to a baseline JSON file, '
+         'fail if a result regressed')
+ARGS.add_option(
+    '--check', action='store_true', dest='check', default=False,
+    help='Compare results to the baseline of the current environment')
+ARGS.add_option(
+    '--save', action='store_true', dest='save', default=False,
+    help='Write the results as the baseline of the current environment')
+ARGS.add_option(
+    '--tolerance', action='store', type='float', dest='tolerance',
+    default=TOLERANCE,
+    help='Maximum accepted slowdown with --compare (default: %s)'
+         % TOLERANCE)
+ARGS.add_option(
+    '-i', '--input', action='store', dest='input', default=None,
+    help='Read results from a JSON file instead of running the benchmarks')
+# options of a child process
+ARGS.add_option(
+    '--worker', action='store_true', dest='worker', default=False,
+    help=optparse.SUPPRESS_HELP)
+ARGS.add_option(
+    '--loop', action='store', dest='loop', default='aioeventlet',
+    help=optparse.SUPPRESS_HELP)
+ARGS.add_option(
+    '-m', '--monkey-patch', action='store_true', dest='monkey_patch',
+    default=False, help=optparse.SUPPRESS_HELP)
+ARGS.add_option(
+    '--scale', action='store', type='float', dest='scale', default=1.0,
+    help=optparse.SUPPRESS_HELP)
+
+
+def calibrate():
+    """Best time of a pure Python loop, in seconds."""
+    timings = []
+    for run in range(5):
+        t0 = perf_counter()
+        data = {}
+        for index in range(CALIBRATION_LOOPS):
+            data[index % 100] = index * 2
+        timings.append(perf_counter() - t0)
+    return min(timings)
+
+
+def worker(args):
+    # monkey patching and the hub must be set up before aioeventlet is
+    # imported and before the hub is created
+    import eventlet
+    import eventlet.hubs
+
+    if args.monkey_patch:
+        eventlet.monkey_patch()
+    if args.hubs:
+        eventlet.hubs.use_hub(args.hubs[0])
+
+    import suite
+
+    if args.loop == 'asyncio':
+        loop_class = suite.asyncio.SelectorEventLoop
+        hub = None
+    else:
+        loop_class = suite.aioeventlet.EventLoop
+        hub = eventlet.hubs.get_hub().__module__.rsplit('.', 1)[-1]
+    config = {'loop': args.loop, 'hub': hub,
+              'monkey_patch': args.monkey_patch}
+
+    results = []
+    errors = []
+    calibrations = []
+    for name, func, greenthreads in suite.BENCHMARKS:
+        if args.benchmarks and name not in args.benchmarks:
+            continue
+        if greenthreads and args.loop == 'asyncio':
+            continue
+        try:
+            calibrations.append(calibrate())
+            bench_results = func(loop_class, args.scale)
+        except Exception as exc:
+            errors.append(dict(config, benchmark=name,
+                               error='%s: %s' % (type(exc).__name__, exc)))
+            continue
+        for res in bench_results:
+            res['benchmark'] = name
+            res['params'].update(config)
+            results.append(res)
+    # A single slow calibration (ex: the process was preempted) would
+    # inflate the normalized values of a benchmark: use the best calibration
+    # of the process
+    for res in results:
+        res['calibration'] = min(calibrations)
+    json.dump({'results': results, 'errors': errors}, sys.stdout)
+
+
+def get_configs(args):
+    configs = []
+    hubs = args.hubs or HUBS
+    patches = []
+    if not args.patch_only:
+        patches.append(False)
+    if not args.no_patch:
+        patches.append(True)
+    for hub in hubs:
+        for monkey_patch in patches:
+            configs.append(('aioeventlet', hub, monkey_patch))
+    if not args.no_asyncio:
+        configs.append(('asyncio', None, False))
+    return configs
+
+
+def run_config(args, config, benchmarks):
+    loop, hub, monkey_patch = config
+    cmd = [sys.executable, os.path.abspath(__file__), '--worker',
+           '--loop', loop,
+           '--scale', str(QUICK_SCALE if args.quick else 1.0)]
+    if hub:
+        cmd.extend(('--hub', hub))
+    if monkey_patch:
+        cmd.append('-m')
+    for name in benchmarks:
+        cmd.extend(('--bench', name))
+
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    stdout = proc.communicate()[0]
+    if proc.returncode:
+        error = {'loop': loop, 'hub': hub, 'monkey_patch': monkey_patch,
+                 'error': 'worker exited with code %s' % proc.returncode}
+        return {'results': [], 'errors': [error]}
+    return json.loads(stdout.decode('utf-8'))
+
+
+def result_key(res):
+    return (res['name'], tuple(sorted(res['params'].items())))
+
+
+def higher_is_better(res):
+    return res['unit'].endswith('/sec')
+
+
+def normalized(res):
+    """Value of a result independent of the speed of the machine."""
+    if higher_is_better(res):
+        return res['value'] * res['calibration']
+    else:
+        return res['value'] / res['calibration']
+
+
+def merge_results(results, new_results):
+    """Keep the best value of each result."""
+    index = dict((result_key(res), res) for res in results)
+    for res in new_results:
+        old = index.get(result_key(res))
+        if old is None:
+            results.append(res)
+            index[result_key(res)] = res
+        elif ((normalized(res) > normalized(old))
+              == higher_is_better(res)):
+            old.update(res)
+
+
+def get_metadata():
+    import eventlet
+
+    return {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'python_implementation': platform.python_implementation(),
+        'eventlet': eventlet.__version__,
+        'platform': platform.platform(),
+    }
+
+
+def get_environment(metadata):
+    """Name of the environment of results.
+
+    Benchmarks only compare on the same Python implementation and version.
+    """
+    python = '.'.join(metadata['python'].split('.')[:2])
+    return '%s%s' % (metadata['python_implementation'].lower(), python)
+
+
+def get_baseline_path(metadata):
+    return os.path.join(BASELINES, get_environment(metadata) + '.json')
+
+
+def compare(baseline, doc):
+    """Compare results to a baseline.
+
+    Return a list of (result, slowdown) tuples.
+    """
+    expected = dict((result_key(res), res) for res in baseline['results'])
+    comparison = []
+    for res in doc['results']:
+        if res['params'].get('loop') != 'aioeventlet':
+            # stock asyncio is only a reference
+            continue
+        base = expected.get(result_key(res))
+        if base is None:
+            continue
+        slowdown = normalized(res) / normalized(base)
+        if higher_is_better(res):
+            slowdown = 1.0 / slowdown
+        comparison.append((res, slowdown))
+    return comparison
+
+
+def get_regressions(comparison, tolerance):
+    return [res for res, slowdown in comparison
+            if slowdown > 1.0 + tolerance]
+
+
+def confirm_regressions(args, doc, regressions):
+    """Run again benchmarks which regressed, keep the best values."""
+    configs = {}
+    for res in regressions:
+        params = res['params']
+        config = (params['loop'], params['hub'], params['monkey_patch'])
+        configs.setdefault(config, set()).add(res['benchmark'])
+    for config, benchmarks in sorted(configs.items()):
+        print("Run again benchmarks %s: loop=%s, hub=%s, monkey_patch=%s"
+              % ((', '.join(sorted(benchmarks)),) + config), file=sys.stderr)
+        for run in range(args.repeat):
+            data = run_config(args, config, sorted(benchmarks))
+            merge_results(doc['results'], data['results'])
+            doc['errors'].extend(data['errors'])
+
+
+def print_comparison(baseline, doc, comparison, tolerance):
+    print("Compare to the baseline of %s (Python %s, eventlet %s)"
+          % (baseline['metadata']['date'], baseline['metadata']['python'],
+             baseline['metadata']['eventlet']), file=sys.stderr)
+    if doc['metadata']['eventlet'] != baseline['metadata']['eventlet']:
+        print("Results of eventlet %s" % doc['metadata']['eventlet'],
+              file=sys.stderr)
+    for res, slowdown in comparison:
+        params = ', '.join('%s=%s' % item
+                           for item in sorted(res['params'].items()))
+        print("%s %s(%s): %.3f %s, %+.0f%%"
+              % ('REGRESSION' if slowdown > 1.0 + tolerance else 'ok',
+                 res['name'], params, res['value'], res['unit'],
+                 (slowdown - 1.0) * 100), file=sys.stderr)
+
+
+def main():
+    args, extra = ARGS.parse_args()
+    if extra:
+        ARGS.error("unexpected arguments: %s" % ' '.join(extra))
+    if args.worker:
+        worker(args)
+        return
+    if args.check and args.baseline:
+        ARGS.error("--check and --compare are mutually exclusive")
+
+    if args.input:
+        with open(args.input) as fp:
+            doc = json.load(fp)
+    else:
+        doc = {'metadata': get_metadata(), 'results': [], 'errors': []}
+        for config in get_configs(args):
+            print("Run benchmarks: loop=%s, hub=%s, monkey_patch=%s"
+                  % config, file=sys.stderr)
+            for run in range(args.repeat):
+                data = run_config(args, config, args.benchmarks)
+                merge_results(doc['results'], data['results'])
+                doc['errors'].extend(data['errors'])
+
+    if args.check:
+        args.baseline = get_baseline_path(doc['metadata'])
+        if not os.path.exists(args.baseline):
+            print("No baseline for the environment %s: create it with --save"
+                  % get_environment(doc['metadata']), file=sys.stderr)
+            sys.exit(1)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        environment = get_environment(doc['metadata'])
+        if get_environment(baseline['metadata']) != environment:
+            print("The baseline %s was created in the environment %s, "
+                  "results are of %s: results are not comparable"
+                  % (args.baseline, get_environment(baseline['metadata']),
+                     environment), file=sys.stderr)
+            sys.exit(1)
+        comparison = compare(baseline, doc)
+        regressions = get_regressions(comparison, args.tolerance)
+        if regressions and not args.input:
+            # benchmarks are noisy: only report regressions which reproduce
+            confirm_regressions(args, doc, regressions)
+            comparison = compare(baseline, doc)
+            regressions = get_regressions(comparison, args.tolerance)
+        print_comparison(baseline, doc, comparison, args.tolerance)
+    for error in doc['errors']:
+        print("ERROR: %s" % error, file=sys.stderr)
+
+    if args.save and doc['errors']:
+        print("Baseline not written: some benchmarks failed", file=sys.stderr)
+    elif args.save:
+        if not os.path.isdir(BASELINES):
+            os.mkdir(BASELINES)
+        path = get_baseline_path(doc['metadata'])
+        with open(path, 'w') as fp:
+            json.dump(doc, fp, indent=2, sort_keys=True)
+            fp.write('\n')
+        print("Baseline written into %s" % path, file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(doc, fp, indent=2, sort_keys=True)
+            fp.write('\n')
+    elif not args.baseline and not args.save:
+        json.dump(doc, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+    if regressions:
+        print("%s result(s) regressed by more than %.0f%%"
+              % (len(regressions), args.tolerance * 100), file=sys.stderr)
+        sys.exit(1)
+    if doc['errors']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
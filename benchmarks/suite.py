@@ -0,0 +1,297 @@
+"""Benchmarks of the suite run by run.py.
+
+Each benchmark takes an event loop class and a scale factor of the number of
+loops, and returns a list of results. Benchmarks using greenthreads are
+skipped on a stock asyncio event loop.
+
+- call_soon: throughput of callbacks scheduled in a batch or in a chain
+- wakeup: latency to wake up select() from a greenthread or from a thread
+- yield_future: round-trip of a greenthread waiting for a future
+- wrap_greenthread: round-trip of the event loop waiting for a greenthread
+- timers: scheduling and expiration of many call_later() timers
+- executor: throughput of run_in_executor() with the default executor
+- echo: TCP echo server with many client connections
+"""
+import random
+import socket
+
+import eventlet
+
+from benchutil import (aioeventlet, asyncio, perf_counter, result,
+                       print_results)
+
+threading = eventlet.patcher.original('threading')
+
+CALL_SOON = 100000
+WAKEUPS = 2000
+ROUND_TRIPS = 2000
+TIMERS = 100000
+EXECUTOR_CALLS = 2000
+ECHO_CLIENTS = 100
+ECHO_MESSAGES = 100
+ECHO_MESSAGE = b'x' * 100
+
+
+def noop():
+    pass
+
+
+def scaled(loops, scale):
+    return max(int(loops * scale), 1)
+
+
+def new_event_loop(loop_class):
+    loop = loop_class()
+    asyncio.set_event_loop(loop)
+    return loop
+
+
+def bench_call_soon(loop_class, scale=1.0):
+    loops = scaled(CALL_SOON, scale)
+    loop = new_event_loop(loop_class)
+    try:
+        t0 = perf_counter()
+        for index in range(loops):
+            loop.call_soon(noop)
+        loop.call_soon(loop.stop)
+        loop.run_forever()
+        batch = perf_counter() - t0
+
+        remaining = [loops]
+
+        def chain():
+            remaining[0] -= 1
+            if remaining[0]:
+                loop.call_soon(chain)
+            else:
+                loop.stop()
+
+        t0 = perf_counter()
+        loop.call_soon(chain)
+        loop.run_forever()
+        chain_dt = perf_counter() - t0
+    finally:
+        loop.close()
+    return [result('call_soon', loops / batch, 'calls/sec', mode='batch'),
+            result('call_soon', loops / chain_dt, 'calls/sec', mode='chain')]
+
+
+def green_pinger(loop, loops, timings):
+    for index in range(loops):
+        event = eventlet.event.Event()
+        t0 = perf_counter()
+        loop.call_soon(event.send)
+        event.wait()
+        timings.append(perf_counter() - t0)
+    loop.call_soon(loop.stop)
+
+
+def thread_pinger(loop, loops, timings):
+    for index in range(loops):
+        event = threading.Event()
+        t0 = perf_counter()
+        loop.call_soon_threadsafe(event.set)
+        event.wait()
+        timings.append(perf_counter() - t0)
+    loop.call_soon_threadsafe(loop.stop)
+
+
+def bench_wakeup(loop_class, scale=1.0):
+    loops = scaled(WAKEUPS, scale)
+    greenthreads = issubclass(loop_class, aioeventlet.EventLoop)
+    results = []
+    for source in ('greenthread', 'thread'):
+        if source == 'greenthread' and not greenthreads:
+            continue
+        loop = new_event_loop(loop_class)
+        try:
+            # a far-future timer makes select() use a long timeout
+            handle = loop.call_later(3600.0, noop)
+            timings = []
+            if source == 'greenthread':
+                eventlet.spawn(green_pinger, loop, loops, timings)
+                loop.run_forever()
+            else:
+                thread = threading.Thread(target=thread_pinger,
+                                          args=(loop, loops, timings))
+                thread.start()
+                loop.run_forever()
+                thread.join()
+            handle.cancel()
+        finally:
+            loop.close()
+        latency = sum(timings) / len(timings)
+        results.append(result('wakeup_latency', latency * 1e6, 'us',
+                              source=source))
+    return results
+
+
+def yield_future_pinger(loop, loops):
+    for index in range(loops):
+        fut = asyncio.Future(loop=loop)
+        loop.call_soon(fut.set_result, index)
+        aioeventlet.yield_future(fut)
+    loop.call_soon(loop.stop)
+
+
+def bench_yield_future(loop_class, scale=1.0):
+    loops = scaled(ROUND_TRIPS, scale)
+    loop = new_event_loop(loop_class)
+    try:
+        t0 = perf_counter()
+        eventlet.spawn(yield_future_pinger, loop, loops)
+        loop.run_forever()
+        dt = perf_counter() - t0
+    finally:
+        loop.close()
+    return [result('yield_future', dt / loops * 1e6, 'us')]
+
+
+def bench_wrap_greenthread(loop_class, scale=1.0):
+    loops = scaled(ROUND_TRIPS, scale)
+    loop = new_event_loop(loop_class)
+    try:
+        remaining = [loops]
+
+        def next_greenthread(fut=None):
+            remaining[0] -= 1
+            if remaining[0] < 0:
+                loop.stop()
+                return
+            gt = eventlet.spawn(noop)
+            fut = aioeventlet.wrap_greenthread(gt, loop=loop)
+            fut.add_done_callback(next_greenthread)
+
+        t0 = perf_counter()
+        loop.call_soon(next_greenthread)
+        loop.run_forever()
+        dt = perf_counter() - t0
+    finally:
+        loop.close()
+    return [result('wrap_greenthread', dt / loops * 1e6, 'us')]
+
+
+def bench_timers(loop_class, scale=1.0):
+    count = scaled(TIMERS, scale)
+    loop = new_event_loop(loop_class)
+    try:
+        rand = random.Random(count)
+        delays = [rand.random() * 0.100 for index in range(count)]
+        fired = [0]
+
+        def timer():
+            fired[0] += 1
+            if fired[0] == count:
+                loop.stop()
+
+        t0 = perf_counter()
+        for delay in delays:
+            loop.call_later(delay, timer)
+        schedule = perf_counter() - t0
+        loop.run_forever()
+        total = perf_counter() - t0
+    finally:
+        loop.close()
+    # the timers expire in 100 ms: the total time includes the wait
+    return [result('timers_schedule', count / schedule, 'timers/sec',
+                   timers=count),
+            result('timers_total', total * 1e3, 'ms', timers=count)]
+
+
+def bench_executor(loop_class, scale=1.0):
+    calls = scaled(EXECUTOR_CALLS, scale)
+    loop = new_event_loop(loop_class)
+    try:
+        t0 = perf_counter()
+        futs = [loop.run_in_executor(None, noop) for index in range(calls)]
+        loop.run_until_complete(asyncio.wait(futs))
+        dt = perf_counter() - t0
+    finally:
+        loop.close()
+    return [result('executor', calls / dt, 'calls/sec')]
+
+
+class EchoServer(asyncio.Protocol):
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.transport.write(data)
+
+
+class EchoClient(asyncio.Protocol):
+    def __init__(self, messages, done):
+        self.messages = messages
+        self.done = done
+        self.received = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.write(ECHO_MESSAGE)
+
+    def data_received(self, data):
+        self.received += len(data)
+        if self.received < len(ECHO_MESSAGE):
+            return
+        self.received -= len(ECHO_MESSAGE)
+        self.messages -= 1
+        if self.messages:
+            self.transport.write(ECHO_MESSAGE)
+        else:
+            self.transport.close()
+            self.done()
+
+
+def bench_echo(loop_class, scale=1.0):
+    nclient = ECHO_CLIENTS
+    messages = scaled(ECHO_MESSAGES, scale)
+    loop = new_event_loop(loop_class)
+    try:
+        server = loop.run_until_complete(
+            loop.create_server(EchoServer, '127.0.0.1', 0,
+                               family=socket.AF_INET))
+        host, port = server.sockets[0].getsockname()[:2]
+        remaining = [nclient]
+
+        def client_done():
+            remaining[0] -= 1
+            if not remaining[0]:
+                loop.stop()
+
+        t0 = perf_counter()
+        for index in range(nclient):
+            loop.run_until_complete(
+                loop.create_connection(
+                    lambda: EchoClient(messages, client_done),
+                    host, port))
+        loop.run_forever()
+        dt = perf_counter() - t0
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+    finally:
+        loop.close()
+    return [result('echo', nclient * messages / dt, 'messages/sec',
+                   clients=nclient)]
+
+
+# (name, function, requires an aioeventlet event loop)
+BENCHMARKS = (
+    ('call_soon', bench_call_soon, False),
+    ('wakeup', bench_wakeup, False),
+    ('yield_future', bench_yield_future, True),
+    ('wrap_greenthread', bench_wrap_greenthread, True),
+    ('timers', bench_timers, False),
+    ('executor', bench_executor, False),
+    ('echo', bench_echo, False),
+)
+
+
+def run(loop_class=aioeventlet.EventLoop, scale=1.0):
+    results = []
+    for name, func, greenthreads in BENCHMARKS:
+        results.extend(func(loop_class, scale))
+    return results
+
+
+if __name__ == '__main__':
+    print_results(run())
@@ -11,8 +11,12 @@ except ImportError:
     import mock
 
 class TestCase(unittest.TestCase):
+    hub_driven = False
+    timer_backend = 'asyncio'
+
     def setUp(self):
-        policy = aioeventlet.EventLoopPolicy()
+        policy = aioeventlet.EventLoopPolicy(hub_driven=self.hub_driven,
+                                             timer_backend=self.timer_backend)
         asyncio.set_event_loop_policy(policy)
         self.addCleanup(asyncio.set_event_loop_policy, None)
 
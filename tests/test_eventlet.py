@@ -1,6 +1,9 @@
 import aioeventlet
 import eventlet
+import os
+import signal
 import sys
+import time
 import tests
 from tests import unittest
 
@@ -146,6 +149,92 @@ class EventletTests(tests.TestCase):
         self.loop.run_forever()
         self.assertEqual(result, ["spawn", "spawn_after"])
 
+    def test_select_cancel_timer(self):
+        hub = self.loop._hub
+        handle = self.loop.call_later(3600.0, lambda: None)
+        self.addCleanup(handle.cancel)
+
+        def pending_timers():
+            return [timer for when, timer in hub.timers + hub.next_timers
+                    if not timer.called]
+
+        def pinger():
+            for index in range(50):
+                event = eventlet.event.Event()
+                self.loop.call_soon(event.send)
+                event.wait()
+            self.loop.stop()
+
+        before = len(pending_timers())
+        eventlet.spawn(pinger)
+        self.loop.run_forever()
+        # select() must cancel its timeout timer when it is woken up
+        self.assertEqual(len(pending_timers()), before)
+
+    def test_call_soon_wakeup(self):
+        result = []
+
+        def func():
+            self.loop.call_soon(result.append, 'call_soon')
+            self.loop.call_soon(self.loop.stop)
+
+        eventlet.spawn(func)
+        with tests.mock.patch.object(self.loop, '_write_to_self') as m_write:
+            self.loop.run_forever()
+        # the same-thread wakeup must not write into the self-pipe
+        self.assertFalse(m_write.called)
+        self.assertEqual(result, ['call_soon'])
+
+    def test_call_soon_threadsafe(self):
+        result = []
+        threading = eventlet.patcher.original('threading')
+
+        def func():
+            result.append('thread')
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+        self.loop.call_soon(threading.Thread(target=func).start)
+        self.loop.run_forever()
+        self.assertEqual(result, ['thread'])
+
+    def test_call_soon_threadsafe_coalesce(self):
+        result = []
+        threading = eventlet.patcher.original('threading')
+        socket = eventlet.patcher.original('socket')
+
+        def func():
+            for value in range(100):
+                self.loop.call_soon_threadsafe(result.append, value)
+
+        thread = threading.Thread(target=func)
+        thread.start()
+        thread.join()
+        # a single byte was written into the self-pipe
+        data = self.loop._ssock.recv(4096, socket.MSG_PEEK)
+        self.assertEqual(data, b'\0')
+
+        # callbacks can run before the self-pipe is read: wait until the
+        # byte is consumed
+        def stop():
+            if len(result) == 100 and not self.loop._wakeup_pending:
+                self.loop.stop()
+            else:
+                self.loop.call_soon(stop)
+
+        self.loop.call_soon(stop)
+        self.loop.run_forever()
+        self.assertEqual(result, list(range(100)))
+
+        # the next wakeup writes again into the self-pipe
+        def func_stop():
+            func()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+        del result[:]
+        self.loop.call_soon(threading.Thread(target=func_stop).start)
+        self.loop.run_forever()
+        self.assertEqual(result, list(range(100)))
+
     def test_set_debug(self):
         hub = eventlet.hubs.get_hub()
         self.assertIs(self.loop._hub, hub)
@@ -257,6 +346,92 @@ class LinkFutureTests(tests.TestCase):
         self.assertEqual(result[0],
                          'loop argument must agree with Future')
 
+    def test_yield_future_done(self):
+        fut = asyncio.Future(loop=self.loop)
+        fut.set_result(5)
+        # the event loop is not running: don't wait
+        self.assertEqual(aioeventlet.yield_future(fut), 5)
+
+        fut = asyncio.Future(loop=self.loop)
+        fut.set_exception(ValueError(7))
+        self.assertRaises(ValueError, aioeventlet.yield_future, fut)
+
+    def run_yield_futures(self, coros, return_when):
+        result = []
+
+        def func():
+            try:
+                result.append(aioeventlet.yield_futures(
+                    coros, return_when=return_when))
+            except Exception as exc:
+                result.append(exc)
+            finally:
+                self.loop.stop()
+
+        self.loop.call_soon(eventlet.spawn, func)
+        self.loop.run_forever()
+        return result[0]
+
+    def test_yield_futures(self):
+        result = []
+        done, pending = self.run_yield_futures(
+            [coro_slow_append(result, 1, 0.010),
+             coro_slow_append(result, 2, 0.001),
+             coro_slow_append(result, 3, 0.020)],
+            asyncio.ALL_COMPLETED)
+        self.assertEqual(len(done), 3)
+        self.assertEqual(pending, set())
+        self.assertEqual(sorted(fut.result() for fut in done), [10, 20, 30])
+        self.assertEqual(result, [2, 1, 3])
+
+    def test_yield_futures_first_completed(self):
+        result = []
+        slow = asyncio.Future(loop=self.loop)
+        done, pending = self.run_yield_futures(
+            [coro_slow_append(result, 1), slow],
+            asyncio.FIRST_COMPLETED)
+        self.assertEqual([fut.result() for fut in done], [10])
+        self.assertEqual(pending, set([slow]))
+
+    def test_yield_futures_first_exception(self):
+        slow = asyncio.Future(loop=self.loop)
+        done, pending = self.run_yield_futures(
+            [coro_slow_error(), slow],
+            asyncio.FIRST_EXCEPTION)
+        self.assertEqual(len(done), 1)
+        self.assertIsInstance(done.pop().exception(), ValueError)
+        self.assertEqual(pending, set([slow]))
+
+    def test_yield_futures_errors(self):
+        self.assertRaises(ValueError, aioeventlet.yield_futures, [])
+        fut = asyncio.Future(loop=self.loop)
+        self.assertRaises(ValueError,
+                          aioeventlet.yield_futures, [fut], return_when='x')
+
+        def func():
+            try:
+                aioeventlet.yield_futures([fut])
+            except RuntimeError as exc:
+                result.append(str(exc))
+
+        result = []
+        self.loop.call_soon(func)
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+        self.assertEqual(result,
+                         ['yield_futures() must not be called from the '
+                          'greenthread of the aioeventlet event loop'])
+
+    def test_yield_futures_wrong_loop(self):
+        loop2 = asyncio.new_event_loop()
+        self.addCleanup(loop2.close)
+        fut = asyncio.Future(loop=self.loop)
+        fut2 = asyncio.Future(loop=loop2)
+        self.assertRaises(ValueError,
+                          aioeventlet.yield_futures, [fut, fut2])
+        self.assertRaises(ValueError,
+                          aioeventlet.yield_futures, [fut], loop=loop2)
+
 
 class WrapGreenthreadTests(tests.TestCase):
     def test_wrap_greenthread(self):
@@ -371,6 +546,1438 @@ class WrapGreenletTests(tests.TestCase):
         self.assertRaisesRegex(RuntimeError, msg, aioeventlet.wrap_greenthread, gt)
 
 
+class TimerSlackTests(tests.TestCase):
+    def test_call_later_slack(self):
+        result = []
+        t0 = self.loop.time()
+        handles = [self.loop.call_later_slack(0.001 * index, 0.010,
+                                              result.append, index)
+                   for index in range(1, 6)]
+        # the deadlines are rounded up to a multiple of the slack
+        whens = set(handle._when for handle in handles)
+        self.assertLessEqual(len(whens), 2)
+        for handle in handles:
+            self.assertGreaterEqual(handle._when,
+                                    t0 + 0.001 * (handles.index(handle) + 1))
+            self.assertLess(handle._when, t0 + 0.016)
+
+        stats = self.loop.get_timer_stats()
+        self.assertEqual(stats['scheduled'], 5)
+        self.assertEqual(stats['expired'], 0)
+
+        self.loop.call_later(0.020, self.loop.stop)
+        self.loop.run_forever()
+        # callbacks with the same deadline are called in any order
+        self.assertEqual(sorted(result), [1, 2, 3, 4, 5])
+
+        stats = self.loop.get_timer_stats()
+        self.assertEqual(stats['expired'], 5)
+        self.assertEqual(stats['wakeups'], len(whens))
+        self.assertEqual(stats['wakeups_saved'], 5 - len(whens))
+
+    def test_integer_when(self):
+        # the deadline is not rounded down by an integer division
+        handle = self.loop.call_at_slack(12211, 3, lambda: None)
+        self.assertEqual(handle._when, 12213)
+        handle.cancel()
+
+    def test_stats_cancel(self):
+        result = []
+        when = self.loop.time() + 0.001
+        handles = [self.loop.call_at_slack(when, 0.010, result.append, index)
+                   for index in range(3)]
+        self.assertEqual(len(set(handle._when for handle in handles)), 1)
+        handles[0].cancel()
+        handles[1].cancel()
+        # a deadline with only cancelled timers needs no wakeup
+        self.loop.call_later_slack(0.050, 0.010, result.append, 3).cancel()
+
+        self.loop.call_later(0.020, self.loop.stop)
+        self.loop.run_forever()
+        self.assertEqual(result, [2])
+        # cancelling an expired timer has no effect
+        handles[2].cancel()
+
+        stats = self.loop.get_timer_stats()
+        self.assertEqual(stats['scheduled'], 4)
+        self.assertEqual(stats['expired'], 1)
+        self.assertEqual(stats['wakeups'], 1)
+        self.assertEqual(stats['wakeups_saved'], 0)
+
+        self.loop.call_later_slack(3600, 0.010, result.append, 4)
+        self.loop.close()
+        stats = self.loop.get_timer_stats()
+        self.assertEqual(stats['expired'], 1)
+
+    def test_cancel_without_slack(self):
+        result = []
+        handle = self.loop.call_later_slack(0.001, 0.010, result.append, 1)
+        # a timer without slack at the same deadline has no slot
+        self.loop.call_at(handle._when, result.append, 2).cancel()
+
+        self.loop.call_later(0.020, self.loop.stop)
+        self.loop.run_forever()
+        self.assertEqual(result, [1])
+
+        stats = self.loop.get_timer_stats()
+        self.assertEqual(stats['scheduled'], 1)
+        self.assertEqual(stats['expired'], 1)
+        self.assertEqual(stats['wakeups'], 1)
+
+    def test_set_timer_slack(self):
+        self.assertEqual(self.loop.get_timer_slack(), 0.0)
+        self.loop.set_timer_slack(1.0)
+        handle = self.loop.call_later(0.5, lambda: None)
+        self.assertEqual(handle._when, float(int(handle._when)))
+        handle.cancel()
+        self.assertRaises(ValueError, self.loop.set_timer_slack, -1)
+        self.assertRaises(ValueError, self.loop.call_later_slack,
+                          1.0, -1, lambda: None)
+
+
+class StatsTests(tests.TestCase):
+    def test_disabled(self):
+        self.assertFalse(self.loop.get_stats_enabled())
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+        stats = self.loop.get_stats()
+        self.assertFalse(stats['enabled'])
+        self.assertEqual(stats['select_calls'], 0)
+
+    def test_wakeups(self):
+        self.loop.set_stats_enabled(True)
+        rsock, wsock = aioeventlet.socketpair()
+        self.addCleanup(rsock.close)
+        self.addCleanup(wsock.close)
+
+        def read():
+            self.loop.remove_reader(rsock.fileno())
+            rsock.recv(1)
+            self.loop.call_later(0.001, self.loop.stop)
+
+        def call_threadsafe():
+            self.loop.call_soon_threadsafe(wsock.send, b'x')
+
+        def notify():
+            self.loop.call_soon(self.loop.add_reader, rsock.fileno(), read)
+            eventlet.sleep(0.001)
+            thread = aioeventlet.threading.Thread(target=call_threadsafe)
+            thread.start()
+
+        eventlet.spawn(notify)
+        self.loop.run_forever()
+
+        stats = self.loop.get_stats()
+        self.assertTrue(stats['enabled'])
+        self.assertGreater(stats['select_calls'], 0)
+        wakeups = stats['wakeups']
+        self.assertGreaterEqual(wakeups['notify'], 1)
+        self.assertGreaterEqual(wakeups['self_pipe'], 1)
+        self.assertGreaterEqual(wakeups['ready'], 1)
+        self.assertGreaterEqual(wakeups['timeout'], 1)
+        self.assertGreater(stats['ready_queue']['count'], 0)
+        self.assertGreater(stats['callback_time'], 0.0)
+        self.assertGreater(stats['hub_time'], 0.0)
+
+        self.loop.set_stats_enabled(False)
+        self.assertEqual(self.loop.get_stats()['select_calls'], 0)
+
+    def test_fds(self):
+        rsock, wsock = aioeventlet.socketpair()
+        self.addCleanup(rsock.close)
+        self.addCleanup(wsock.close)
+        stats = self.loop.get_stats()
+        self.loop.add_reader(rsock.fileno(), lambda: None)
+        self.loop.add_writer(rsock.fileno(), lambda: None)
+        new_stats = self.loop.get_stats()
+        self.assertEqual(new_stats['fds'], stats['fds'] + 1)
+        self.assertEqual(new_stats['selector_listeners'],
+                         stats['selector_listeners'] + 2)
+        self.assertEqual(new_stats['hub_listeners'],
+                         stats['hub_listeners'] + 2)
+        self.loop.remove_reader(rsock.fileno())
+        self.loop.remove_writer(rsock.fileno())
+        self.assertEqual(self.loop.get_stats()['fds'], stats['fds'])
+
+    def test_histogram(self):
+        histogram = aioeventlet._Histogram()
+        for value in (0, 1, 2, 3, 4, 100):
+            histogram.add(value)
+        self.assertEqual(histogram.get_buckets(),
+                         [(0, 0, 1), (1, 1, 1), (2, 3, 2), (4, 7, 1),
+                          (64, 127, 1)])
+        data = histogram.as_dict()
+        self.assertEqual(data['count'], 6)
+        self.assertEqual(data['max'], 100)
+        self.assertAlmostEqual(data['mean'], 110 / 6.0)
+
+
+def busy_wait(delay):
+    deadline = time.time() + delay
+    while time.time() < deadline:
+        pass
+
+
+class ProfilerTests(tests.TestCase):
+    def start_profiler(self, **kw):
+        profiler = aioeventlet.Profiler(**kw)
+        profiler.start(self.loop)
+        self.addCleanup(profiler.stop)
+        return profiler
+
+    def test_greenthread(self):
+        profiler = self.start_profiler(threshold=0.020, sample_interval=1)
+
+        def slow_greenthread():
+            busy_wait(0.060)
+
+        gt = eventlet.spawn(slow_greenthread)
+        self.loop.run_until_complete(aioeventlet.wrap_greenthread(gt))
+        profiler.stop()
+
+        report = profiler.get_report()
+        self.assertGreater(report['greenthread_runs']['count'], 0)
+        slow = [record for record in report['slow']
+                if record['type'] == 'greenthread'
+                and record['duration'] >= 0.060]
+        self.assertTrue(slow)
+        # the watchdog captured the stack during the run
+        self.assertIn('busy_wait', ''.join(slow[0]['stack']))
+
+    def test_callback(self):
+        profiler = self.start_profiler(threshold=0.020, sample_interval=1)
+
+        def slow_callback():
+            busy_wait(0.060)
+
+        self.loop.call_soon(slow_callback)
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+        profiler.stop()
+        self.assertNotIsInstance(self.loop._ready, aioeventlet._HookedReady)
+
+        report = profiler.get_report()
+        names = [entry['callback'] for entry in report['callbacks']]
+        self.assertTrue(any('slow_callback' in name for name in names))
+        slow = [record for record in report['slow']
+                if record['type'] == 'callback']
+        self.assertEqual(len(slow), 1)
+        self.assertIn('slow_callback', slow[0]['name'])
+        self.assertIn('busy_wait', ''.join(slow[0]['stack']))
+
+    def test_sample_interval(self):
+        switches = []
+
+        def count_switch(origin, target):
+            switches.append(None)
+
+        aioeventlet._add_switch_hook(count_switch)
+        self.addCleanup(aioeventlet._remove_switch_hook, count_switch)
+        profiler = self.start_profiler(threshold=0, sample_interval=3)
+        self.assertRaises(RuntimeError, profiler.start, self.loop)
+
+        def greenthread():
+            for index in range(30):
+                eventlet.sleep(0)
+
+        for index in range(10):
+            self.loop.call_soon(lambda: None)
+        gt = eventlet.spawn(greenthread)
+        self.loop.run_until_complete(aioeventlet.wrap_greenthread(gt))
+        profiler.stop()
+        report = profiler.get_report()
+
+        # one callback of 3 is recorded (the event loop calls also its own
+        # callbacks)
+        self.assertGreaterEqual(profiler._callback_count, 10)
+        self.assertEqual(sum(entry['runs']['count']
+                             for entry in report['callbacks']),
+                         profiler._callback_count // 3)
+        # one run of 3 is recorded: the run started by start() ends at the
+        # first switch
+        self.assertGreaterEqual(len(switches), 60)
+        self.assertEqual(report['greenthread_runs']['count'],
+                         1 + (len(switches) - 1) // 3)
+        self.assertEqual(report['slow'], [])
+
+        self.assertRaises(ValueError, aioeventlet.Profiler,
+                          sample_interval=0)
+
+
+def burn_cpu(delay):
+    deadline = aioeventlet._thread_time() + delay
+    while aioeventlet._thread_time() < deadline:
+        pass
+
+
+class CpuAccountingTests(tests.TestCase):
+    def setUp(self):
+        super(CpuAccountingTests, self).setUp()
+        if aioeventlet._thread_time is None:
+            self.skipTest("the thread CPU time is not available")
+
+    def start_accounting(self):
+        accounting = aioeventlet.CpuAccounting()
+        accounting.start(self.loop)
+        self.addCleanup(accounting.stop)
+        return accounting
+
+    def find(self, entries, name):
+        return [entry for entry in entries if name in entry['name']]
+
+    def test_wrap_greenthread(self):
+        accounting = self.start_accounting()
+        greenthreads = []
+
+        def burn_greenthread():
+            burn_cpu(0.030)
+
+        def spawn():
+            gt = eventlet.spawn(burn_greenthread)
+            greenthreads.append(gt)
+            fut = aioeventlet.wrap_greenthread(gt, loop=self.loop)
+            fut.add_done_callback(lambda fut: self.loop.stop())
+
+        self.loop.call_soon(spawn)
+        self.loop.run_forever()
+
+        report = accounting.get_report()
+        entries = self.find(report['top'], 'burn_greenthread')
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['type'], 'greenthread')
+        self.assertGreaterEqual(entries[0]['cpu'], 0.020)
+        self.assertIn('spawn', entries[0]['owner'])
+
+    def test_yield_future(self):
+        accounting = self.start_accounting()
+        tasks = []
+
+        @asyncio.coroutine
+        def burn_task():
+            burn_cpu(0.030)
+            if False:
+                yield
+
+        def waiter():
+            task = asyncio.Task(burn_task(), loop=self.loop)
+            tasks.append(task)
+            aioeventlet.yield_future(task, loop=self.loop)
+            self.loop.stop()
+
+        eventlet.spawn(waiter)
+        self.loop.run_forever()
+
+        report = accounting.get_report()
+        entries = self.find(report['top'], 'burn_task')
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['type'], 'task')
+        self.assertGreaterEqual(entries[0]['cpu'], 0.020)
+        self.assertIn('waiter', entries[0]['owner'])
+
+    def test_finished(self):
+        accounting = self.start_accounting()
+
+        def burn_greenthread():
+            burn_cpu(0.030)
+
+        def burn_callback():
+            burn_cpu(0.030)
+
+        gt = eventlet.spawn(burn_greenthread)
+        self.loop.run_until_complete(aioeventlet.wrap_greenthread(gt))
+        self.loop.call_soon(burn_callback)
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+        del gt
+        accounting.stop()
+
+        report = accounting.get_report()
+        self.assertGreaterEqual(report['cpu'], 0.060)
+        entries = self.find(report['by_name'], 'burn_greenthread')
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['count'], 1)
+        self.assertGreaterEqual(entries[0]['cpu'], 0.020)
+        entries = self.find(report['by_name'], 'burn_callback')
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['type'], 'callback')
+        self.assertGreaterEqual(entries[0]['cpu'], 0.020)
+
+        accounting.reset()
+        self.assertEqual(accounting.get_report()['top'], [])
+
+    def test_start(self):
+        accounting = self.start_accounting()
+        self.assertRaises(RuntimeError, accounting.start, self.loop)
+        self.assertRaises(RuntimeError,
+                          aioeventlet.CpuAccounting().start, self.loop)
+        accounting.stop()
+        self.assertIsNone(aioeventlet._get_cpu_accounting())
+
+
+class SelectorTests(tests.TestCase):
+    def setUp(self):
+        super(SelectorTests, self).setUp()
+        rsock, wsock = aioeventlet.socketpair()
+        self.addCleanup(rsock.close)
+        self.addCleanup(wsock.close)
+        self.sock = rsock
+        self.selector = self.loop._selector
+
+    def get_listeners(self):
+        fd = self.sock.fileno()
+        hub = self.loop._hub
+        return (hub.listeners[aioeventlet._HUB_READ].get(fd),
+                hub.listeners[aioeventlet._HUB_WRITE].get(fd))
+
+    def test_modify(self):
+        selector = self.selector
+        read, write = aioeventlet._EVENT_READ, aioeventlet._EVENT_WRITE
+
+        key = selector.register(self.sock, read, 'data')
+        self.addCleanup(selector.unregister, self.sock)
+        reader, writer = self.get_listeners()
+        self.assertIsNotNone(reader)
+        self.assertIsNone(writer)
+
+        # add write: the read listener must be kept
+        key = selector.modify(self.sock, read | write, 'data')
+        self.assertEqual(key.events, read | write)
+        self.assertIs(selector.get_key(self.sock), key)
+        listeners = self.get_listeners()
+        self.assertIs(listeners[0], reader)
+        self.assertIsNotNone(listeners[1])
+
+        # remove write
+        key = selector.modify(self.sock, read, 'data')
+        self.assertEqual(key.events, read)
+        self.assertEqual(self.get_listeners(), (reader, None))
+
+        # only modify data
+        key = selector.modify(self.sock, read, 'data2')
+        self.assertEqual(key.data, 'data2')
+        self.assertEqual(self.get_listeners(), (reader, None))
+
+    def test_modify_errors(self):
+        self.assertRaises(KeyError,
+                          self.selector.modify,
+                          self.sock, aioeventlet._EVENT_READ)
+
+        self.selector.register(self.sock, aioeventlet._EVENT_READ)
+        self.addCleanup(self.selector.unregister, self.sock)
+        self.assertRaises(ValueError, self.selector.modify, self.sock, 0)
+
+    def test_read_events(self):
+        selector = self.selector
+        read, write = aioeventlet._EVENT_READ, aioeventlet._EVENT_WRITE
+        fd = self.sock.fileno()
+
+        key = selector.register(self.sock, read)
+        self.addCleanup(selector.unregister, self.sock)
+        selector._notify(fd, read)
+        selector._notify(fd, write)
+        selector._notify(fd, read)
+        self.assertEqual(selector._read_events(), [(key, read)])
+        self.assertEqual(selector._read_events(), [])
+
+    def test_read_events_unregistered(self):
+        selector = self.selector
+        read = aioeventlet._EVENT_READ
+        fd = self.sock.fileno()
+
+        selector.register(self.sock, read)
+        selector._notify(fd, read)
+        selector.unregister(self.sock)
+        # the unregistered file descriptor must be ignored
+        self.assertEqual(selector._read_events(), [])
+
+        # notified events must not be reported after a new registration
+        selector.register(self.sock, read)
+        selector._notify(fd, read)
+        selector.unregister(self.sock)
+        key = selector.register(self.sock, read)
+        self.addCleanup(selector.unregister, self.sock)
+        self.assertEqual(selector._read_events(), [])
+
+        selector._notify(fd, read)
+        self.assertEqual(selector._read_events(), [(key, read)])
+
+    def count_listeners(self):
+        hub = self.loop._hub
+        return (len(hub.listeners[aioeventlet._HUB_READ]),
+                len(hub.listeners[aioeventlet._HUB_WRITE]))
+
+    @unittest.skipUnless(aioeventlet._EVENTLET15,
+                         "need eventlet 0.15 or newer")
+    def test_throwback(self):
+        baseline = self.count_listeners()
+        result = []
+
+        def reader():
+            result.append('read')
+            self.loop.remove_reader(self.sock)
+            self.loop.stop()
+
+        self.loop.add_reader(self.sock, reader)
+        # simulate a new file reusing the file descriptor
+        self.loop._hub.mark_as_reopened(self.sock.fileno())
+        handle = self.loop.call_later(5.0, self.loop.stop)
+        self.loop.run_forever()
+        handle.cancel()
+        self.assertEqual(result, ['read'])
+        self.assertEqual(self.count_listeners(), baseline)
+
+    @unittest.skipUnless(aioeventlet._EVENTLET15,
+                         "need eventlet 0.15 or newer")
+    def test_throwback_churn(self):
+        baseline = self.count_listeners()
+        result = []
+
+        def reader(fd, sock, fut):
+            try:
+                sock.recv(1)
+            except (OSError, IOError):
+                result.append('error')
+            self.loop.remove_reader(fd)
+            fut.set_result(None)
+
+        for index in range(1000):
+            rsock, wsock = aioeventlet.socketpair()
+            fd = rsock.fileno()
+            fut = asyncio.Future(loop=self.loop)
+            self.loop.add_reader(fd, reader, fd, rsock, fut)
+            # close the socket without unregistering it
+            rsock.close()
+            wsock.close()
+            self.loop._hub.mark_as_reopened(fd)
+            self.loop.run_until_complete(fut)
+
+        self.assertEqual(result, ['error'] * 1000)
+        self.assertEqual(self.count_listeners(), baseline)
+
+    def test_connection_churn(self):
+        baseline = self.count_listeners()
+
+        class Server(asyncio.Protocol):
+            def connection_made(self, transport):
+                transport.close()
+
+        class Client(asyncio.Protocol):
+            def __init__(self, fut):
+                self.fut = fut
+
+            def connection_lost(self, exc):
+                self.fut.set_result(None)
+
+        server = self.loop.run_until_complete(
+            self.loop.create_server(Server, '127.0.0.1', 0))
+        port = server.sockets[0].getsockname()[1]
+        for index in range(1000):
+            fut = asyncio.Future(loop=self.loop)
+            self.loop.run_until_complete(
+                self.loop.create_connection(lambda: Client(fut),
+                                            '127.0.0.1', port))
+            self.loop.run_until_complete(fut)
+        server.close()
+        self.loop.call_later(0.010, self.loop.stop)
+        self.loop.run_forever()
+
+        self.assertEqual(self.count_listeners(), baseline)
+
+
+class SockFastPathTests(tests.TestCase):
+    def socketpair(self):
+        rsock, wsock = aioeventlet.socketpair()
+        self.addCleanup(rsock.close)
+        self.addCleanup(wsock.close)
+        rsock.setblocking(False)
+        wsock.setblocking(False)
+        return rsock, wsock
+
+    def count_listeners(self, fd):
+        hub = self.loop._hub
+        return sum(fd in hub.listeners[evtype]
+                   for evtype in (aioeventlet._HUB_READ,
+                                  aioeventlet._HUB_WRITE))
+
+    def test_recv_sendall(self):
+        rsock, wsock = self.socketpair()
+        fut = self.loop.sock_recv(rsock, 100)
+        # the socket is not registered into the selector
+        self.assertEqual(self.loop._selector.get_map().get(rsock), None)
+        self.assertEqual(self.count_listeners(rsock.fileno()), 1)
+
+        data = b'x' * (1024 * 1024)
+        send = self.loop.sock_sendall(wsock, data)
+        self.assertEqual(self.loop.run_until_complete(fut), b'x' * 100)
+        self.assertEqual(self.count_listeners(rsock.fileno()), 0)
+
+        received = [b'x' * 100]
+        while len(b''.join(received)) < len(data):
+            received.append(self.loop.run_until_complete(
+                self.loop.sock_recv(rsock, 65536)))
+        self.assertEqual(b''.join(received), data)
+        self.assertIsNone(self.loop.run_until_complete(send))
+        self.assertEqual(self.count_listeners(wsock.fileno()), 0)
+
+    def test_recv_cancel(self):
+        rsock, wsock = self.socketpair()
+        fut = self.loop.sock_recv(rsock, 100)
+        fut.cancel()
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+        self.assertEqual(self.count_listeners(rsock.fileno()), 0)
+
+        # the data is not lost
+        wsock.send(b'data')
+        fut = self.loop.sock_recv(rsock, 100)
+        self.assertEqual(self.loop.run_until_complete(fut), b'data')
+
+    def test_recv_ready(self):
+        rsock, wsock = self.socketpair()
+        wsock.send(b'data')
+        # the data is received immediately, no hub listener is created
+        fut = self.loop.sock_recv(rsock, 100)
+        self.assertTrue(fut.done())
+        self.assertEqual(fut.result(), b'data')
+        self.assertEqual(self.count_listeners(rsock.fileno()), 0)
+
+    def test_recv_registered(self):
+        rsock, wsock = self.socketpair()
+        self.loop.add_reader(rsock.fileno(), lambda: None)
+        self.addCleanup(self.loop.remove_reader, rsock.fileno())
+        self.assertFalse(self.loop._use_sock_fast_path(
+            rsock, aioeventlet._HUB_READ))
+
+        # the socket is not ready: wait with the selector
+        recv = self.loop.sock_recv(rsock, 100)
+        self.loop.call_soon(wsock.send, b'data')
+        self.assertEqual(self.loop.run_until_complete(recv), b'data')
+
+    def test_accept_connect(self):
+        socket = eventlet.patcher.original('socket')
+        listener = socket.socket()
+        self.addCleanup(listener.close)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(5)
+        listener.setblocking(False)
+        address = listener.getsockname()
+
+        accept = self.loop.sock_accept(listener)
+        client = socket.socket()
+        self.addCleanup(client.close)
+        client.setblocking(False)
+        connect = self.loop.sock_connect(client, address)
+        self.loop.run_until_complete(connect)
+        conn, peer = self.loop.run_until_complete(accept)
+        self.addCleanup(conn.close)
+        self.assertEqual(peer, client.getsockname())
+        self.assertEqual(conn.gettimeout(), 0)
+
+        # connection refused
+        listener.close()
+        client2 = socket.socket()
+        self.addCleanup(client2.close)
+        client2.setblocking(False)
+        connect = self.loop.sock_connect(client2, address)
+        self.assertRaises(socket.error, self.loop.run_until_complete, connect)
+
+
+class BufferPoolTests(tests.TestCase):
+    def test_pool(self):
+        pool = aioeventlet.BufferPool(buffer_size=10, max_buffers=1)
+        buf1 = pool.acquire()
+        buf2 = pool.acquire()
+        self.assertEqual(len(buf1), 10)
+        self.assertIsNot(buf1, buf2)
+        pool.release(buf1)
+        pool.release(buf2)
+        # at most max_buffers buffers are kept
+        self.assertIs(pool.acquire(), buf1)
+        self.assertIsNot(pool.acquire(), buf2)
+
+    def test_sock_recv_into(self):
+        rsock, wsock = aioeventlet.socketpair()
+        self.addCleanup(rsock.close)
+        self.addCleanup(wsock.close)
+        rsock.setblocking(False)
+        buf = bytearray(100)
+        fut = self.loop.sock_recv_into(rsock, buf)
+        wsock.send(b'data')
+        self.assertEqual(self.loop.run_until_complete(fut), 4)
+        self.assertEqual(buf[:4], b'data')
+
+    def test_pooled_protocol(self):
+        received = []
+        acquired = []
+
+        class Pool(aioeventlet.BufferPool):
+            def acquire(self):
+                buf = aioeventlet.BufferPool.acquire(self)
+                acquired.append(buf)
+                return buf
+
+        class Protocol(aioeventlet.PooledBufferProtocol):
+            def connection_made(self, transport):
+                self.transport = transport
+
+            def buffer_received(self, view):
+                received.append(view.tobytes())
+                if b''.join(received) == b'abcdef':
+                    self.transport.close()
+
+            def connection_lost(self, exc):
+                self.loop.stop()
+
+        Protocol.loop = self.loop
+        self.loop.set_buffer_pool(Pool(buffer_size=1024))
+        rsock, wsock = aioeventlet.socketpair()
+        self.addCleanup(wsock.close)
+        self.loop.run_until_complete(
+            self.loop.create_connection(Protocol, sock=rsock))
+        wsock.send(b'abc')
+        self.loop.call_later(0.01, wsock.send, b'def')
+        self.loop.run_forever()
+        self.assertEqual(b''.join(received), b'abcdef')
+
+        # data was received into pooled buffers, the same buffer is used
+        # for all reads
+        self.assertGreaterEqual(len(acquired), 2)
+        self.assertTrue(all(buf is acquired[0] for buf in acquired))
+        self.assertEqual(len(acquired[0]), 1024)
+
+    def test_pooled_protocol_eof(self):
+        socket = eventlet.patcher.original('socket')
+        events = []
+
+        class Protocol(aioeventlet.PooledBufferProtocol):
+            def buffer_received(self, view):
+                events.append(view.tobytes())
+
+            def eof_received(self):
+                events.append('eof')
+
+            def connection_lost(self, exc):
+                events.append('lost')
+                self.loop.stop()
+
+        Protocol.loop = self.loop
+        rsock, wsock = aioeventlet.socketpair()
+        self.addCleanup(wsock.close)
+        self.loop.run_until_complete(
+            self.loop.create_connection(Protocol, sock=rsock))
+        wsock.send(b'abc')
+        wsock.shutdown(socket.SHUT_WR)
+        self.loop.run_forever()
+        self.assertEqual(events, [b'abc', 'eof', 'lost'])
+        # the buffer was given back to the pool
+        self.assertEqual(len(self.loop.get_buffer_pool()._free), 1)
+
+
+class SendfileTests(tests.TestCase):
+    DATA = b''.join(str(index).encode('ascii') for index in range(200000))
+
+    def setUp(self):
+        super(SendfileTests, self).setUp()
+        import tempfile
+        self.file = tempfile.TemporaryFile()
+        self.addCleanup(self.file.close)
+        self.file.write(self.DATA)
+        self.file.seek(0)
+        self.rsock, self.wsock = aioeventlet.socketpair()
+        self.addCleanup(self.rsock.close)
+        self.addCleanup(self.wsock.close)
+        self.rsock.setblocking(False)
+        self.wsock.setblocking(False)
+
+    def receive(self, fut, size):
+        data = []
+        received = 0
+        while received < size:
+            chunk = self.loop.run_until_complete(
+                self.loop.sock_recv(self.rsock, 65536))
+            data.append(chunk)
+            received += len(chunk)
+        return self.loop.run_until_complete(fut), b''.join(data)
+
+    @unittest.skipUnless(hasattr(os, 'sendfile'), 'need os.sendfile()')
+    def test_sock_sendfile(self):
+        with tests.mock.patch.object(self.loop,
+                                     '_sock_sendfile_fallback') as fallback:
+            fut = self.loop.sock_sendfile(self.wsock, self.file)
+            sent, data = self.receive(fut, len(self.DATA))
+        self.assertFalse(fallback.called)
+        self.assertEqual(sent, len(self.DATA))
+        self.assertEqual(data, self.DATA)
+        self.assertEqual(self.file.tell(), len(self.DATA))
+
+    def test_offset_count(self):
+        fut = self.loop.sock_sendfile(self.wsock, self.file, 1000, 5000)
+        sent, data = self.receive(fut, 5000)
+        self.assertEqual(sent, 5000)
+        self.assertEqual(data, self.DATA[1000:6000])
+        self.assertEqual(self.file.tell(), 6000)
+
+    def test_fallback(self):
+        import io
+        file = io.BytesIO(self.DATA)
+        fut = self.loop.sock_sendfile(self.wsock, file, 10)
+        sent, data = self.receive(fut, len(self.DATA) - 10)
+        self.assertEqual(sent, len(self.DATA) - 10)
+        self.assertEqual(data, self.DATA[10:])
+        self.assertEqual(file.tell(), len(self.DATA))
+
+        self.assertRaises(aioeventlet._SendfileNotAvailableError,
+                          self.loop.sock_sendfile, self.wsock, file,
+                          fallback=False)
+
+    def test_invalid_params(self):
+        self.assertRaises(ValueError, self.loop.sock_sendfile,
+                          self.wsock, self.file, -1)
+        self.assertRaises(ValueError, self.loop.sock_sendfile,
+                          self.wsock, self.file, 0, 0)
+
+    def test_transport_sendfile(self):
+        transport, protocol = self.loop.run_until_complete(
+            self.loop.create_connection(asyncio.Protocol, sock=self.wsock))
+        self.addCleanup(transport.close)
+        # large enough to fill the socket buffer: the file is sent after
+        # the write buffer is flushed
+        header = b'header' * 200000
+        transport.write(header)
+        self.assertNotEqual(transport.get_write_buffer_size(), 0)
+        fut = self.loop.sendfile(transport, self.file)
+        self.assertRaises(RuntimeError, transport.write, b'data')
+        self.assertRaises(RuntimeError, self.loop.sendfile,
+                          transport, self.file)
+        sent, data = self.receive(fut, len(header) + len(self.DATA))
+        self.assertEqual(sent, len(self.DATA))
+        self.assertEqual(data, header + self.DATA)
+
+        # reading is resumed and write() works again
+        self.assertFalse(transport._paused)
+        transport.write(b'trailer')
+        sent, data = self.receive(fut, 7)
+        self.assertEqual(data, b'trailer')
+
+    def test_transport_sendfile_fallback(self):
+        import io
+        transport, protocol = self.loop.run_until_complete(
+            self.loop.create_connection(asyncio.Protocol, sock=self.wsock))
+        self.addCleanup(transport.close)
+        file = io.BytesIO(self.DATA)
+        fut = self.loop.sendfile(transport, file, 10, 5000)
+        sent, data = self.receive(fut, 5000)
+        self.assertEqual(sent, 5000)
+        self.assertEqual(data, self.DATA[10:5010])
+
+        self.assertRaises(aioeventlet._SendfileNotAvailableError,
+                          self.loop.sendfile, tests.mock.Mock(), file)
+
+
+class TpoolExecutorTests(tests.TestCase):
+    DELAY = 0.2
+
+    def blocking_sleep(self, value):
+        time = eventlet.patcher.original('time')
+        time.sleep(self.DELAY)
+        return value
+
+    def run_in_executor(self, executor, values):
+        ticks = []
+
+        def tick():
+            ticks.append(None)
+            handle[0] = self.loop.call_later(0.010, tick)
+        handle = [self.loop.call_soon(tick)]
+
+        clock = eventlet.patcher.original('time').time
+        t0 = clock()
+        futs = [self.loop.run_in_executor(executor, self.blocking_sleep, value)
+                for value in values]
+        results = [self.loop.run_until_complete(fut) for fut in futs]
+        dt = clock() - t0
+        handle[0].cancel()
+        return results, dt, len(ticks)
+
+    def test_submit(self):
+        executor = aioeventlet._TpoolExecutor(self.loop)
+        fut = executor.submit(self.blocking_sleep, 'result')
+        self.assertFalse(fut.done())
+        self.assertEqual(self.loop.run_until_complete(fut), 'result')
+
+    def test_submit_error(self):
+        def func():
+            raise ValueError(7)
+
+        executor = aioeventlet._TpoolExecutor(self.loop)
+        fut = executor.submit(func)
+        self.assertRaises(ValueError, self.loop.run_until_complete, fut)
+
+    def test_parallel(self):
+        executor = aioeventlet._TpoolExecutor(self.loop)
+        results, dt, ticks = self.run_in_executor(executor, (1, 2, 3))
+        self.assertEqual(results, [1, 2, 3])
+        # functions run in parallel
+        self.assertLess(dt, self.DELAY * 2)
+        # the event loop is not blocked
+        self.assertGreater(ticks, 1)
+
+    def test_max_workers(self):
+        executor = aioeventlet._TpoolExecutor(self.loop, max_workers=1)
+        results, dt, ticks = self.run_in_executor(executor, (1, 2))
+        self.assertEqual(results, [1, 2])
+        self.assertGreaterEqual(dt, self.DELAY * 2)
+        self.assertRaises(ValueError,
+                          aioeventlet._TpoolExecutor, self.loop, 0)
+
+    def test_max_queued(self):
+        threading = eventlet.patcher.original('threading')
+        lock = threading.Lock()
+        lock.acquire()
+
+        executor = aioeventlet._TpoolExecutor(self.loop, max_workers=1,
+                                              max_queued=1)
+        running = executor.submit(lock.acquire)
+        queued = executor.submit(lambda: 'queued')
+        self.assertRaisesRegex(RuntimeError, 'executor queue is full',
+                               executor.submit, lambda: 'rejected')
+
+        executor._rejection_policy = 'caller_runs'
+        fut = executor.submit(lambda: 'caller')
+        self.assertEqual(fut.result(), 'caller')
+
+        executor._rejection_policy = 'discard_oldest'
+        newest = executor.submit(lambda: 'newest')
+        self.assertTrue(queued.cancelled())
+
+        stats = executor.get_stats()
+        self.assertEqual(stats['running'], 1)
+        self.assertEqual(stats['queued'], 1)
+        self.assertEqual(stats['rejected'], 3)
+
+        self.assertFalse(running.done())
+        lock.release()
+        self.assertTrue(self.loop.run_until_complete(running))
+        self.assertEqual(self.loop.run_until_complete(newest), 'newest')
+        stats = executor.get_stats()
+        self.assertEqual(stats['running'], 0)
+        self.assertEqual(stats['queued'], 0)
+        self.assertEqual(stats['completed'], 3)
+
+    def test_shutdown(self):
+        executor = self.loop.configure_executor(max_workers=1)
+        self.assertIs(self.loop._default_executor, executor)
+        fut1 = self.loop.run_in_executor(None, self.blocking_sleep, 1)
+        fut2 = self.loop.run_in_executor(None, self.blocking_sleep, 2)
+        # wait until the first function is running
+        self.loop.run_until_complete(asyncio.sleep(0.010))
+
+        executor.shutdown(wait=False)
+        self.assertTrue(fut2.cancelled())
+        self.assertRaises(RuntimeError,
+                          executor.submit, self.blocking_sleep, 3)
+        self.assertEqual(self.loop.run_until_complete(fut1), 1)
+
+    def test_shutdown_wait(self):
+        executor = aioeventlet._TpoolExecutor(self.loop, max_workers=1)
+        futs = [executor.submit(self.blocking_sleep, value)
+                for value in (1, 2)]
+        executor.shutdown(wait=True)
+        self.assertEqual([fut.result() for fut in futs], [1, 2])
+        self.assertEqual(executor._threads, [])
+        self.assertIsNone(executor._rsock)
+
+    def test_own_threads(self):
+        # the executor doesn't share the eventlet thread pool: functions
+        # of a blocked executor don't block other executors, and an
+        # executor can run more functions than the eventlet thread pool
+        threading = eventlet.patcher.original('threading')
+        nworker = 30
+        cond = threading.Condition()
+        started = []
+
+        clock = eventlet.patcher.original('time').time
+
+        def wait_all():
+            deadline = clock() + 5.0
+            with cond:
+                started.append(None)
+                cond.notify_all()
+                while len(started) < nworker and clock() < deadline:
+                    cond.wait(0.1)
+            return len(started)
+
+        blocked = aioeventlet._TpoolExecutor(self.loop, max_workers=nworker)
+        self.addCleanup(blocked.shutdown, wait=False)
+        futs = [blocked.submit(wait_all) for index in range(nworker - 1)]
+
+        other = aioeventlet._TpoolExecutor(self.loop, max_workers=1)
+        self.assertEqual(self.loop.run_until_complete(
+                         other.submit(lambda: 'other')), 'other')
+
+        futs.append(blocked.submit(wait_all))
+        results = self.loop.run_until_complete(asyncio.gather(*futs))
+        self.assertEqual(results, [nworker] * nworker)
+        self.assertEqual(len(blocked._threads), nworker)
+
+    def test_shutdown_wait_from_hub(self):
+        executor = aioeventlet._TpoolExecutor(self.loop, max_workers=1)
+        fut = executor.submit(self.blocking_sleep, 1)
+        result = []
+
+        def shutdown():
+            try:
+                executor.shutdown(wait=True)
+            except RuntimeError as exc:
+                result.append(str(exc))
+
+        hub = eventlet.hubs.get_hub()
+        hub.schedule_call_global(0, shutdown)
+        self.assertEqual(self.loop.run_until_complete(fut), 1)
+        self.assertEqual(result, ['shutdown(wait=True) must not be called '
+                                  'from the hub greenlet'])
+        executor.shutdown(wait=True)
+
+
+class GreenPoolExecutorTests(tests.TestCase):
+    def test_run_in_executor(self):
+        running = []
+
+        def green_sleep(value):
+            running.append(value)
+            max_running.append(len(running))
+            eventlet.sleep(0.010)
+            running.remove(value)
+            return value * 10
+
+        max_running = []
+        executor = aioeventlet.GreenPoolExecutor(max_workers=2)
+        self.assertIs(executor._loop, self.loop)
+        futs = [self.loop.run_in_executor(executor, green_sleep, value)
+                for value in range(5)]
+        results = [self.loop.run_until_complete(fut) for fut in futs]
+        self.assertEqual(results, [0, 10, 20, 30, 40])
+        self.assertEqual(max(max_running), 2)
+
+        stats = executor.get_stats()
+        self.assertEqual(stats['completed'], 5)
+        self.assertEqual(stats['running'], 0)
+
+    def test_error(self):
+        def func():
+            eventlet.sleep(0)
+            raise ValueError(7)
+
+        executor = aioeventlet.GreenPoolExecutor(loop=self.loop)
+        fut = executor.submit(func)
+        self.assertRaises(ValueError, self.loop.run_until_complete, fut)
+        self.assertEqual(executor.get_stats()['failed'], 1)
+
+    def test_shutdown(self):
+        executor = aioeventlet.GreenPoolExecutor(max_workers=1,
+                                                 loop=self.loop)
+        futs = [executor.submit(eventlet_slow_append, [], value, 0.001)
+                for value in (1, 2)]
+        executor.shutdown(wait=True)
+        self.assertEqual([fut.result() for fut in futs], [10, 20])
+        self.assertRaises(RuntimeError, executor.submit, eventlet.sleep, 0)
+
+    def test_many_queued(self):
+        # Queued functions must not be run recursively from the worker
+        # which just completed
+        executor = aioeventlet.GreenPoolExecutor(max_workers=1,
+                                                 loop=self.loop)
+        futs = [executor.submit(int, value) for value in range(3000)]
+        executor.shutdown(wait=True)
+        self.assertEqual([fut.result() for fut in futs], list(range(3000)))
+
+
+class ChannelTests(tests.TestCase):
+    def test_green_producer(self):
+        chan = aioeventlet.Channel(10)
+        qsizes = []
+
+        def producer():
+            for item in range(100):
+                chan.put(item)
+                qsizes.append(chan.qsize())
+            chan.put_many(['a', 'b', 'c'])
+
+        eventlet.spawn(producer)
+        items = []
+        while len(items) < 103:
+            batch = self.loop.run_until_complete(chan.async_get_many())
+            self.assertGreaterEqual(len(batch), 1)
+            items.extend(batch)
+        self.assertEqual(items, list(range(100)) + ['a', 'b', 'c'])
+        # backpressure
+        self.assertLessEqual(max(qsizes), 10)
+
+    def test_green_consumer(self):
+        chan = aioeventlet.Channel(3)
+        items = []
+
+        def consumer():
+            items.append(chan.get())
+            while len(items) < 10:
+                items.extend(chan.get_many(2))
+
+        gt = eventlet.spawn(consumer)
+        futs = [chan.async_put(item) for item in range(5)]
+        # the channel is full
+        self.assertEqual([fut.done() for fut in futs],
+                         [True, True, True, False, False])
+        self.loop.run_until_complete(chan.async_put_many(range(5, 10)))
+        gt.wait()
+        self.assertEqual(items, list(range(10)))
+        self.assertTrue(all(fut.done() for fut in futs))
+
+    def test_async_get(self):
+        chan = aioeventlet.Channel(1)
+        fut1 = chan.async_get()
+        fut2 = chan.async_get()
+        fut1.cancel()
+        # a cancelled getter must not lose items
+        chan.async_put('item')
+        self.assertEqual(self.loop.run_until_complete(fut2), 'item')
+        self.assertEqual(chan.qsize(), 0)
+
+    def test_get_from_loop(self):
+        chan = aioeventlet.Channel(1)
+        result = []
+
+        def func():
+            try:
+                chan.get()
+            except RuntimeError as exc:
+                result.append(str(exc))
+
+        self.loop.call_soon(func)
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+        self.assertEqual(len(result), 1)
+        self.assertIn('must not be called from the greenthread', result[0])
+        self.assertRaises(ValueError, aioeventlet.Channel, 0)
+
+
+class WrapGeneratorTests(tests.TestCase):
+    def consume(self, it):
+        items = []
+        while True:
+            try:
+                item = self.loop.run_until_complete(it.next_future())
+            except aioeventlet.StopAsyncIteration:
+                return items
+            items.append(item)
+
+    def test_wrap_generator(self):
+        def gen():
+            for item in range(10):
+                eventlet.sleep(0)
+                yield item
+
+        it = aioeventlet.wrap_generator(gen(), prefetch=3)
+        self.assertEqual(self.consume(it), list(range(10)))
+        self.assertRaises(aioeventlet.StopAsyncIteration,
+                          self.loop.run_until_complete, it.next_future())
+
+    def test_prefetch(self):
+        produced = []
+
+        def gen():
+            for item in range(10):
+                produced.append(item)
+                yield item
+
+        it = aioeventlet.wrap_generator(gen(), prefetch=3)
+        self.assertEqual(self.loop.run_until_complete(it.next_future()), 0)
+        # the greenthread is blocked when the channel is full
+        self.assertLessEqual(len(produced), 5)
+        self.assertEqual(self.consume(it), list(range(1, 10)))
+
+    def test_error(self):
+        def gen():
+            yield 1
+            yield 2
+            raise ValueError("error")
+
+        it = aioeventlet.wrap_generator(gen())
+        self.assertEqual(self.loop.run_until_complete(it.next_future()), 1)
+        self.assertEqual(self.loop.run_until_complete(it.next_future()), 2)
+        self.assertRaises(ValueError,
+                          self.loop.run_until_complete, it.next_future())
+        self.assertRaises(aioeventlet.StopAsyncIteration,
+                          self.loop.run_until_complete, it.next_future())
+
+    def test_aclose(self):
+        result = []
+
+        def gen():
+            try:
+                for item in range(10):
+                    yield item
+            finally:
+                result.append('closed')
+
+        it = aioeventlet.wrap_generator(gen())
+        self.assertEqual(self.loop.run_until_complete(it.next_future()), 0)
+        self.loop.run_until_complete(it.aclose())
+        self.assertEqual(result, ['closed'])
+        self.assertRaises(aioeventlet.StopAsyncIteration,
+                          self.loop.run_until_complete, it.next_future())
+
+    @unittest.skipIf(sys.version_info < (3, 5), 'need Python 3.5')
+    def test_async_for(self):
+        namespace = {'aioeventlet': aioeventlet}
+        exec('''if 1:
+            async def consume(it):
+                items = []
+                async for item in it:
+                    items.append(item)
+                return items
+        ''', namespace)
+
+        it = aioeventlet.wrap_generator(iter(range(5)), prefetch=2)
+        items = self.loop.run_until_complete(namespace['consume'](it))
+        self.assertEqual(items, list(range(5)))
+
+
+class EventLoopGroupTests(tests.TestCase):
+    def setUp(self):
+        super(EventLoopGroupTests, self).setUp()
+        self.group = aioeventlet.EventLoopGroup(2)
+        self.group.start()
+        self.addCleanup(self.group.stop)
+
+    def test_get_loop(self):
+        loops = self.group.get_loops()
+        self.assertEqual(len(loops), 2)
+        self.assertNotIn(self.loop, loops)
+        self.assertIsNot(loops[0]._hub, loops[1]._hub)
+        self.assertIsNot(loops[0]._hub, self.loop._hub)
+
+        # round-robin
+        self.assertEqual(set([self.group.get_loop(), self.group.get_loop()]),
+                         set(loops))
+        # sharding
+        self.assertIs(self.group.get_loop('key'),
+                      self.group.get_loop('key'))
+
+    def test_run_in_loop(self):
+        threading = eventlet.patcher.original('threading')
+        idents = set()
+        for loop in self.group.get_loops():
+            cfut = aioeventlet.run_in_loop(loop, threading.current_thread)
+            thread = cfut.result(5.0)
+            self.assertIsNot(thread, threading.current_thread())
+            idents.add(thread.ident)
+        self.assertEqual(len(idents), 2)
+
+        def error():
+            raise ValueError("error")
+
+        cfut = aioeventlet.run_in_loop(self.group.get_loop(), error)
+        self.assertRaises(ValueError, cfut.result, 5.0)
+
+    def test_run_coroutine(self):
+        result = []
+        loop = self.group.get_loop()
+        cfut = aioeventlet.run_in_loop(loop, coro_slow_append, result, 1)
+        self.assertEqual(cfut.result(5.0), 10)
+        self.assertEqual(result, [1])
+
+        # wait for a coroutine running in another loop from a coroutine
+        cfut = aioeventlet.run_in_loop(loop, coro_slow_append, result, 2)
+        fut = asyncio.wrap_future(cfut, loop=self.loop)
+        self.assertEqual(self.loop.run_until_complete(fut), 20)
+
+    def test_stop(self):
+        loops = self.group.get_loops()
+        self.group.stop()
+        self.assertTrue(all(loop.is_closed() for loop in loops))
+        self.assertRaises(RuntimeError, self.group.get_loop)
+        self.assertRaises(ValueError, aioeventlet.EventLoopGroup, 0)
+
+
+class PidProtocol(asyncio.Protocol):
+    def connection_made(self, transport):
+        transport.write(str(os.getpid()).encode('ascii'))
+        transport.close()
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'need os.fork()')
+class PreforkServerTests(tests.TestCase):
+    def get_pid(self, address):
+        socket = eventlet.patcher.original('socket')
+        deadline = time.time() + 10.0
+        while time.time() < deadline:
+            try:
+                sock = socket.create_connection(address, timeout=5.0)
+            except socket.error:
+                # the worker is not listening yet
+                time.sleep(0.01)
+                continue
+            try:
+                data = b''
+                while True:
+                    chunk = sock.recv(100)
+                    if not chunk:
+                        break
+                    data += chunk
+            except socket.error:
+                data = b''
+            finally:
+                sock.close()
+            if data:
+                return int(data)
+        self.fail("no worker answered")
+
+    def wait_new_pid(self, address, old_pids):
+        deadline = time.time() + 10.0
+        while time.time() < deadline:
+            pid = self.get_pid(address)
+            if pid not in old_pids:
+                return pid
+        self.fail("no new worker")
+
+    def start_server(self, **kw):
+        server = aioeventlet.PreforkServer(PidProtocol, '127.0.0.1', 0,
+                                           workers=1, **kw)
+        server.restart_delay = 0.05
+        pid = os.fork()
+        if not pid:
+            status = 1
+            try:
+                # the test kills a worker: don't log its unexpected exit
+                with tests.mock.patch.object(aioeventlet.logger, 'error'):
+                    server.run()
+                status = 0
+            finally:
+                os._exit(status)
+        address = server.getsockname()
+        server.close()
+        self.addCleanup(self.stop_server, pid)
+        return pid, address
+
+    def stop_server(self, pid):
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            return
+        os.waitpid(pid, 0)
+
+    def check_server(self, **kw):
+        pid, address = self.start_server(**kw)
+        worker = self.get_pid(address)
+        self.assertNotEqual(worker, pid)
+
+        # a worker which crashed is restarted
+        os.kill(worker, signal.SIGKILL)
+        worker2 = self.wait_new_pid(address, (worker,))
+
+        # reload starts new workers
+        os.kill(pid, signal.SIGHUP)
+        worker3 = self.wait_new_pid(address, (worker, worker2))
+
+        os.kill(pid, signal.SIGTERM)
+        self.assertEqual(os.waitpid(pid, 0), (pid, 0))
+        # the supervisor waited for its workers
+        self.assertRaises(OSError, os.kill, worker3, 0)
+
+    def test_prefork(self):
+        self.check_server()
+
+    @unittest.skipUnless(hasattr(eventlet.patcher.original('socket'),
+                                 'SO_REUSEPORT'),
+                         'need SO_REUSEPORT')
+    def test_reuse_port(self):
+        self.check_server(reuse_port=True)
+
+
+class HubDrivenEventletTests(EventletTests):
+    hub_driven = True
+
+    def test_hub_driven(self):
+        result = []
+
+        def func():
+            result.append(eventlet.getcurrent() is self.loop._hub.greenlet)
+            self.loop.stop()
+
+        self.loop.call_later(0.001, func)
+        self.loop.run_forever()
+        self.assertEqual(result, [True])
+
+
+class HubDrivenLinkFutureTests(LinkFutureTests):
+    hub_driven = True
+
+
+class HubDrivenWrapGreenthreadTests(WrapGreenthreadTests):
+    hub_driven = True
+
+
+class HubDrivenStatsTests(StatsTests):
+    hub_driven = True
+
+
+class HubDrivenProfilerTests(ProfilerTests):
+    hub_driven = True
+
+
+class HubDrivenCpuAccountingTests(CpuAccountingTests):
+    hub_driven = True
+
+
+class HubTimerEventletTests(EventletTests):
+    timer_backend = 'hub'
+
+    def test_call_later(self):
+        result = []
+        self.loop.call_later(0.002, result.append, 2)
+        self.loop.call_later(0.001, result.append, 1)
+        handle = self.loop.call_later(0.001, result.append, 'cancelled')
+        self.loop.call_later(0.003, self.loop.stop)
+        # handles are not stored in the heap of asyncio
+        self.assertEqual(len(self.loop._scheduled), 0)
+        handle.cancel()
+        self.assertTrue(handle.called)
+
+        self.loop.run_forever()
+        self.assertEqual(result, [1, 2])
+
+    def test_close(self):
+        hub = self.loop._hub
+        handles = [self.loop.call_later(3600, int) for _ in range(1000)]
+        self.assertEqual(self.loop.get_stats()['scheduled_timers'], 1000)
+        handles[0].cancel()
+        self.assertEqual(self.loop.get_stats()['scheduled_timers'], 999)
+
+        self.loop.close()
+        self.assertTrue(all(handle._cancelled for handle in handles))
+        self.assertEqual(self.loop.get_stats()['scheduled_timers'], 0)
+        # the handles are removed from the heap of the hub
+        timers = [timer for when, timer in hub.timers + hub.next_timers
+                  if isinstance(timer, aioeventlet._HubTimerHandle)]
+        self.assertEqual(timers, [])
+
+    def test_invalid_backend(self):
+        self.assertRaises(ValueError, aioeventlet.EventLoop,
+                          timer_backend='wheel')
+
+
+class HubTimerLinkFutureTests(LinkFutureTests):
+    timer_backend = 'hub'
+
+
+class HubTimerTimerSlackTests(TimerSlackTests):
+    timer_backend = 'hub'
+
+
+class HubDrivenHubTimerEventletTests(HubTimerEventletTests):
+    hub_driven = True
+
+
 if __name__ == '__main__':
     import unittest
     unittest.main()